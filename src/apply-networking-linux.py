@@ -13,22 +13,36 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import argparse
 import base64
+import codecs
+import copy
 import errno
+import hashlib
+import io
 import json
 import os
-import platform
+import select
+import signal
+import socket
+import stat
 import string
+import struct
 import subprocess
 import sys
 import syslog
+import tempfile
+import threading
 import time
+import uuid
 
-NET_RENDERERS = ["eni", "sysconfig", "netplan"]
+NET_RENDERERS = ["eni", "sysconfig", "netplan", "networkd", "networkmanager"]
 
 ENI_DISABLE_DAD = """
-pre-up echo 0 > /proc/sys/net/ipv6/conf/$name/accept_dad
-"""
+    pre-up echo 0 > /proc/sys/net/ipv6/conf/$name/accept_dad || true"""
+ENI_OPTIMISTIC_DAD = """
+    pre-up echo 1 > /proc/sys/net/ipv6/conf/$name/optimistic_dad || true
+    pre-up echo 1 > /proc/sys/net/ipv6/conf/$name/use_optimistic || true"""
 ENI_INTERFACE_HEADER = """
 # Injected by CLOUD MANAGER
 #     DO NOT EDIT THIS FILE BY HAND -- YOUR CHANGES WILL BE OVERWRITTEN
@@ -40,7 +54,7 @@ iface $name$index inet$family $type
     address $address$mtu
     netmask $netmask
     gateway $gateway
-    dns-nameservers $dns
+    dns-nameservers $dns$dad
 """
 ENI_DEBIAN_BUSTER_INTERFACE_STATIC_TEMPLATE = """
 auto $name$index
@@ -50,7 +64,7 @@ iface $name$index inet$family $type
     netmask $netmask
     dns-nameservers $dns
     post-up route add -A inet$family default gw $gateway || true
-    pre-down route del -A inet$family default gw $gateway || true$routes
+    pre-down route del -A inet$family default gw $gateway || true$routes$dad
 """
 ENI_INTERFACE_DEFAULT_TEMPLATE = """
 auto $name$index
@@ -60,7 +74,34 @@ ENI_ROUTE_TEMPLATE = """
     post-up route add -net $network netmask $netmask gw $gateway
     post-down route del -net $network netmask $netmask gw $gateway
 """
+ENI_ROUTE_BATCH_TEMPLATE = """
+    post-up ip -$family -force -batch $routes_file || true
+    pre-down ip -$family -force -batch $routes_del_file || true"""
+ENI_ROUTES_DIR = "/etc/network/openstack-routes"
 SYS_CLASS_NET = "/sys/class/net/"
+SYSCTL_DAD_CONFIG_FILE = "/etc/sysctl.d/60-openstack-networkd-dad.conf"
+PROC_SYS = "/proc/sys/"
+METADATA_IP = "169.254.169.254"
+# The routes owned by the kernel, the DHCP clients and the IPv6 RAs
+DYNAMIC_ROUTE_PROTOS = ("kernel", "dhcp", "ra")
+NETWORK_DATA_CHUNK_SIZE = 64 * 1024
+PLAN_CACHE_DIR = "/var/lib/openstack-networkd/plans"
+PLAN_CACHE_SIZE = 32
+APPLIED_STATE_FILE = "/var/lib/openstack-networkd/applied.json"
+DETECTION_CACHE_FILE = "/var/lib/openstack-networkd/detection.json"
+OS_RELEASE_FILES = ["/etc/os-release", "/usr/lib/os-release"]
+# CentOS 6 has no os-release
+REDHAT_RELEASE_FILE = "/etc/redhat-release"
+BOOT_ID_FILE = "/proc/sys/kernel/random/boot_id"
+RESOLV_CONF = "/etc/resolv.conf"
+# The glibc resolver uses only the first 3 nameservers
+RESOLV_CONF_MAX_NAMESERVERS = 3
+# Found in the header comments of the resolv.conf files generated by the
+# resolver managers, which would overwrite the file
+RESOLV_CONF_MANAGERS = ["resolvconf", "systemd-resolved", "NetworkManager",
+                        "netconfig"]
+CONFIG_DRIVE_LABELS = ["config-2", "CONFIG-2"]
+CONFIG_DRIVE_NETWORK_DATA = "openstack/latest/network_data.json"
 
 EXAMPLE_JSON_METADATA = """
 {
@@ -154,17 +195,575 @@ PREFIX$index=$prefix
 IPADDR$index=$address
 """
 
+NETWORKD_HEADER = """# Injected by CLOUD MANAGER
+#     DO NOT EDIT THIS FILE BY HAND -- YOUR CHANGES WILL BE OVERWRITTEN
+"""
+
+NETWORKD_LINK_TEMPLATE = """
+[Match]
+MACAddress=$mac_address
+
+[Link]
+Name=$name
+MTUBytes=$mtu
+"""
+
+NETWORKD_NETWORK_TEMPLATE = """
+[Match]
+MACAddress=$mac_address
+Name=$name
+
+[Link]
+MTUBytes=$mtu
+
+[Network]
+DHCP=$dhcp
+$dad$dns$addresses$routes"""
+
+NETWORKD_ROUTE_TEMPLATE = """
+[Route]
+Destination=$destination
+Gateway=$gateway
+"""
+
+NM_CONNECTION_TEMPLATE = """# Injected by CLOUD MANAGER
+#     DO NOT EDIT THIS FILE BY HAND -- YOUR CHANGES WILL BE OVERWRITTEN
+
+[connection]
+id=$id
+uuid=$uuid
+type=ethernet
+interface-name=$name
+autoconnect=true
+autoconnect-priority=100
+
+[ethernet]
+mac-address=$mac_address
+mtu=$mtu
+
+[ipv4]
+method=$ipv4_method
+$ipv4
+[ipv6]
+method=$ipv6_method
+$ipv6"""
+
+NETWORKD_DHCP_TEMPLATE = """
+[Match]
+Name=$name
+
+[Network]
+DHCP=$dhcp
+"""
+
+DHCP_BACKENDS = ["dhclient", "networkd"]
+DHCP_TIMEOUT = 30
+DHCP_POLL_INTERVAL = 0.2
+DHCLIENT_PID_FILE = "/run/dhclient-openstack%s.%s.pid"
+# Used by the networkd DHCP backend, part of the plan
+NETWORKD_DHCP_DIR = "/run/systemd/network"
+NETWORKD_DHCP_PREFIX = "06-openstack-dhcp-"
+
+# Ordered from the least to the most strict, the strictest mode set on the
+# networks of a link is used for the link wide settings
+IPV6_DAD_MODES = ["enabled", "optimistic", "disabled"]
+IPV6_DAD_TIMEOUT = 10
+
+LINK_READY_TIMEOUT = 10
+
+# Time budget of an event, from the network data read to the last wait
+EVENT_DEADLINE = 120
+
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+RTMGRP_IPV6_IFADDR = 0x100
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+RTM_NEWLINK = 16
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+IFA_ADDRESS = 1
+IFA_FLAGS = 8
+IFA_F_OPTIMISTIC = 0x04
+IFA_F_DADFAILED = 0x08
+IFA_F_TENTATIVE = 0x40
+IFF_UP = 0x1
+IFF_LOWER_UP = 0x10000
+
 SUPPORTED_NETWORK_TYPES = ["ipv4", "ipv6", "ipv4_dhcp", "ipv6_dhcp"]
 
 
-class DebianInterfacesDistro(object):
+# Deadline and DeadlineExceeded are the reference of the copies in
+# cloud_init_apply_net.py, which is installed alone and cannot import this
+# script. Keep them in sync, tests/test_deadline.py checks it.
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline(object):
+    """Time budget of an event, shared by all its stages
+
+    The commands and the waits take their timeouts from the remaining
+    time, the retries are scheduled only if they fit in it. The current
+    and the longest stages are reported when the time is used up.
+    """
+
+    def __init__(self, timeout=EVENT_DEADLINE):
+        self.timeout = timeout
+        self.end_time = time.time() + timeout
+        self.stage = "start"
+        self.stage_start_time = time.time()
+        # [(stage, seconds)] of the completed stages
+        self.stages = []
+
+    def start_stage(self, stage):
+        now = time.time()
+        self.stages.append((self.stage, now - self.stage_start_time))
+        self.stage = stage
+        self.stage_start_time = now
+
+    def remaining(self):
+        return max(self.end_time - time.time(), 0)
+
+    def get_timeout(self, timeout):
+        """Return the timeout, capped to the remaining time"""
+        return min(timeout, self.remaining())
+
+    def check(self, action=None):
+        if not self.remaining():
+            raise self.exceeded(action)
+
+    def exceeded(self, action=None):
+        msg = "The %ss deadline was used up in stage %s" % (
+            self.timeout, self.stage)
+        if action:
+            msg += ", while %s" % action
+        stages = self.stages + [(self.stage,
+                                 time.time() - self.stage_start_time)]
+        stage, seconds = max(stages, key=lambda stage_info: stage_info[1])
+        msg += " (longest stage: %s, %.1fs)" % (stage, seconds)
+        return DeadlineExceeded(msg)
+
+
+class NetlinkRoute(object):
+    """Minimal rtnetlink client, used to wait for kernel events"""
+
+    NLMSG_HEADER = "=LHHLL"
+
+    def __init__(self, groups=0):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                  NETLINK_ROUTE)
+        self.sock.bind((0, groups))
+        self.seq = 0
+
+    def close(self):
+        self.sock.close()
+
+    def request_dump(self, msg_type, family=socket.AF_UNSPEC):
+        """Request the kernel to send the current objects, like events"""
+        self.seq += 1
+        payload = struct.pack("=Bxxx", family)
+        header = struct.pack(self.NLMSG_HEADER,
+                             struct.calcsize(self.NLMSG_HEADER) + len(payload),
+                             msg_type, NLM_F_REQUEST | NLM_F_DUMP, self.seq, 0)
+        self.sock.send(header + payload)
+
+    def receive(self, timeout):
+        """Return the received messages as [(msg_type, payload)]
+
+        Returns an empty list if no message arrived within the timeout.
+        """
+        readable, _, _ = select.select([self.sock], [], [], max(timeout, 0))
+        if not readable:
+            return []
+
+        data = self.sock.recv(65536)
+        header_len = struct.calcsize(self.NLMSG_HEADER)
+        messages = []
+        offset = 0
+        while offset + header_len <= len(data):
+            msg_len, msg_type, _, _, _ = struct.unpack_from(
+                self.NLMSG_HEADER, data, offset)
+            if msg_len < header_len:
+                break
+            if msg_type not in (NLMSG_ERROR, NLMSG_DONE):
+                messages.append(
+                    (msg_type, data[offset + header_len:offset + msg_len]))
+            offset += (msg_len + 3) & ~3
+        return messages
+
+    @staticmethod
+    def parse_attributes(data, offset):
+        attributes = {}
+        while offset + 4 <= len(data):
+            attr_len, attr_type = struct.unpack_from("=HH", data, offset)
+            if attr_len < 4:
+                break
+            attributes[attr_type] = data[offset + 4:offset + attr_len]
+            offset += (attr_len + 3) & ~3
+        return attributes
+
+    @staticmethod
+    def parse_link(payload):
+        """Return (ifindex, flags) from a RTM_NEWLINK"""
+        _, _, ifindex, flags, _ = struct.unpack_from("=BxHiII", payload)
+        return ifindex, flags
+
+    @classmethod
+    def parse_address(cls, payload):
+        """Return (family, ifindex, address, flags) from a RTM_NEWADDR"""
+        family, _, flags, _, ifindex = struct.unpack_from("=BBBBL", payload)
+        attributes = cls.parse_attributes(payload, 8)
+        if IFA_FLAGS in attributes:
+            flags = struct.unpack("=L", attributes[IFA_FLAGS][:4])[0]
+        return family, ifindex, attributes.get(IFA_ADDRESS), flags
+
+
+class LinkStateWatcher(object):
+    """Tracks which links are up and have a carrier
+
+    The state changes are received as netlink RTM_NEWLINK notifications,
+    the current state is requested after the subscription, so that no
+    change is missed.
+    """
 
     def __init__(self):
+        self.netlink = NetlinkRoute(RTMGRP_LINK)
+        self.ready = set()
+        self.netlink.request_dump(RTM_GETLINK)
+
+    def close(self):
+        self.netlink.close()
+
+    def _receive(self, timeout):
+        for msg_type, payload in self.netlink.receive(timeout):
+            if msg_type != RTM_NEWLINK:
+                continue
+            ifindex, flags = NetlinkRoute.parse_link(payload)
+            if flags & IFF_UP and flags & IFF_LOWER_UP:
+                self.ready.add(ifindex)
+            else:
+                self.ready.discard(ifindex)
+
+    def wait(self, ifindex, deadline):
+        """Wait for the link to be ready, returns False on timeout"""
+        # Process the pending notifications first
+        self._receive(0)
+        while ifindex not in self.ready:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            self._receive(remaining)
+        return True
+
+
+class DhcpClient(object):
+    """Acquires the DHCP leases of multiple links in parallel
+
+    The DHCP clients are started without waiting for a lease. The leases
+    of all the links are then awaited with a single deadline, set when the
+    first client is started.
+    """
+
+    def __init__(self, backend="dhclient", timeout=DHCP_TIMEOUT,
+                 execute=None, max_end_time=None):
+        if backend not in DHCP_BACKENDS:
+            raise Exception("DHCP backend %s not supported" % backend)
+        self.backend = backend
+        self.timeout = timeout
+        self.execute = execute or execute_process
+        # The leases are not awaited past the end of the event budget
+        self.max_end_time = max_end_time
+        self.deadline = None
+        self.networkd_links = []
+        # (link, family) => lease addresses present before the DHCP start
+        self.pending = {}
+        self.leases = {}
+
+    def watch(self, link, family):
+        """Wait for the lease of a DHCP client started by someone else"""
+        if self.deadline is None:
+            self.deadline = time.time() + self.timeout
+            if self.max_end_time is not None:
+                self.deadline = min(self.deadline, self.max_end_time)
+        self.pending[(link, family)] = self._get_lease_addresses(link,
+                                                                 family)
+
+    def start(self, link, family):
+        LOG("Starting DHCP (ipv%s) for %s using %s" % (family, link,
+                                                       self.backend))
+        self.watch(link, family)
+        if self.backend == "dhclient":
+            self._start_dhclient(link, family)
+        else:
+            self.networkd_links.append((link, family))
+
+    def _start_dhclient(self, link, family):
+        dhclient_cmd = ["dhclient"]
+        pid_file = DHCLIENT_PID_FILE % ("", link)
+        if family == "6":
+            dhclient_cmd += ["-6"]
+            pid_file = DHCLIENT_PID_FILE % ("6", link)
+
+        # Stop the client started by a previous run for the same link
+        self.execute(dhclient_cmd + ["-x", "-pf", pid_file, link],
+                     shell=False)
+
+        out, err, exit_code = self.execute(
+            dhclient_cmd + ["-nw", "-pf", pid_file, link], shell=False)
+        if exit_code:
+            LOG("dhclient failed for %s. Err: %s" % (link, err))
+
+    def _start_networkd(self):
+        # The DHCP config files are written with the plan
+        out, err, exit_code = self.execute(["networkctl", "reload"],
+                                           shell=False)
+        if exit_code:
+            raise Exception("networkctl reload failed: %s" % err)
+        reconfigure_cmd = ["networkctl", "reconfigure"]
+        reconfigure_cmd += sorted(set(
+            link for link, _ in self.networkd_links))
+        out, err, exit_code = self.execute(reconfigure_cmd, shell=False)
+        if exit_code:
+            raise Exception("Links could not be reconfigured: %s" % err)
+        self.networkd_links = []
+
+    def _get_lease_addresses(self, link, family):
+        timeout = None
+        if self.max_end_time is not None:
+            timeout = max(self.max_end_time - time.time(), 0)
+        return get_link_lease_addresses(link, family, timeout=timeout)
+
+    def _has_lease(self, link, family, start_addresses):
+        """Check for a new lease address, or a renewed lease lifetime
+
+        The lease addresses present before the DHCP start, for example
+        from a previous run, are not leases unless their lifetime grows.
+        """
+        addresses = self._get_lease_addresses(link, family)
+        for address, valid_lft in addresses.items():
+            if address not in start_addresses:
+                return True
+            start_valid_lft = start_addresses[address]
+            if (valid_lft is not None and start_valid_lft is not None and
+                    valid_lft > start_valid_lft):
+                return True
+        return False
+
+    def wait(self):
+        """Wait for the leases until the deadline
+
+        Returns the (link, family) pairs that did not get a lease.
+        """
+        if self.networkd_links:
+            self._start_networkd()
+
+        while self.pending:
+            for (link, family), start_addresses in list(self.pending.items()):
+                if self._has_lease(link, family, start_addresses):
+                    LOG("DHCP (ipv%s) lease acquired for %s" % (family, link))
+                    self.leases[(link, family)] = True
+                    del self.pending[(link, family)]
+            if not self.pending or time.time() >= self.deadline:
+                break
+            time.sleep(DHCP_POLL_INTERVAL)
+
+        no_leases = sorted(self.pending.keys())
+        for link, family in no_leases:
+            LOG("No DHCP (ipv%s) lease for %s within %s seconds" % (
+                family, link, self.timeout))
+            self.leases[(link, family)] = False
+        self.pending = {}
+        return no_leases
+
+
+class ConfigFileWriter(object):
+    """Writes the config files of a run, only the changed ones
+
+    The files are collected first and compared to their current content.
+    Each changed file is written to a temporary file renamed over the old
+    one, so that a crash never leaves a partial config file. The
+    directories are synced once, after all the renames.
+    """
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.files = []
+        self.removals = []
+        self.written_files = []
+        self.removed_files = []
+
+    def add(self, config_file_path, content, mode=None):
+        self.files.append((config_file_path, content, mode))
+
+    def remove(self, config_file_path):
+        self.removals.append(config_file_path)
+
+    def commit(self):
+        """Returns the set of the written and removed config files"""
+        config_dirs = set()
+        for config_file_path, content, mode in self.files:
+            if read_config_file(config_file_path) == content:
+                LOG("Config %s has not changed" % config_file_path)
+                continue
+            self.written_files.append(config_file_path)
+            if self.dry_run:
+                LOG("Dry run, config for %s:\n%s" % (config_file_path,
+                                                     content))
+                continue
+            config_dir = os.path.dirname(config_file_path)
+            if not os.path.isdir(config_dir):
+                os.makedirs(config_dir)
+            LOG("Writing config to %s" % config_file_path)
+            write_file_atomic(config_file_path, content, mode=mode)
+            config_dirs.add(config_dir)
+
+        for config_file_path in self.removals:
+            if (not os.path.exists(config_file_path) or
+                    config_file_path in self.removed_files):
+                continue
+            remove_config_file(config_file_path, dry_run=self.dry_run)
+            self.removed_files.append(config_file_path)
+            config_dirs.add(os.path.dirname(config_file_path))
+
+        if not self.dry_run:
+            for config_dir in sorted(config_dirs):
+                sync_dir(config_dir)
+        return set(self.written_files + self.removed_files)
+
+
+class DebianInterfacesDistro(object):
+
+    # The ENI static templates set a default gateway for each network
+    requires_gateway = True
+    # The DHCP networks are acquired with DhcpClient.start
+    starts_dhcp_clients = True
+
+    def __init__(self, dry_run=False, dhcp_backend="dhclient",
+                 dhcp_timeout=DHCP_TIMEOUT, ipv6_dad="enabled",
+                 ipv6_dad_timeout=IPV6_DAD_TIMEOUT, eni_route_batch=False,
+                 link_timeout=LINK_READY_TIMEOUT, root="/", deadline=None):
+        self.dry_run = dry_run
+        self.deadline = deadline or Deadline()
+        self.link_timeout = link_timeout
+        # The config files are written relative to root
+        self.root = root
+        # [(step, seconds)], reported at the end of the run
+        self.timings = []
+        # Commands and sysctls run to apply the config
+        self.ops = []
+        # DHCP family => links that did not get a lease
+        self.no_dhcp_leases = {}
+        self.written_config_files = []
+        self.deleted_config_files = []
+        self.dhcp_backend = dhcp_backend
+        self.dhcp_timeout = dhcp_timeout
+        self.ipv6_dad = ipv6_dad
+        self.ipv6_dad_timeout = ipv6_dad_timeout
+        self.eni_route_batch = eni_route_batch
+        self.sysctl_dad_config_file = SYSCTL_DAD_CONFIG_FILE
         self.config_file = "/etc/network/interfaces"
+        self.routes_dir = ENI_ROUTES_DIR
         self.default_template = ENI_INTERFACE_DEFAULT_TEMPLATE
         self.static_template = ENI_DEBIAN_BUSTER_INTERFACE_STATIC_TEMPLATE
-
-    def set_network_config_file(self, network_data, reset_to_dhcp=False):
+        # MAC address => interface name, set when compiling a plan
+        self.interfaces = None
+        self.config_files = []
+        self.config_cleanup = []
+        self.sysctl_config = None
+        self.removed_files = []
+        self.changed_links = []
+        self.removed_config_files = []
+        self.config_changed = False
+
+    def start_step(self, step):
+        """Return the start time of the step, reported on deadline"""
+        self.deadline.start_stage(step)
+        return time.time()
+
+    def record_timing(self, step, start_time):
+        self.timings.append((step, time.time() - start_time))
+
+    def _wait_for_dhcp_leases(self, dhcp_client):
+        for link, family in dhcp_client.wait():
+            self.no_dhcp_leases.setdefault(family, []).append(link)
+
+    def _execute_process(self, args, **kwargs):
+        action = "running %s" % " ".join(str(arg) for arg in args)
+        self.deadline.check(action)
+        try:
+            out, err, exit_code = execute_process(
+                args, timeout=self.deadline.remaining(), **kwargs)
+        except DeadlineExceeded:
+            raise self.deadline.exceeded(action)
+        self.ops.append({
+            "cmd": [str(arg) for arg in args],
+            "exit_code": exit_code,
+        })
+        return out, err, exit_code
+
+    def _set_sysctl(self, key, value):
+        set_sysctl(key, value)
+        self.ops.append({"sysctl": key, "value": value})
+
+    def _get_root_path(self, path):
+        if not self.root or self.root == "/":
+            return path
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def can_apply(self, apply=True):
+        """Whether the config files can be applied to the running system
+
+        The config files of another root do not describe this host.
+        """
+        return bool(apply and not self.dry_run and
+                    self.root in (None, "", "/"))
+
+    def _get_link_name(self, link):
+        mac_address = link["ethernet_mac_address"]
+        if self.interfaces is not None:
+            return self.interfaces.get(mac_address)
+        return get_os_net_interface_by_mac(mac_address)
+
+    def _render_config_file(self, config_file_path, content, mode=None,
+                            link=None):
+        """Add a config file to the plan
+
+        The link is reconfigured when the config file content changes.
+        """
+        self.config_files.append({
+            "path": config_file_path,
+            "content": content,
+            "mode": mode,
+            "link": link,
+        })
+
+    def _render_dhcp_config(self, links, link_configs):
+        """Add the config files of the networkd DHCP backend to the plan"""
+        # Also drops the files of a previous run using the networkd backend
+        self.config_cleanup.append((NETWORKD_DHCP_DIR, NETWORKD_DHCP_PREFIX))
+        if not self.starts_dhcp_clients or self.dhcp_backend != "networkd":
+            return
+
+        for link in links:
+            families = link_configs[link["id"]]["dhcp"]
+            if not families:
+                continue
+            dhcp = "yes"
+            if len(families) == 1:
+                dhcp = "ipv%s" % families[0]
+            self._render_config_file(
+                os.path.join(NETWORKD_DHCP_DIR, "%s%s.network" % (
+                    NETWORKD_DHCP_PREFIX, link["name"])),
+                NETWORKD_HEADER + format_template(NETWORKD_DHCP_TEMPLATE, {
+                    "name": link["name"],
+                    "dhcp": dhcp,
+                }), link=link["name"])
+
+    def render_network_config(self, network_data, reset_to_dhcp=False):
         template_string = ENI_INTERFACE_HEADER + "\n"
         lo_data = {
             "name": "lo",
@@ -177,13 +776,11 @@ class DebianInterfacesDistro(object):
 
         links = {}
         for link in network_data["links"]:
-            os_link_name = get_os_net_interface_by_mac(
-                link["ethernet_mac_address"])
+            os_link_name = self._get_link_name(link)
             if not os_link_name:
                 raise Exception(
                     "Link could not be found " + link["ethernet_mac_address"])
-            link["os_link_name"] = os_link_name
-            links[link["id"]] = link
+            links[link["id"]] = dict(link, os_link_name=os_link_name)
 
         interface_indexes = {}
         for network in network_data["networks"]:
@@ -220,11 +817,16 @@ class DebianInterfacesDistro(object):
                 interface_indexes[interface_index_id] = interface_index + 1
                 gateway = None
                 routes = ""
+                batch_routes = []
                 for route in network["routes"]:
                     route_gateway = route["gateway"]
                     prefixlen = str(mask_to_net_prefix(str(route["netmask"])))
                     if prefixlen == "0":
                         gateway = route_gateway
+                    elif self.eni_route_batch:
+                        batch_routes.append("%s/%s via %s dev %s" % (
+                            route["network"], prefixlen, route_gateway,
+                            os_link_name))
                     else:
                         route_dict = {
                             "gateway": route["gateway"],
@@ -238,14 +840,27 @@ class DebianInterfacesDistro(object):
                 if not gateway:
                     raise Exception("No gateways have been found")
 
+                if batch_routes:
+                    routes = self._render_route_batch_files(
+                        os_link_name + interface_index_str, family,
+                        batch_routes)
+
                 dns = []
                 for service in network["services"]:
                     if str(service["type"]) == "dns":
                         dns += [service["address"]]
 
                 netmask = network["netmask"]
+                dad = ""
                 if family == "6":
                     netmask = str(mask_to_net_prefix(str(netmask)))
+                    dad_mode = get_ipv6_dad_mode(network, self.ipv6_dad)
+                    if dad_mode == "disabled":
+                        dad = format_template(ENI_DISABLE_DAD,
+                                              {"name": os_link_name})
+                    elif dad_mode == "optimistic":
+                        dad = format_template(ENI_OPTIMISTIC_DAD,
+                                              {"name": os_link_name})
 
                 template_network_data = {
                     "index": interface_index_str,
@@ -258,7 +873,8 @@ class DebianInterfacesDistro(object):
                     "netmask": netmask,
                     "gateway": gateway,
                     "routes": routes.rstrip(),
-                    "dns": " ".join(dns)
+                    "dns": " ".join(dns),
+                    "dad": dad
                 }
                 template_string += format_template(self.static_template,
                                                    template_network_data)
@@ -277,145 +893,902 @@ class DebianInterfacesDistro(object):
             LOG("Setting network %s to %s" % (network["id"], net_type))
             template_string += "\n"
 
-        LOG("Writing config to %s" % self.config_file)
-        with open(self.config_file, 'w') as config_file:
-            config_file.write(template_string)
+        self._render_config_file(self.config_file, template_string)
+        # Also removes the route batch files when the batching is disabled
+        self.config_cleanup.append((self.routes_dir, ""))
+
+    def _render_route_batch_files(self, interface_name, family, routes):
+        """Render the extra routes of an interface as "ip -batch" files
+
+        ifupdown runs a single "ip" command for all the routes, instead of
+        a "route" command per route. Returns the interface hooks.
+        """
+        routes_file = os.path.join(
+            self.routes_dir, "%s.inet%s" % (interface_name, family))
+        routes_del_file = routes_file + ".del"
+        self._render_config_file(
+            routes_file, "".join("route replace %s\n" % route
+                                 for route in routes))
+        self._render_config_file(
+            routes_del_file, "".join("route del %s\n" % route
+                                     for route in routes))
+        return format_template(ENI_ROUTE_BATCH_TEMPLATE, {
+            "family": family or "4",
+            "routes_file": routes_file,
+            "routes_del_file": routes_del_file,
+        })
+
+    def _get_ipv6_dad_modes(self, network_data):
+        """Return the IPv6 DAD mode of each link with IPv6 networks"""
+        dad_modes = {}
+        for network in network_data["networks"]:
+            if "ipv6" not in str(network["type"]):
+                continue
+            os_link_name = self._get_device_for_link(network_data,
+                                                     network["link"])
+            dad_mode = get_ipv6_dad_mode(network, self.ipv6_dad)
+            link_dad_mode = dad_modes.get(os_link_name, IPV6_DAD_MODES[0])
+            if (IPV6_DAD_MODES.index(dad_mode) >
+                    IPV6_DAD_MODES.index(link_dad_mode)):
+                link_dad_mode = dad_mode
+            dad_modes[os_link_name] = link_dad_mode
+        return dad_modes
+
+    def _render_ipv6_dad_sysctl_config(self, network_data):
+        """Persist the IPv6 DAD settings for the renderers without them
+
+        The sysctl.d settings are applied by systemd-sysctl when the
+        network device is added.
+        """
+        sysctl_config = ""
+        dad_modes = self._get_ipv6_dad_modes(network_data)
+        for os_link_name in sorted(dad_modes.keys()):
+            if dad_modes[os_link_name] == "enabled":
+                continue
+            for key, value in get_ipv6_dad_sysctls(os_link_name,
+                                                   dad_modes[os_link_name]):
+                sysctl_config += "%s = %s\n" % (key, value)
+
+        self.sysctl_config = ""
+        if sysctl_config:
+            self.sysctl_config = NETWORKD_HEADER + sysctl_config
+
+    def _write_ipv6_dad_sysctl_config(self, plan, writer):
+        if plan["sysctl_config"] is None:
+            # The renderer sets the IPv6 DAD natively
+            return
+        sysctl_config_file = self._get_root_path(self.sysctl_dad_config_file)
+        if plan["sysctl_config"]:
+            writer.add(sysctl_config_file, plan["sysctl_config"])
+        else:
+            writer.remove(sysctl_config_file)
+
+    def _set_ipv6_dad_sysctls(self, plan):
+        for os_link_name, dad_mode in plan["ipv6_dad_modes"].items():
+            for key, value in get_ipv6_dad_sysctls(os_link_name, dad_mode):
+                self._set_sysctl(key, value)
+
+    def _get_ipv6_static_addresses(self, network_data):
+        """Return the static IPv6 addresses as [(link, address)]"""
+        addresses = []
+        for network in network_data["networks"]:
+            if str(network["type"]) != "ipv6":
+                continue
+            os_link_name = self._get_device_for_link(network_data,
+                                                     network["link"])
+            addresses.append((os_link_name, network["ip_address"]))
+        return addresses
+
+    def _wait_for_ipv6_addresses(self, addresses):
+        """Returns the addresses not ready, including the DAD failures"""
+        not_ready, dad_failed = wait_for_ipv6_addresses(
+            addresses, self.deadline.get_timeout(self.ipv6_dad_timeout))
+        for os_link_name, address in not_ready:
+            LOG("IPv6 address %s on %s is not ready after %s seconds" % (
+                address, os_link_name, self.ipv6_dad_timeout))
+        for os_link_name, address in dad_failed:
+            LOG("IPv6 address %s on %s is a duplicate, not usable" % (
+                address, os_link_name))
+        return sorted(not_ready + dad_failed)
+
+    def _get_dns_config(self, network_data, reset_to_dhcp=False):
+        """Return the DNS servers of each link and the global ones
+
+        The global servers come from the top level services.
+        """
+        dns_config = {"links": {}, "global": []}
+        for network in network_data["networks"]:
+            if "dhcp" in str(network["type"]) and not reset_to_dhcp:
+                continue
+            os_link_name = self._get_device_for_link(network_data,
+                                                     network["link"])
+            servers = dns_config["links"].setdefault(os_link_name, [])
+            for server in get_dns_servers(network.get("services", [])):
+                if server not in servers:
+                    servers.append(server)
+        for server in get_dns_servers(network_data.get("services", [])):
+            if server not in dns_config["global"]:
+                dns_config["global"].append(server)
+        return dns_config
+
+    def apply_dns_config(self, plan):
+        """Push the DNS servers to systemd-resolved, or to resolv.conf
+
+        Only the resolver config is changed, the addresses and routes of
+        the links are not touched.
+        """
+        dns_config = plan["dns"]
+        if (not dns_config["global"] and
+                not any(dns_config["links"].values())):
+            LOG("No DNS servers in the network data")
+            return
+
+        self.deadline.check("checking systemd-resolved")
+        if is_service_active("systemd-resolved",
+                             timeout=self.deadline.remaining()):
+            try:
+                # resolved has no runtime global servers, each link gets
+                # them after its own servers
+                for os_link_name in sorted(dns_config["links"].keys()):
+                    servers = list(dns_config["links"][os_link_name])
+                    servers += [server for server in dns_config["global"]
+                                if server not in servers]
+                    if servers:
+                        self._set_link_dns(os_link_name, servers)
+                if not dns_config["links"]:
+                    LOG("The global DNS servers %s are not set: "
+                        "systemd-resolved has no runtime global servers "
+                        "and there is no static link to set them on" %
+                        " ".join(dns_config["global"]))
+                return
+            except OSError as ex:
+                LOG("systemd-resolved tools not found, writing %s: %s" % (
+                    RESOLV_CONF, ex))
+        self._write_resolv_conf(dns_config)
+
+    def _set_link_dns(self, link, servers):
+        LOG("Setting the DNS servers of %s to %s" % (
+            link, " ".join(servers)))
+        try:
+            out, err, exit_code = self._execute_process(
+                ["resolvectl", "dns", link] + servers, shell=False)
+        except OSError:
+            # resolvectl is available from systemd 239
+            set_dns_cmd = ["systemd-resolve", "--interface", link]
+            for server in servers:
+                set_dns_cmd += ["--set-dns", server]
+            out, err, exit_code = self._execute_process(set_dns_cmd,
+                                                        shell=False)
+        if exit_code:
+            raise Exception("DNS servers could not be set for %s: %s" % (
+                link, err))
+
+    def _write_resolv_conf(self, dns_config):
+        """Replace the nameservers of resolv.conf, keeping the other lines
+
+        Only a regular file owned by no resolver manager is written, the
+        managers would overwrite it, for example resolvconf from the ENI
+        dns-nameservers. The file is replaced atomically, the resolver
+        never reads a partial file.
+        """
+        resolv_conf = self._get_root_path(RESOLV_CONF)
+        manager = get_resolv_conf_manager(resolv_conf)
+        if manager:
+            LOG("%s is managed by %s, not writing the DNS servers" % (
+                resolv_conf, manager))
+            return
+
+        servers = []
+        for os_link_name in sorted(dns_config["links"].keys()):
+            servers += [server for server in dns_config["links"][os_link_name]
+                        if server not in servers]
+        servers += [server for server in dns_config["global"]
+                    if server not in servers]
+        if len(servers) > RESOLV_CONF_MAX_NAMESERVERS:
+            LOG("Only the first %d DNS servers are used: %s" % (
+                RESOLV_CONF_MAX_NAMESERVERS, " ".join(servers)))
+
+        lines = []
+        header_lines = NETWORKD_HEADER.splitlines()
+        try:
+            with open(resolv_conf, 'r') as resolv_conf_file:
+                lines = [line for line in resolv_conf_file.read().splitlines()
+                         if line.split()[:1] != ["nameserver"] and
+                         line not in header_lines]
+        except (IOError, OSError) as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+        content = NETWORKD_HEADER
+        content += "".join("nameserver %s\n" % server for server in servers)
+        content += "".join("%s\n" % line for line in lines)
+
+        if write_config_file(resolv_conf, content, mode=0o644,
+                             dry_run=self.dry_run):
+            self.written_config_files.append(resolv_conf)
+
+    def get_applied_links(self, plan):
+        """Return the interface index of each link of the plan
+
+        A link removed and added again gets a new index.
+        """
+        links = {}
+        for link in plan["links"]:
+            try:
+                links[link["name"]] = get_link_index(link["name"])
+            except (IOError, OSError):
+                links[link["name"]] = None
+        return links
+
+    def is_dns_only_change(self, plan):
+        """Check if the plan differs from the applied one only in DNS"""
+        applied_state = load_state_file(
+            self._get_root_path(APPLIED_STATE_FILE))
+        if not applied_state or "network_key" not in plan:
+            return False
+        return (applied_state.get("key") != plan["key"] and
+                applied_state.get("network_key") == plan["network_key"] and
+                applied_state.get("links") == self.get_applied_links(plan))
+
+    def get_installed_config(self, plan):
+        """Return the static addresses and routes of each link of the plan
+
+        These are the only addresses and routes removed as stale by the
+        next plan.
+        """
+        installed_config = {}
+        for link in plan["links"]:
+            link_config = plan["link_configs"][link["id"]]
+            installed_config[link["name"]] = {
+                "addresses": dict(
+                    (family, [normalize_address(address)
+                              for address in addresses])
+                    for family, addresses in
+                    link_config["addresses"].items()),
+                "routes": dict(
+                    (family, [normalize_route_destination(destination)
+                              for destination, _ in routes])
+                    for family, routes in link_config["routes"].items()),
+            }
+        return installed_config
+
+    def save_applied_state(self, plan):
+        save_state_file({
+            "key": plan["key"],
+            "network_key": plan["network_key"],
+            "links": self.get_applied_links(plan),
+            "installed": self.get_installed_config(plan),
+        }, self._get_root_path(APPLIED_STATE_FILE))
 
     def _get_device_for_link(self, network_data, link):
         for n_link in network_data["links"]:
             if n_link["id"] == link:
-                return get_os_net_interface_by_mac(
-                    n_link["ethernet_mac_address"])
+                return self._get_link_name(n_link)
         raise Exception("Could not find device for link %s" % link)
 
+    def validate_network_data(self, network_data):
+        """Check the network data before anything is changed
+
+        All the errors are reported at once.
+        """
+        errors = []
+        if (not isinstance(network_data.get("links"), list) or
+                not isinstance(network_data.get("networks"), list)):
+            raise Exception("Network data has no links or networks list")
+
+        link_ids = set()
+        for link in network_data["links"]:
+            if "id" not in link or "ethernet_mac_address" not in link:
+                errors.append("Link %s has no id or MAC address" % link)
+                continue
+            link_ids.add(link["id"])
+            if not self._get_link_name(link):
+                errors.append(
+                    "Link could not be found " + link["ethernet_mac_address"])
+            try:
+                int(link["mtu"])
+            except (KeyError, TypeError, ValueError):
+                errors.append("Link %s has no valid MTU" % link["id"])
+
+        for network in network_data["networks"]:
+            network_id = network.get("id")
+            if network.get("link") not in link_ids:
+                errors.append("Link not found for net %s" % network_id)
+            network_type = str(network.get("type"))
+            if network_type not in SUPPORTED_NETWORK_TYPES:
+                errors.append("Network type %s not supported for %s" % (
+                    network_type, network_id))
+                continue
+            if "dhcp" in network_type:
+                continue
+
+            try:
+                normalize_address(network["ip_address"])
+                mask_to_net_prefix(str(network["netmask"]))
+                if "ipv6" in network_type:
+                    get_ipv6_dad_mode(network, self.ipv6_dad)
+            except Exception as ex:
+                errors.append("Network %s is not valid: %s" % (network_id,
+                                                               ex))
+                continue
+
+            has_gateway = False
+            for route in network.get("routes", []):
+                try:
+                    normalize_address(route["network"])
+                    normalize_address(route["gateway"])
+                    prefixlen = mask_to_net_prefix(str(route["netmask"]))
+                except Exception as ex:
+                    errors.append("Route %s of network %s is not valid: %s" %
+                                  (route, network_id, ex))
+                    continue
+                if prefixlen == 0:
+                    has_gateway = True
+            if self.requires_gateway and not has_gateway:
+                errors.append("No gateways have been found for %s" %
+                              network_id)
+
+        if errors:
+            raise Exception("Network data is not valid: %s" %
+                            "; ".join(errors))
+
+    def compile_plan(self, network_data, interfaces, reset_to_dhcp=False):
+        """Turn the network data into the config files and kernel config
+
+        The returned plan only holds JSON serializable data, so that it
+        can be cached and applied later without the network data.
+        """
+        self.interfaces = interfaces
+        self.validate_network_data(network_data)
+
+        self.config_files = []
+        self.config_cleanup = []
+        self.sysctl_config = None
+        self.render_network_config(network_data, reset_to_dhcp=reset_to_dhcp)
+
+        links = []
+        for link in network_data["links"]:
+            links.append({
+                "id": link["id"],
+                "name": self._get_link_name(link),
+                "mtu": link["mtu"],
+                "networks": [network["id"] for network
+                             in network_data["networks"]
+                             if network["link"] == link["id"]],
+            })
+
+        link_configs = self._get_link_configs(network_data,
+                                              reset_to_dhcp=reset_to_dhcp)
+        self._render_dhcp_config(links, link_configs)
+
+        return {
+            "renderer": self.__class__.__name__,
+            "config_files": self.config_files,
+            "config_cleanup": self.config_cleanup,
+            "sysctl_config": self.sysctl_config,
+            "links": links,
+            "link_configs": link_configs,
+            "ipv6_dad_modes": self._get_ipv6_dad_modes(network_data),
+            "ipv6_addresses": self._get_ipv6_static_addresses(network_data),
+            "dns": self._get_dns_config(network_data,
+                                        reset_to_dhcp=reset_to_dhcp),
+        }
+
+    def get_plan(self, network_data, reset_to_dhcp=False, use_cache=True):
+        """Return the cached plan of the network data, or compile it"""
+        interfaces = get_os_net_interface_index()
+        plan_input = {
+            "network_data": network_data,
+            "interfaces": interfaces,
+            "renderer": self.__class__.__name__,
+            "reset_to_dhcp": reset_to_dhcp,
+            "ipv6_dad": self.ipv6_dad,
+            "eni_route_batch": self.eni_route_batch,
+            "dhcp_backend": self.dhcp_backend,
+        }
+        key = get_plan_key(plan_input)
+        if use_cache:
+            plan = load_plan(key, self._get_root_path(PLAN_CACHE_DIR))
+            if plan:
+                LOG("Using the cached plan %s" % key)
+                return plan
+
+        plan = self.compile_plan(network_data, interfaces,
+                                 reset_to_dhcp=reset_to_dhcp)
+        plan["key"] = key
+        # Plans differing only in their DNS servers have the same
+        # network_key, they are applied without touching the links
+        plan["network_key"] = get_plan_key(dict(
+            plan_input, network_data=remove_dns_services(network_data)))
+        LOG("Compiled the plan %s" % key)
+        if use_cache and not self.dry_run:
+            save_plan(plan, self._get_root_path(PLAN_CACHE_DIR))
+        return plan
+
+    def write_config_files(self, plan):
+        """Write the config files of the plan
+
+        Records the links whose config has changed and the removed config
+        files. Returns the set of the written and removed config files.
+        """
+        writer = ConfigFileWriter(dry_run=self.dry_run)
+        config_file_links = {}
+        for config_file in plan["config_files"]:
+            config_file_path = self._get_root_path(config_file["path"])
+            config_file_links[config_file_path] = config_file["link"]
+            writer.add(config_file_path, config_file["content"],
+                       mode=config_file["mode"])
+
+        # The config files of a removed link
+        for config_file in plan.get("removed_files", []):
+            writer.remove(self._get_root_path(config_file))
+
+        # Remove the config of the links no longer present in the metadata
+        for config_dir, prefix in plan["config_cleanup"]:
+            config_dir = self._get_root_path(config_dir)
+            for config_file_name in get_dir_files(config_dir):
+                config_file = os.path.join(config_dir, config_file_name)
+                if (config_file_name.startswith(prefix) and
+                        config_file not in config_file_links):
+                    writer.remove(config_file)
+
+        self._write_ipv6_dad_sysctl_config(plan, writer)
+        changed_files = writer.commit()
+
+        # The sysctl file alone does not change the network config
+        sysctl_config_file = self._get_root_path(self.sysctl_dad_config_file)
+        self.written_config_files = writer.written_files
+        self.deleted_config_files = writer.removed_files
+        self.removed_config_files = [
+            config_file for config_file in writer.removed_files
+            if config_file != sysctl_config_file]
+        self.changed_links = []
+        for config_file in writer.written_files:
+            link = config_file_links.get(config_file)
+            if link and link not in self.changed_links:
+                self.changed_links.append(link)
+        self.config_changed = bool(changed_files - set([sysctl_config_file]))
+        return changed_files
+
+    def compile_link_removal(self, link):
+        """Drop a removed link from the current config files
+
+        The config of the other links is kept as it is, so that no network
+        data is needed. Returns a plan to be passed to write_config_files.
+        """
+        self.config_files = []
+        self.config_cleanup = []
+        self.sysctl_config = None
+        self.removed_files = []
+        self._render_link_removal(link)
+        self._render_ipv6_dad_sysctl_removal(link)
+        # Written by the networkd DHCP backend
+        self.removed_files.append(os.path.join(
+            NETWORKD_DHCP_DIR, "%s%s.network" % (NETWORKD_DHCP_PREFIX, link)))
+        return {
+            "renderer": self.__class__.__name__,
+            "link": link,
+            "config_files": self.config_files,
+            "config_cleanup": self.config_cleanup,
+            "removed_files": self.removed_files,
+            "sysctl_config": self.sysctl_config,
+        }
+
+    def _render_link_removal(self, link):
+        """Drop the auto and iface stanzas of the link and its aliases"""
+        config_file_path = self._get_root_path(self.config_file)
+        try:
+            with open(config_file_path, 'r') as config_file:
+                content = config_file.read()
+        except (IOError, OSError) as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            return
+
+        def is_link_interface(name):
+            return name == link or name.startswith(link + ":")
+
+        lines = []
+        skip_stanza = False
+        for line in content.splitlines():
+            tokens = line.split()
+            if not tokens or line[0].isspace():
+                # Stanza options and blank lines belong to the stanza above
+                if not skip_stanza:
+                    lines.append(line)
+                continue
+            skip_stanza = False
+            if tokens[0] == "iface" and is_link_interface(tokens[1]):
+                skip_stanza = True
+                continue
+            if tokens[0] == "auto" or tokens[0].startswith("allow-"):
+                names = [name for name in tokens[1:]
+                         if not is_link_interface(name)]
+                if not names:
+                    continue
+                line = " ".join([tokens[0]] + names)
+            lines.append(line)
+        self._render_config_file(self.config_file,
+                                 "".join("%s\n" % line for line in lines))
+
+        routes_dir = self._get_root_path(self.routes_dir)
+        for routes_file_name in get_dir_files(routes_dir):
+            if is_link_interface(routes_file_name.split(".")[0]):
+                self.removed_files.append(
+                    os.path.join(self.routes_dir, routes_file_name))
+
+    def _render_ipv6_dad_sysctl_removal(self, link):
+        sysctl_config_file = self._get_root_path(self.sysctl_dad_config_file)
+        try:
+            with open(sysctl_config_file, 'r') as sysctl_file:
+                content = sysctl_file.read()
+        except (IOError, OSError) as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            return
+
+        sysctl_config = "".join(
+            "%s\n" % line for line in content.splitlines()
+            if line.strip() and not line.startswith("#") and
+            "/conf/%s/" % link not in line)
+        self.sysctl_config = ""
+        if sysctl_config:
+            self.sysctl_config = NETWORKD_HEADER + sysctl_config
+
+    def apply_link_removal(self, removal):
+        """Remove the state left by the removed link
+
+        The kernel removes the addresses and routes of a deleted device
+        itself, they are flushed only if the device is still present. The
+        other links are not touched.
+        """
+        link = removal["link"]
+        for family in ("", "6"):
+            pid_file = DHCLIENT_PID_FILE % (family, link)
+            if not os.path.exists(pid_file):
+                continue
+            dhclient_cmd = ["dhclient"]
+            if family:
+                dhclient_cmd += ["-6"]
+            self._execute_process(dhclient_cmd + ["-x", "-pf", pid_file,
+                                                  link], shell=False)
+
+        if os.path.exists(os.path.join(SYS_CLASS_NET, link)):
+            for family in ("4", "6"):
+                for flush_cmd in (["ip", "-%s" % family, "addr", "flush",
+                                   "dev", link],
+                                  ["ip", "-%s" % family, "route", "flush",
+                                   "dev", link, "scope", "global"]):
+                    out, err, exit_code = self._execute_process(
+                        flush_cmd, shell=False)
+                    if exit_code:
+                        LOG("Link %s could not be flushed: %s" % (
+                            link, err))
+
     def _set_link_mtu(self, link, mtu):
         LOG("Setting MTU for link %s to %r" % (link, mtu))
         ip_cmd = ["ip", "link", "set", "dev", link, "mtu", mtu]
-        _, err, exit_code = execute_process(ip_cmd, shell=False)
+        _, err, exit_code = self._execute_process(ip_cmd, shell=False)
         if exit_code:
             raise Exception("MTU could not be set: %s" % err)
 
     def _set_link_online(self, link):
         ip_cmd = ["ip", "link", "set", "dev", link, "up"]
-        _, err, exit_code = execute_process(ip_cmd, shell=False)
+        _, err, exit_code = self._execute_process(ip_cmd, shell=False)
         if exit_code:
             raise Exception("MTU could not be set: %s" % err)
 
+    def _wait_for_link_ready(self, link_watcher, link, online_time):
+        """Wait for the link carrier, until link_timeout after link up
+
+        The config is applied anyway on timeout, the kernel accepts the
+        addresses and routes of a link without carrier.
+        """
+        start_time = self.start_step("link %s ready" % link)
+        if not link_watcher.wait(get_link_index(link),
+                                 min(online_time + self.link_timeout,
+                                     self.deadline.end_time)):
+            LOG("Link %s has no carrier after %s seconds" % (
+                link, self.link_timeout))
+        self.record_timing("link %s ready" % link, start_time)
+
     def _flush_nic(self, link):
         for i in ("4", "6"):
             flush_addr_cmd = ["ip", "-%s" % i, "addr", "flush", "dev", link]
-            out, err, exit_code = execute_process(flush_addr_cmd, shell=False)
+            out, err, exit_code = self._execute_process(
+                flush_addr_cmd, shell=False)
             if exit_code:
                 raise Exception("IPs could not be flushed")
 
             flush_route_cmd = ["ip", "-%s" % i, "route", "flush", "dev",
                                link, "scope", "global"]
-            out, err, exit_code = execute_process(flush_route_cmd, shell=False)
+            out, err, exit_code = self._execute_process(
+                flush_route_cmd, shell=False)
             if exit_code:
                 raise Exception("Routes could not be flushed")
 
-    def apply_network_config(self, network_data, reset_to_dhcp=False):
+    def _get_primary_links(self):
+        """Return the links carrying the default and the metadata routes"""
+        primary_links = set()
+        route_cmds = [
+            ["ip", "-4", "route", "show", "default"],
+            ["ip", "-6", "route", "show", "default"],
+            ["ip", "route", "get", METADATA_IP],
+        ]
+        for route_cmd in route_cmds:
+            out, err, exit_code = self._execute_process(route_cmd, shell=False,
+                                                        decode_output=True)
+            if exit_code:
+                # No route, the metadata service is not reachable
+                continue
+            for line in out.splitlines():
+                tokens = line.split()
+                if "dev" in tokens[:-1]:
+                    primary_links.add(tokens[tokens.index("dev") + 1])
+        return primary_links
+
+    def _get_link_routes(self, link, family):
+        route_cmd = ["ip", "-%s" % family, "route", "show", "dev", link]
+        out, err, exit_code = self._execute_process(route_cmd, shell=False,
+                                                    decode_output=True)
+        if exit_code:
+            raise Exception("Routes could not be listed: %s" % err)
+
+        routes = []
+        for line in out.splitlines():
+            tokens = line.split()
+            if not tokens:
+                continue
+            proto = ""
+            if "proto" in tokens[:-1]:
+                proto = tokens[tokens.index("proto") + 1]
+            routes.append((tokens[0], proto))
+        return routes
+
+    def _remove_stale_config(self, link, link_config, installed_config):
+        """Remove the addresses and routes not present in the new config
+
+        Called after the new addresses and routes have been added to the
+        link, so that the link is never left without connectivity. Only
+        the static addresses and routes installed by the previous plan are
+        removed, the DHCP / SLAAC addresses and the kernel / RA / DHCP
+        routes are left untouched.
+        """
+        if not installed_config:
+            LOG("No config was applied on %s, no stale config to remove" %
+                link)
+            return
+
+        # Removing the primary IPv4 address removes the secondary
+        # addresses from the same subnet, unless they get promoted
+        self._set_sysctl("net/ipv4/conf/%s/promote_secondaries" % link, "1")
+
+        for family in ("4", "6"):
+            if family in link_config["dhcp"]:
+                # Leases are owned by the DHCP client
+                continue
+
+            addresses = set(
+                normalize_address(address)
+                for address in link_config["addresses"][family])
+            installed_addresses = set(installed_config["addresses"][family])
+            for address, dynamic in get_link_addresses(
+                    link, family, timeout=self.deadline.remaining()):
+                address = normalize_address(address)
+                if (dynamic or address in addresses or
+                        address not in installed_addresses):
+                    continue
+                LOG("Removing stale address %s from %s" % (address, link))
+                addr_del_cmd = ["ip", "-%s" % family, "addr", "del", address,
+                                "dev", link]
+                out, err, exit_code = self._execute_process(addr_del_cmd,
+                                                            shell=False)
+                if exit_code:
+                    raise Exception("IP could not be removed. Err: %s" % err)
+
+            destinations = set(
+                normalize_route_destination(destination)
+                for destination, _ in link_config["routes"][family])
+            installed_destinations = set(installed_config["routes"][family])
+            for destination, proto in self._get_link_routes(link, family):
+                if proto in DYNAMIC_ROUTE_PROTOS:
+                    continue
+                try:
+                    destination = normalize_route_destination(destination)
+                except (socket.error, ValueError):
+                    # For example an unreachable or a multicast route
+                    continue
+                if (destination in destinations or
+                        destination not in installed_destinations or
+                        destination == METADATA_IP):
+                    continue
+                LOG("Removing stale route %s from %s" % (destination, link))
+                route_del_cmd = ["ip", "-%s" % family, "route", "del",
+                                 destination, "dev", link]
+                out, err, exit_code = self._execute_process(route_del_cmd,
+                                                            shell=False)
+                if exit_code:
+                    LOG("Route %s could not be removed. Err: %s" % (
+                        destination, err))
+
+    def _get_link_configs(self, network_data, reset_to_dhcp=False):
+        link_configs = {}
         for link in network_data["links"]:
-            os_link_name = self._get_device_for_link(network_data, link["id"])
-            if not os_link_name:
-                raise Exception("Link not found for net %s" % link["id"])
-            self._set_link_online(os_link_name)
-            self._set_link_mtu(os_link_name, link["mtu"])
-            self._flush_nic(os_link_name)
+            link_configs[link["id"]] = {
+                "addresses": {"4": [], "6": []},
+                "routes": {"4": [], "6": []},
+                "dhcp": [],
+                "dad": {},
+            }
 
+        # Routes are deduplicated in metadata order, even if the links
+        # are applied in a different order
         route_destinations = set()
         for network in network_data["networks"]:
             os_link_name = self._get_device_for_link(network_data,
                                                      network["link"])
             if not os_link_name:
                 raise Exception("Link not found for net %s" % network["id"])
-            LOG("Apply network " + network["id"] + " for " + os_link_name)
 
-            base_cmd = ["ip"]
-            dhclient_cmd = ["dhclient"]
             network_type = str(network["type"])
             if network_type not in SUPPORTED_NETWORK_TYPES:
                 raise Exception(
                     "Network type %s not supported for %s" % (network_type,
                                                               os_link_name))
 
-            LOG("Network type is %s" % network_type)
-            if network_type == "ipv6":
-                base_cmd += ["-6"]
-                dhclient_cmd += ["-6"]
+            family = "4"
+            if "ipv6" in network_type:
+                family = "6"
 
+            link_config = link_configs[network["link"]]
             if "dhcp" in network_type:
                 if reset_to_dhcp:
-                    dhclient_cmd += [os_link_name]
-                    out, err, exit_code = execute_process(dhclient_cmd,
-                                                          shell=False)
-                    if exit_code:
-                        LOG("dhclient failed for %s. Err: %s" % (os_link_name,
-                                                                 err))
-                # That's all folks!
+                    link_config["dhcp"].append(family)
                 continue
 
-            ip_address = network["ip_address"]
-            ip_netmask = network["netmask"]
-            prefixlen = str(mask_to_net_prefix(str(ip_netmask)))
-            addr_add_cmd = base_cmd + ["addr", "add",
-                                       ip_address + "/" + prefixlen,
-                                       "dev", os_link_name]
-            out, err, exit_code = execute_process(addr_add_cmd, shell=False)
-            if exit_code:
-                raise Exception("IP could not be set. Err: %s" % err)
+            prefixlen = str(mask_to_net_prefix(str(network["netmask"])))
+            address = network["ip_address"] + "/" + prefixlen
+            link_config["addresses"][family].append(address)
+            if family == "6":
+                link_config["dad"][address] = get_ipv6_dad_mode(
+                    network, self.ipv6_dad)
 
             for route in network["routes"]:
-                network_address = route["network"]
-                gateway = route["gateway"]
                 prefixlen = str(mask_to_net_prefix(str(route["netmask"])))
-                destination = network_address + "/" + prefixlen
+                destination = route["network"] + "/" + prefixlen
                 if destination in route_destinations:
                     continue
+                route_destinations.add(destination)
+                link_config["routes"][family].append(
+                    (destination, route["gateway"]))
+        return link_configs
+
+    def _apply_link_config(self, link, link_config, dhcp_client):
+        for family in ("4", "6"):
+            for address in link_config["addresses"][family]:
+                addr_add_cmd = ["ip", "-%s" % family, "addr", "replace",
+                                address, "dev", link]
+                dad_mode = link_config["dad"].get(address)
+                if dad_mode == "disabled":
+                    addr_add_cmd += ["nodad"]
+                elif dad_mode == "optimistic":
+                    addr_add_cmd += ["optimistic"]
+                out, err, exit_code = self._execute_process(addr_add_cmd,
+                                                            shell=False)
+                if exit_code:
+                    raise Exception("IP could not be set. Err: %s" % err)
 
-                route_add_cmd = base_cmd + ["route", "add",
-                                            destination,
-                                            "via", gateway, "dev",
-                                            os_link_name]
-                out, err, exit_code = execute_process(route_add_cmd,
-                                                      shell=False)
+            for destination, gateway in link_config["routes"][family]:
+                route_add_cmd = ["ip", "-%s" % family, "route", "replace",
+                                 destination, "via", gateway, "dev", link]
+                out, err, exit_code = self._execute_process(route_add_cmd,
+                                                            shell=False)
                 if exit_code:
                     raise Exception("Route could not be set. Err: %s" % err)
-                route_destinations.add(destination)
+
+        if link_config["dhcp"] and not self.starts_dhcp_clients:
+            # The leases are acquired by the network service itself
+            LOG("No DHCP client started for link %s" % link)
+            return
+        for family in link_config["dhcp"]:
+            dhcp_client.start(link, family)
+
+    def apply_network_config(self, plan):
+        link_configs = plan["link_configs"]
+
+        # The links carrying the default route and the metadata route are
+        # applied last and without a flush (make before break), so that the
+        # metadata service stays reachable during the hotplug. This depends
+        # on the current routes, so it is not part of the plan.
+        primary_links = self._get_primary_links()
+        links = []
+        for link in plan["links"]:
+            links.append((link["name"] in primary_links, link["name"], link))
+        links.sort(key=lambda link_info: link_info[0])
+
+        # The static config installed by the previous plan
+        applied_state = load_state_file(
+            self._get_root_path(APPLIED_STATE_FILE)) or {}
+        installed_configs = applied_state.get("installed", {})
+
+        dhcp_client = DhcpClient(backend=self.dhcp_backend,
+                                 timeout=self.dhcp_timeout,
+                                 execute=self._execute_process,
+                                 max_end_time=self.deadline.end_time)
+        self._set_ipv6_dad_sysctls(plan)
+
+        # All the links are set up first, so that their carriers come up
+        # in parallel, each link is then configured once it is ready
+        link_watcher = LinkStateWatcher()
+        try:
+            online_times = {}
+            for is_primary, os_link_name, link in links:
+                self._set_link_online(os_link_name)
+                online_times[os_link_name] = time.time()
+
+            for is_primary, os_link_name, link in links:
+                self._wait_for_link_ready(link_watcher, os_link_name,
+                                          online_times[os_link_name])
+                self.start_step("link %s config" % os_link_name)
+                LOG("Apply config for link %s" % os_link_name)
+                self._set_link_mtu(os_link_name, link["mtu"])
+                if not is_primary:
+                    self._flush_nic(os_link_name)
+
+                for network_id in link["networks"]:
+                    LOG("Apply network " + network_id + " for " +
+                        os_link_name)
+                link_config = link_configs[link["id"]]
+                self._apply_link_config(os_link_name, link_config,
+                                        dhcp_client)
+
+                if is_primary:
+                    self._remove_stale_config(
+                        os_link_name, link_config,
+                        installed_configs.get(os_link_name))
+        finally:
+            link_watcher.close()
+
+        # The DHCP clients run in parallel with the static links config
+        start_time = self.start_step("DHCP leases")
+        self._wait_for_dhcp_leases(dhcp_client)
+        self.record_timing("DHCP leases", start_time)
+        start_time = self.start_step("IPv6 addresses ready")
+        self._wait_for_ipv6_addresses(plan["ipv6_addresses"])
+        self.record_timing("IPv6 addresses ready", start_time)
 
 
 class DebianInterfacesd50Distro(DebianInterfacesDistro):
 
-    def __init__(self):
-        super(DebianInterfacesd50Distro, self).__init__()
+    def __init__(self, **kwargs):
+        super(DebianInterfacesd50Distro, self).__init__(**kwargs)
         self.config_file = "/etc/network/interfaces.d/50-cloud-init.cfg"
 
 
 class DebianBusterInterfacesd50Distro(DebianInterfacesDistro):
 
-    def __init__(self):
-        super(DebianBusterInterfacesd50Distro, self).__init__()
+    def __init__(self, **kwargs):
+        super(DebianBusterInterfacesd50Distro, self).__init__(**kwargs)
         self.config_file = "/etc/network/interfaces.d/50-cloud-init"
 
 
 class NetplanDistro(DebianInterfacesDistro):
 
-    def __init__(self):
-        super(NetplanDistro, self).__init__()
+    requires_gateway = False
+
+    def __init__(self, **kwargs):
+        super(NetplanDistro, self).__init__(**kwargs)
         self.config_file = "/etc/netplan/50-cloud-init.yaml"
 
-    def set_network_config_file(self, network_data, reset_to_dhcp=False):
+    def render_network_config(self, network_data, reset_to_dhcp=False):
         ethernets = {}
 
         links = {}
         for link in network_data["links"]:
-            os_link_name = get_os_net_interface_by_mac(
-                link["ethernet_mac_address"])
+            os_link_name = self._get_link_name(link)
             if not os_link_name:
                 raise Exception(
                     "Link could not be found " + link["ethernet_mac_address"])
-            link["os_link_name"] = os_link_name
-            links[link["id"]] = link
+            links[link["id"]] = dict(link, os_link_name=os_link_name)
             ethernets[os_link_name] = {
                 "addresses": [],
                 "match": {
@@ -464,37 +1837,55 @@ class NetplanDistro(DebianInterfacesDistro):
                 }]
             ethernets[os_link_name]["routes"] += routes
 
-        netplan_config = NETPLAN_ROOT_CONFIG
+        netplan_config = copy.deepcopy(NETPLAN_ROOT_CONFIG)
         netplan_config["network"]["ethernets"] = ethernets
 
         import yaml
         netplan_config_str = yaml.dump(netplan_config, line_break="\n",
                                        indent=4, default_flow_style=False)
 
-        LOG("Writing config to %s" % self.config_file)
-        with open(self.config_file, 'w') as config_file:
-            config_file.write(netplan_config_str)
+        self._render_config_file(self.config_file, netplan_config_str)
+        self._render_ipv6_dad_sysctl_config(network_data)
+
+    def _render_link_removal(self, link):
+        import yaml
+        config_file_path = self._get_root_path(self.config_file)
+        try:
+            with open(config_file_path, 'r') as config_file:
+                netplan_config = yaml.safe_load(config_file)
+        except (IOError, OSError) as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            return
+
+        ethernets = netplan_config.get("network", {}).get("ethernets") or {}
+        if link not in ethernets:
+            return
+        del ethernets[link]
+        netplan_config_str = yaml.dump(netplan_config, line_break="\n",
+                                       indent=4, default_flow_style=False)
+        self._render_config_file(self.config_file, netplan_config_str)
 
 
 class CentOSDistro(DebianInterfacesDistro):
 
-    def __init__(self):
-        super(CentOSDistro, self).__init__()
+    requires_gateway = False
+
+    def __init__(self, **kwargs):
+        super(CentOSDistro, self).__init__(**kwargs)
         self.config_file = "/etc/sysconfig/network-scripts/ifcfg-%s"
         self.config_file_route = "/etc/sysconfig/network-scripts/route-%s"
         self.config_file_route6 = "/etc/sysconfig/network-scripts/route6-%s"
 
-    def set_network_config_file(self, network_data, reset_to_dhcp=False):
+    def render_network_config(self, network_data, reset_to_dhcp=False):
         ethernets = {}
         links = {}
         for link in network_data["links"]:
-            os_link_name = get_os_net_interface_by_mac(
-                link["ethernet_mac_address"])
+            os_link_name = self._get_link_name(link)
             if not os_link_name:
                 raise Exception(
                     "Link could not be found " + link["ethernet_mac_address"])
-            link["os_link_name"] = os_link_name
-            links[link["id"]] = link
+            links[link["id"]] = dict(link, os_link_name=os_link_name)
             ethernets[os_link_name] = {
                 "name": os_link_name,
                 "mac_address": link["ethernet_mac_address"],
@@ -545,11 +1936,11 @@ class CentOSDistro(DebianInterfacesDistro):
                 else:
                     route_info = "%s/%s via %s dev %s" % (
                         route["network"], prefixlen,
-                        gateway, os_link_name)
+                        route_gateway, os_link_name)
                     if family == "6":
-                        ethernets[os_link_name]["ipv6_routes"] += route_info
+                        ethernets[os_link_name]["ipv6_routes"] += [route_info]
                     else:
-                        ethernets[os_link_name]["ipv4_routes"] += route_info
+                        ethernets[os_link_name]["ipv4_routes"] += [route_info]
 
             if not gateway:
                 LOG("No gateways have been found")
@@ -601,37 +1992,552 @@ class CentOSDistro(DebianInterfacesDistro):
             ethernets[os_link_name]["ipv4_str"] = (
                 ethernets[os_link_name]["ipv4_str"].strip())
 
-            LOG("Writing config to %s" % net_config_file)
             template_string = format_template(CENTOS_STATIC_TEMPLATE,
                                               ethernets[os_link_name])
-            with open(net_config_file, 'w') as config_file:
-                config_file.write(template_string)
+            self._render_config_file(net_config_file, template_string)
 
             if ethernets[os_link_name]["ipv4_routes"]:
-                route_config_file = self.config_file_route4 % os_link_name
+                route_config_file = self.config_file_route % os_link_name
                 routes = ethernets[os_link_name]["ipv4_routes"]
-                LOG("Writing config to %s" % route_config_file)
                 template_string = "\n".join(routes)
-                with open(route_config_file, 'w') as config_file:
-                    config_file.write(template_string)
+                self._render_config_file(route_config_file, template_string)
 
             if ethernets[os_link_name]["ipv6_routes"]:
                 route_config_file = self.config_file_route6 % os_link_name
                 routes = ethernets[os_link_name]["ipv6_routes"]
-                LOG("Writing config to %s" % route_config_file)
                 template_string = "\n".join(routes)
-                with open(route_config_file, 'w') as config_file:
-                    config_file.write(template_string)
+                self._render_config_file(route_config_file, template_string)
+
+        self._render_ipv6_dad_sysctl_config(network_data)
+
+    def _render_link_removal(self, link):
+        for config_file in (self.config_file, self.config_file_route,
+                            self.config_file_route6):
+            self.removed_files.append(config_file % link)
+
+
+class SystemdNetworkdDistro(DebianInterfacesDistro):
+    """Renders systemd-networkd runtime config files
+
+    The files are written in /run/systemd/network, with a lower prefix than
+    the netplan generated ones, so that they take precedence. Only the links
+    whose config has changed are reconfigured.
+    """
+
+    requires_gateway = False
+    # The DHCP clients are run by systemd-networkd itself
+    starts_dhcp_clients = False
+
+    def __init__(self, **kwargs):
+        super(SystemdNetworkdDistro, self).__init__(**kwargs)
+        self.config_dir = "/run/systemd/network"
+        self.config_file = "05-openstack-%s.network"
+        self.config_file_link = "05-openstack-%s.link"
+
+    def _get_link_network_config(self, os_link_name, link):
+        return {
+            "name": os_link_name,
+            "mac_address": link["ethernet_mac_address"],
+            "mtu": link["mtu"],
+            "dhcp": set(),
+            "dns": [],
+            "addresses": [],
+            "routes": [],
+        }
+
+    def render_network_config(self, network_data, reset_to_dhcp=False):
+        ethernets = {}
+        links = {}
+        for link in network_data["links"]:
+            os_link_name = self._get_link_name(link)
+            if not os_link_name:
+                raise Exception(
+                    "Link could not be found " + link["ethernet_mac_address"])
+            links[link["id"]] = os_link_name
+            ethernets[os_link_name] = self._get_link_network_config(
+                os_link_name, link)
+
+        existing_destinations = set()
+        for network in network_data["networks"]:
+            LOG("Processing network %s" % network["id"])
+            os_link_name = links[network["link"]]
+            ethernet = ethernets[os_link_name]
+
+            network_type = str(network["type"])
+            if network_type not in SUPPORTED_NETWORK_TYPES:
+                raise Exception(
+                    "Network type %s not supported for %s" % (network_type,
+                                                              os_link_name))
+
+            if "dhcp" in network_type:
+                if not reset_to_dhcp:
+                    LOG("Skipping network %s" % network["id"])
+                    continue
+                if "ipv6" in network_type:
+                    ethernet["dhcp"].add("ipv6")
+                else:
+                    ethernet["dhcp"].add("ipv4")
+                continue
+
+            prefixlen = str(mask_to_net_prefix(str(network["netmask"])))
+            ethernet["addresses"] += [
+                "%s/%s" % (network["ip_address"], prefixlen)]
+
+            for service in network["services"]:
+                if (str(service["type"]) == "dns" and
+                        service["address"] not in ethernet["dns"]):
+                    ethernet["dns"] += [service["address"]]
+
+            for route in network["routes"]:
+                prefixlen = str(mask_to_net_prefix(str(route["netmask"])))
+                destination = "%s/%s" % (route["network"], prefixlen)
+                if destination in existing_destinations:
+                    continue
+                existing_destinations.add(destination)
+                ethernet["routes"] += [{
+                    "destination": destination,
+                    "gateway": route["gateway"]
+                }]
+
+        dad_modes = self._get_ipv6_dad_modes(network_data)
+        for os_link_name, ethernet in ethernets.items():
+            dhcp = "no"
+            if len(ethernet["dhcp"]) == 2:
+                dhcp = "yes"
+            elif ethernet["dhcp"]:
+                dhcp = ethernet["dhcp"].pop()
+
+            network_config = {
+                "name": os_link_name,
+                "mac_address": ethernet["mac_address"],
+                "mtu": ethernet["mtu"],
+                "dhcp": dhcp,
+                "dad": "",
+                "dns": "".join(
+                    "DNS=%s\n" % dns for dns in ethernet["dns"]),
+                "addresses": "".join(
+                    "\n[Address]\nAddress=%s\n" % address
+                    for address in ethernet["addresses"]),
+                "routes": "".join(
+                    format_template(NETWORKD_ROUTE_TEMPLATE, route)
+                    for route in ethernet["routes"]),
+            }
+
+            if dad_modes.get(os_link_name) == "disabled":
+                network_config["dad"] = "IPv6DuplicateAddressDetection=0\n"
+
+            link_config_file = os.path.join(
+                self.config_dir, self.config_file_link % os_link_name)
+            link_config_str = NETWORKD_HEADER + format_template(
+                NETWORKD_LINK_TEMPLATE, network_config)
+            self._render_config_file(link_config_file, link_config_str)
+
+            net_config_file = os.path.join(
+                self.config_dir, self.config_file % os_link_name)
+            net_config_str = NETWORKD_HEADER + format_template(
+                NETWORKD_NETWORK_TEMPLATE, network_config)
+            self._render_config_file(net_config_file, net_config_str,
+                                     link=os_link_name)
+
+        self.config_cleanup.append((self.config_dir, "05-openstack-"))
+
+        # systemd-networkd has no setting for optimistic DAD
+        self._render_ipv6_dad_sysctl_config(network_data)
+
+    def _render_link_removal(self, link):
+        self.removed_files.append(
+            os.path.join(self.config_dir, self.config_file % link))
+        self.removed_files.append(
+            os.path.join(self.config_dir, self.config_file_link % link))
+
+    def apply_link_removal(self, removal):
+        super(SystemdNetworkdDistro, self).apply_link_removal(removal)
+        if self.removed_config_files:
+            # Only the links matching changed files are reconfigured
+            out, err, exit_code = self._execute_process(
+                ["networkctl", "reload"], shell=False)
+            if exit_code:
+                LOG("networkctl reload failed: %s" % err)
+
+    def apply_network_config(self, plan):
+        if not self.config_changed:
+            LOG("Network config has not changed")
+            return
 
+        self._set_ipv6_dad_sysctls(plan)
+        out, err, exit_code = self._execute_process(["networkctl", "reload"],
+                                                    shell=False)
+        if exit_code:
+            # networkctl reload / reconfigure are available from systemd 244
+            # The static config is applied with ip, the DHCP links get
+            # their leases once systemd-networkd loads the new config files
+            LOG("networkctl reload failed, applying the config using ip. "
+                "Err: %s" % err)
+            super(SystemdNetworkdDistro, self).apply_network_config(plan)
+            return
+
+        if self.changed_links:
+            reconfigure_cmd = ["networkctl", "reconfigure"]
+            reconfigure_cmd += self.changed_links
+            out, err, exit_code = self._execute_process(reconfigure_cmd,
+                                                        shell=False)
+            if exit_code:
+                raise Exception("Links could not be reconfigured: %s" % err)
+
+        # The DHCP clients are run by systemd-networkd itself
+        dhcp_client = DhcpClient(backend="networkd",
+                                 timeout=self.dhcp_timeout,
+                                 execute=self._execute_process,
+                                 max_end_time=self.deadline.end_time)
+        for link in plan["links"]:
+            if link["name"] not in self.changed_links:
+                continue
+            for family in plan["link_configs"][link["id"]]["dhcp"]:
+                dhcp_client.watch(link["name"], family)
+        self._wait_for_dhcp_leases(dhcp_client)
+        self._wait_for_ipv6_addresses(
+            [(os_link_name, address) for os_link_name, address
+             in plan["ipv6_addresses"]
+             if os_link_name in self.changed_links])
+
+
+class NetworkManagerDistro(DebianInterfacesDistro):
+    """Renders NetworkManager keyfile connections
+
+    Each link gets its own connection profile. Only the changed profiles
+    are loaded and reapplied on their devices, the other devices are not
+    touched.
+    """
+
+    requires_gateway = False
+    # The DHCP clients are run by NetworkManager itself
+    starts_dhcp_clients = False
+
+    def __init__(self, **kwargs):
+        super(NetworkManagerDistro, self).__init__(**kwargs)
+        self.config_dir = "/etc/NetworkManager/system-connections"
+        self.config_file = "openstack-%s.nmconnection"
+        self.connection_id = "openstack-%s"
+
+    def _get_link_network_config(self, os_link_name, link):
+        mac_address = link["ethernet_mac_address"]
+        return {
+            "id": self.connection_id % os_link_name,
+            "uuid": get_connection_uuid(mac_address),
+            "name": os_link_name,
+            "mac_address": mac_address.upper(),
+            "mtu": link["mtu"],
+            "ipv4_method": "disabled",
+            "ipv6_method": "ignore",
+            "ipv4": "",
+            "ipv6": "",
+            "ipv4_addresses": [],
+            "ipv6_addresses": [],
+            "ipv4_routes": [],
+            "ipv6_routes": [],
+            "ipv4_dns": [],
+            "ipv6_dns": [],
+        }
+
+    def render_network_config(self, network_data, reset_to_dhcp=False):
+        ethernets = {}
+        links = {}
+        for link in network_data["links"]:
+            os_link_name = self._get_link_name(link)
+            if not os_link_name:
+                raise Exception(
+                    "Link could not be found " + link["ethernet_mac_address"])
+            links[link["id"]] = os_link_name
+            ethernets[os_link_name] = self._get_link_network_config(
+                os_link_name, link)
+
+        existing_destinations = set()
+        for network in network_data["networks"]:
+            LOG("Processing network %s" % network["id"])
+            os_link_name = links[network["link"]]
+            ethernet = ethernets[os_link_name]
+
+            network_type = str(network["type"])
+            if network_type not in SUPPORTED_NETWORK_TYPES:
+                raise Exception(
+                    "Network type %s not supported for %s" % (network_type,
+                                                              os_link_name))
 
-def get_os_distribution():
+            family = "ipv4"
+            if "ipv6" in network_type:
+                family = "ipv6"
+
+            if "dhcp" in network_type:
+                if not reset_to_dhcp:
+                    LOG("Skipping network %s" % network["id"])
+                    continue
+                ethernet["%s_method" % family] = "auto"
+                continue
+
+            ethernet["%s_method" % family] = "manual"
+            prefixlen = str(mask_to_net_prefix(str(network["netmask"])))
+            address = "%s/%s" % (network["ip_address"], prefixlen)
+
+            gateway = None
+            for route in network["routes"]:
+                prefixlen = str(mask_to_net_prefix(str(route["netmask"])))
+                destination = "%s/%s" % (route["network"], prefixlen)
+                if destination in existing_destinations:
+                    continue
+                existing_destinations.add(destination)
+                if prefixlen == "0":
+                    gateway = route["gateway"]
+                else:
+                    ethernet["%s_routes" % family] += [
+                        "%s,%s" % (destination, route["gateway"])]
+
+            if gateway:
+                address += ",%s" % gateway
+            ethernet["%s_addresses" % family] += [address]
+
+            for service in network["services"]:
+                if (str(service["type"]) == "dns" and
+                        service["address"] not in ethernet["%s_dns" % family]):
+                    ethernet["%s_dns" % family] += [service["address"]]
+
+        for os_link_name, ethernet in ethernets.items():
+            for family in ("ipv4", "ipv6"):
+                settings = []
+                for i, address in enumerate(ethernet["%s_addresses" % family]):
+                    settings += ["address%d=%s" % (i + 1, address)]
+                for i, route in enumerate(ethernet["%s_routes" % family]):
+                    settings += ["route%d=%s" % (i + 1, route)]
+                if ethernet["%s_dns" % family]:
+                    settings += ["dns=%s;" % ";".join(
+                        ethernet["%s_dns" % family])]
+                ethernet[family] = "".join("%s\n" % setting
+                                           for setting in settings)
+
+            config_file = os.path.join(self.config_dir,
+                                       self.config_file % os_link_name)
+            config_str = format_template(NM_CONNECTION_TEMPLATE, ethernet)
+            # NetworkManager ignores keyfiles readable by other users
+            self._render_config_file(config_file, config_str, mode=0o600,
+                                     link=os_link_name)
+
+        # Remove the connections of the links no longer in the metadata
+        self.config_cleanup.append((self.config_dir, "openstack-"))
+
+        # NetworkManager has no setting for the IPv6 DAD
+        self._render_ipv6_dad_sysctl_config(network_data)
+
+    def _render_link_removal(self, link):
+        self.removed_files.append(
+            os.path.join(self.config_dir, self.config_file % link))
+
+    def apply_link_removal(self, removal):
+        super(NetworkManagerDistro, self).apply_link_removal(removal)
+        if self.removed_config_files:
+            # Loading a removed connection file deletes the connection
+            load_cmd = ["nmcli", "connection", "load"]
+            load_cmd += self.removed_config_files
+            out, err, exit_code = self._execute_process(load_cmd,
+                                                        shell=False)
+            if exit_code:
+                raise Exception("Connection could not be removed: %s" % err)
+
+    def _get_device_connection(self, link):
+        out, err, exit_code = self._execute_process(
+            ["nmcli", "-g", "GENERAL.CONNECTION", "device", "show", link],
+            shell=False, decode_output=True)
+        if exit_code:
+            return None
+        return out.strip()
+
+    def apply_network_config(self, plan):
+        if not self.changed_links and not self.removed_config_files:
+            LOG("Network config has not changed")
+            return
+
+        self._set_ipv6_dad_sysctls(plan)
+
+        # Loading a removed connection file deletes the connection
+        load_cmd = ["nmcli", "connection", "load"]
+        load_cmd += [self._get_root_path(
+            os.path.join(self.config_dir, self.config_file % link))
+            for link in self.changed_links]
+        load_cmd += self.removed_config_files
+        out, err, exit_code = self._execute_process(load_cmd, shell=False)
+        if exit_code:
+            raise Exception("Connections could not be loaded: %s" % err)
+
+        for os_link_name in self.changed_links:
+            connection_id = self.connection_id % os_link_name
+            if self._get_device_connection(os_link_name) == connection_id:
+                apply_cmd = ["nmcli", "device", "reapply", os_link_name]
+            else:
+                # The device has another connection active, switching to
+                # our connection bounces only this device
+                apply_cmd = ["nmcli", "connection", "up", "id",
+                             connection_id, "ifname", os_link_name]
+            out, err, exit_code = self._execute_process(apply_cmd, shell=False)
+            if exit_code:
+                raise Exception("Connection %s could not be applied: %s" % (
+                    connection_id, err))
+
+        self._wait_for_ipv6_addresses(
+            [(os_link_name, address) for os_link_name, address
+             in plan["ipv6_addresses"]
+             if os_link_name in self.changed_links])
+
+
+def parse_os_release(content):
+    """Parse the os-release KEY=value lines, the values may be quoted"""
+    os_release = {}
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        value = value.strip()
+        if len(value) > 1 and value[0] == value[-1] and value[0] in "\"'":
+            value = value[1:-1]
+        os_release[key.strip()] = value
+    return os_release
+
+
+def get_os_release_file():
+    for os_release_file in OS_RELEASE_FILES + [REDHAT_RELEASE_FILE]:
+        if os.path.exists(os_release_file):
+            return os_release_file
+    return None
+
+
+def get_os_release(os_release_file):
+    """Return the os-release ID, ID_LIKE, VERSION_ID and PRETTY_NAME"""
+    with open(os_release_file, "r") as f:
+        content = f.read()
+    if os_release_file != REDHAT_RELEASE_FILE:
+        return parse_os_release(content)
+
+    # For example: CentOS release 6.10 (Final)
+    version_id = ""
+    tokens = content.split()
+    if "release" in tokens[:-1]:
+        version_id = tokens[tokens.index("release") + 1]
+    return {
+        "ID": "centos",
+        "ID_LIKE": "rhel",
+        "VERSION_ID": version_id,
+        "PRETTY_NAME": content.strip(),
+    }
+
+
+def parse_version(version):
+    """Return the version as a tuple of ints, for example 18.04: (18, 4)"""
+    version_tuple = []
+    for part in version.split("."):
+        digits = ""
+        for char in part:
+            if not char.isdigit():
+                break
+            digits += char
+        if not digits:
+            break
+        version_tuple.append(int(digits))
+    return tuple(version_tuple)
+
+
+def write_config_file(config_file_path, content, mode=None, dry_run=False):
+    """Write the config file only if its content has changed
+
+    Returns True if the file has been (or, on dry run, would be) written.
+    """
+    writer = ConfigFileWriter(dry_run=dry_run)
+    writer.add(config_file_path, content, mode=mode)
+    return bool(writer.commit())
+
+
+def read_config_file(config_file_path):
+    """Returns the content of the config file, None if it does not exist"""
+    try:
+        with open(config_file_path, 'r') as config_file:
+            return config_file.read()
+    except (IOError, OSError) as ex:
+        if ex.errno != errno.ENOENT:
+            raise
+    return None
+
+
+def write_file_atomic(file_path, content, mode=None, sync=True):
+    """Replace the file with a temporary file renamed over it
+
+    The temporary file is hidden (.<name>.XXXX), so that it is never
+    matched by the interfaces.d/* or ifcfg-* globs, and it is removed on
+    failure. The mode of the replaced file is kept if no mode is given,
+    a new file is 0644. With sync, the content is on disk before the
+    rename, the caller syncs the directory.
+    """
+    if mode is None:
+        try:
+            mode = stat.S_IMODE(os.stat(file_path).st_mode)
+        except OSError as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            mode = 0o644
+    dir_path, file_name = os.path.split(file_path)
+    tmp_fd, tmp_file_path = tempfile.mkstemp(prefix=".%s." % file_name,
+                                             dir=dir_path or ".")
     try:
-        return platform.dist()
+        with os.fdopen(tmp_fd, 'w') as tmp_file:
+            tmp_file.write(content)
+            if sync:
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+        os.chmod(tmp_file_path, mode)
+        os.rename(tmp_file_path, file_path)
     except Exception:
-        import distro
-        return [distro.name(),
-                distro.major_version() + '.' + distro.minor_version(),
-                distro.codename()]
+        try:
+            os.remove(tmp_file_path)
+        except OSError:
+            pass
+        raise
+
+
+def sync_dir(dir_path):
+    """Persist the renames and removals done in the directory"""
+    try:
+        dir_fd = os.open(dir_path, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError as ex:
+        LOG("Failed to sync %s: %s" % (dir_path, ex))
+
+
+def remove_config_file(config_file_path, dry_run=False):
+    if dry_run:
+        LOG("Dry run, config %s would be removed" % config_file_path)
+        return
+    LOG("Removing stale config %s" % config_file_path)
+    os.remove(config_file_path)
+
+
+def is_service_active(service_name, timeout=None):
+    try:
+        out, err, exit_code = execute_process(
+            ["systemctl", "is-active", "--quiet", service_name], shell=False,
+            timeout=timeout)
+    except OSError:
+        # Not a systemd distro
+        return False
+    return exit_code == 0
+
+
+def get_connection_uuid(mac_address):
+    """Return the same connection UUID on each run for the MAC address"""
+    name = "openstack-networkd-%s" % mac_address
+    if not is_python_3():
+        # uuid5 hashes the name with a byte string namespace on Python 2,
+        # the MAC address parsed from JSON is unicode
+        name = name.encode("utf-8")
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, name))
 
 
 def format_template(template, data):
@@ -728,6 +2634,216 @@ def mask_to_net_prefix(mask):
         return ipv4_mask_to_net_prefix(mask)
 
 
+def normalize_address(address):
+    """Return the address in the canonical format used by the "ip" command
+
+       "2001:db8:0::10/64" => "2001:db8::10/64"
+    """
+    address, separator, prefixlen = address.partition("/")
+    family = socket.AF_INET
+    if is_ipv6_addr(address):
+        family = socket.AF_INET6
+    address = socket.inet_ntop(family, socket.inet_pton(family, address))
+    return address + separator + prefixlen
+
+
+def normalize_route_destination(destination):
+    """Return the destination in the format used by "ip route show"
+
+       "0.0.0.0/0"          => "default"
+       "169.254.169.254/32" => "169.254.169.254"
+       "10.0.0.0/8"         => "10.0.0.0/8"
+       "2001:db8:5:0::/64"  => "2001:db8:5::/64"
+    """
+    if destination == "default":
+        return destination
+    network_address, separator, prefixlen = normalize_address(
+        destination).partition("/")
+    if not separator:
+        return network_address
+    if prefixlen == "0":
+        return "default"
+    host_prefixlen = "32"
+    if is_ipv6_addr(network_address):
+        host_prefixlen = "128"
+    if prefixlen == host_prefixlen:
+        return network_address
+    return "%s/%s" % (network_address, prefixlen)
+
+
+def set_sysctl(key, value):
+    sysctl_path = os.path.join(PROC_SYS, key)
+    LOG("Setting %s to %s" % (sysctl_path, value))
+    try:
+        with open(sysctl_path, 'w') as sysctl_file:
+            sysctl_file.write(value)
+    except (IOError, OSError) as ex:
+        LOG("Failed to set %s: %s" % (sysctl_path, ex))
+
+
+def get_resolv_conf_manager(resolv_conf):
+    """Return what manages the resolv.conf, None for a plain file"""
+    if os.path.islink(resolv_conf):
+        return "the link target %s" % os.readlink(resolv_conf)
+    if not os.path.exists(resolv_conf):
+        return None
+    if not os.path.isfile(resolv_conf):
+        return "a non regular file"
+    with open(resolv_conf, 'r') as resolv_conf_file:
+        for line in resolv_conf_file.read().splitlines():
+            if not line.startswith("#"):
+                continue
+            for manager in RESOLV_CONF_MANAGERS:
+                if manager in line:
+                    return manager
+    return None
+
+
+def get_dir_files(dir_path):
+    try:
+        return os.listdir(dir_path)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return []
+        raise
+
+
+def get_link_addresses(link, family, timeout=None):
+    """Return the global addresses of the link as [(address, dynamic)]"""
+    addr_cmd = ["ip", "-o", "-%s" % family, "addr", "show", "dev", link,
+                "scope", "global"]
+    out, err, exit_code = execute_process(addr_cmd, shell=False,
+                                          decode_output=True,
+                                          timeout=timeout)
+    if exit_code:
+        raise Exception("IPs could not be listed: %s" % err)
+
+    addresses = []
+    for line in out.splitlines():
+        tokens = line.split()
+        for inet in ("inet", "inet6"):
+            if inet in tokens[:-1]:
+                addresses.append((tokens[tokens.index(inet) + 1],
+                                  "dynamic" in tokens))
+    return addresses
+
+
+def get_link_lease_addresses(link, family, timeout=None):
+    """Return the addresses that can be DHCP leases as {address: valid_lft}
+
+    The valid lifetime is in seconds, None if the address is permanent, as
+    set by the old dhclient scripts. The DHCPv6 leases are /128 dynamic
+    addresses, unlike the SLAAC addresses.
+    """
+    addr_cmd = ["ip", "-o", "-%s" % family, "addr", "show", "dev", link,
+                "scope", "global"]
+    out, err, exit_code = execute_process(addr_cmd, shell=False,
+                                          decode_output=True,
+                                          timeout=timeout)
+    if exit_code:
+        raise Exception("IPs could not be listed: %s" % err)
+
+    addresses = {}
+    for line in out.splitlines():
+        tokens = line.split()
+        for inet in ("inet", "inet6"):
+            if inet not in tokens[:-1]:
+                continue
+            address = tokens[tokens.index(inet) + 1]
+            dynamic = "dynamic" in tokens
+            if family == "6" and (not dynamic or
+                                  not address.endswith("/128")):
+                continue
+            valid_lft = None
+            if dynamic and "valid_lft" in tokens[:-1]:
+                lifetime = tokens[tokens.index("valid_lft") + 1]
+                if lifetime.endswith("sec"):
+                    valid_lft = int(lifetime[:-len("sec")])
+            addresses[address] = valid_lft
+    return addresses
+
+
+def get_ipv6_dad_mode(network, default_dad_mode="enabled"):
+    dad_mode = str(network.get("ipv6_dad", default_dad_mode))
+    if dad_mode not in IPV6_DAD_MODES:
+        raise Exception("IPv6 DAD mode %s not supported for %s" % (
+            dad_mode, network["id"]))
+    return dad_mode
+
+
+def get_ipv6_dad_sysctls(link, dad_mode):
+    """Return the sysctls setting the IPv6 DAD mode of the link"""
+    sysctl_path = "net/ipv6/conf/%s/%%s" % link
+    accept_dad = "1"
+    optimistic_dad = "0"
+    if dad_mode == "disabled":
+        accept_dad = "0"
+    elif dad_mode == "optimistic":
+        optimistic_dad = "1"
+    return [
+        (sysctl_path % "accept_dad", accept_dad),
+        (sysctl_path % "optimistic_dad", optimistic_dad),
+        (sysctl_path % "use_optimistic", optimistic_dad),
+    ]
+
+
+def get_link_index(link):
+    with open(os.path.join(SYS_CLASS_NET, link, "ifindex"), 'r') as f:
+        return int(f.read().strip())
+
+
+def wait_for_ipv6_addresses(addresses, timeout):
+    """Wait for the IPv6 addresses to leave the tentative state
+
+    The addresses are given as [(link, address)]. The state changes are
+    received as netlink RTM_NEWADDR notifications, the current state is
+    requested after the subscription, so that no change is missed.
+    Optimistic addresses are usable while tentative, so they are ready.
+    The addresses failing DAD are not awaited any longer.
+
+    Returns the addresses that are not ready when the timeout is reached
+    and the addresses that failed DAD.
+    """
+    pending = {}
+    for link, address in addresses:
+        address = address.split("/")[0]
+        packed_address = socket.inet_pton(socket.AF_INET6, address)
+        pending[(get_link_index(link), packed_address)] = (link, address)
+    dad_failed = []
+    if not pending:
+        return [], dad_failed
+
+    deadline = time.time() + timeout
+    netlink = NetlinkRoute(RTMGRP_IPV6_IFADDR)
+    try:
+        netlink.request_dump(RTM_GETADDR, socket.AF_INET6)
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            for msg_type, payload in netlink.receive(remaining):
+                if msg_type != RTM_NEWADDR:
+                    continue
+                _, ifindex, packed_address, flags = (
+                    NetlinkRoute.parse_address(payload))
+                link_address = pending.get((ifindex, packed_address))
+                if not link_address:
+                    continue
+                if flags & IFA_F_DADFAILED:
+                    LOG("IPv6 DAD failed for %s on %s" % (link_address[1],
+                                                          link_address[0]))
+                    dad_failed.append(link_address)
+                    del pending[(ifindex, packed_address)]
+                elif (not flags & IFA_F_TENTATIVE or
+                        flags & IFA_F_OPTIMISTIC):
+                    LOG("IPv6 address %s on %s is ready" % (link_address[1],
+                                                            link_address[0]))
+                    del pending[(ifindex, packed_address)]
+    finally:
+        netlink.close()
+    return sorted(pending.values()), sorted(dad_failed)
+
+
 def get_os_net_interfaces():
     """Return NET interfaces as [eth0, eth1]"""
 
@@ -761,6 +2877,109 @@ def get_os_net_interface_by_mac(mac_address):
                 return dev
 
 
+def get_os_net_interface_index():
+    """Return the NET interfaces as {MAC ADDRESS: name}"""
+    interfaces = {}
+    for dev in get_os_net_interfaces():
+        mac_file_path = os.path.join(SYS_CLASS_NET, dev, 'address')
+        try:
+            with open(mac_file_path, 'r') as mac_file:
+                interfaces.setdefault(mac_file.read().strip(), dev)
+        except (IOError, OSError):
+            # The interface has been removed meanwhile
+            continue
+    return interfaces
+
+
+def get_nic_mac_addresses():
+    """Return the MAC addresses of the physical NICs"""
+    mac_addresses = set()
+    for dev in get_os_net_interfaces():
+        dev_path = os.path.join(SYS_CLASS_NET, dev)
+        if not os.path.exists(os.path.join(dev_path, "device")):
+            continue
+        try:
+            with open(os.path.join(dev_path, "address"), 'r') as mac_file:
+                mac_addresses.add(mac_file.read().strip().lower())
+        except (IOError, OSError):
+            # The interface has been removed meanwhile
+            continue
+    return mac_addresses
+
+
+def is_network_data_current(network_data):
+    """Check that the network data describes exactly the present NICs"""
+    data_mac_addresses = set(
+        str(link.get("ethernet_mac_address", "")).lower()
+        for link in network_data.get("links", []))
+    return data_mac_addresses == get_nic_mac_addresses()
+
+
+def get_plan_key(plan_input):
+    """Return the content hash of the plan input and of this script
+
+    Changing the script invalidates the cached plans.
+    """
+    plan_hash = hashlib.sha256()
+    with open(os.path.abspath(__file__), 'rb') as script_file:
+        plan_hash.update(script_file.read())
+    plan_hash.update(json.dumps(plan_input, sort_keys=True).encode())
+    return plan_hash.hexdigest()
+
+
+def load_plan(key, cache_dir=PLAN_CACHE_DIR):
+    plan_path = os.path.join(cache_dir, "%s.json" % key)
+    try:
+        with open(plan_path, 'r') as plan_file:
+            plan = json.load(plan_file)
+    except (IOError, OSError, ValueError):
+        return None
+    if plan.get("key") != key:
+        return None
+    # Keep the recently used plans when pruning the cache
+    os.utime(plan_path, None)
+    return plan
+
+
+def save_plan(plan, cache_dir=PLAN_CACHE_DIR):
+    """Cache the plan, keeping only the PLAN_CACHE_SIZE most recent ones"""
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        plan_path = os.path.join(cache_dir, "%s.json" % plan["key"])
+        # The cache is not synced, a lost plan is compiled again
+        write_file_atomic(plan_path, json.dumps(plan), sync=False)
+
+        plan_paths = [os.path.join(cache_dir, plan_file_name)
+                      for plan_file_name in get_dir_files(cache_dir)
+                      if plan_file_name.endswith(".json")]
+        plan_paths.sort(key=os.path.getmtime, reverse=True)
+        for plan_path in plan_paths[PLAN_CACHE_SIZE:]:
+            os.remove(plan_path)
+    except (IOError, OSError) as ex:
+        # The cache is an optimization only
+        LOG("Plan %s could not be cached: %s" % (plan["key"], ex))
+
+
+def load_state_file(state_path):
+    try:
+        with open(state_path, 'r') as state_file:
+            return json.load(state_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save_state_file(state, state_path):
+    """Save the state atomically, the state is an optimization only"""
+    try:
+        state_dir = os.path.dirname(state_path)
+        if not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+        write_file_atomic(state_path, json.dumps(state), sync=False)
+    except (IOError, OSError) as ex:
+        LOG("State %s could not be saved: %s" % (state_path, ex))
+
+
 def get_example_metadata():
     example = EXAMPLE_JSON_METADATA
     if is_python_3():
@@ -769,24 +2988,58 @@ def get_example_metadata():
     # return "eyJzZXJ2aWNlcyI6IFt7InR5cGUiOiAiZG5zIiwgImFkZHJlc3MiOiAiOC44LjguOCJ9XSwgIm5ldHdvcmtzIjogW3sibmV0d29ya19pZCI6ICI4MWQ1MjkyZS03OTBhLTRiMWEtOGRmZi1mNmRmZmVjMDY2ZmIiLCAidHlwZSI6ICJpcHY0IiwgInNlcnZpY2VzIjogW3sidHlwZSI6ICJkbnMiLCAiYWRkcmVzcyI6ICI4LjguOC44In1dLCAibmV0bWFzayI6ICIyNTUuMjU1LjI1NS4wIiwgImxpbmsiOiAidGFwODU0NDc3YzgtYmIiLCAicm91dGVzIjogW3sibmV0bWFzayI6ICIwLjAuMC4wIiwgIm5ldHdvcmsiOiAiMC4wLjAuMCIsICJnYXRld2F5IjogIjE5Mi4xNjguNS4xIn1dLCAiaXBfYWRkcmVzcyI6ICIxOTIuMTY4LjUuMTciLCAiaWQiOiAibmV0d29yazAifV0sICJsaW5rcyI6IFt7ImV0aGVybmV0X21hY19hZGRyZXNzIjogIjAwOjE1OjVEOjY0Ojk4OjYwIiwgIm10dSI6IDE0NTAsICJ0eXBlIjogIm92cyIsICJpZCI6ICJ0YXA4NTQ0NzdjOC1iYiIsICJ2aWZfaWQiOiAiODU0NDc3YzgtYmJmZS00OGY1LTg5NGQtODBmMGNkZmNjYTYwIn1dfQ=="
 
 
-def execute_process(args, shell=True, decode_output=False):
+def execute_process(args, shell=True, decode_output=False, timeout=None):
+    """Run the command, killed if it runs for more than timeout seconds"""
     args = [str(arg) for arg in args]
     LOG("Executing: %s" % " ".join(args))
+    session_kwargs = {}
+    if timeout is not None:
+        # The children holding the output pipes are killed too. preexec_fn
+        # is not safe in multithreaded processes, Python 2 has no other way.
+        if is_python_3():
+            session_kwargs["start_new_session"] = True
+        else:
+            session_kwargs["preexec_fn"] = os.setsid
     p = subprocess.Popen(args,
                          stdout=subprocess.PIPE,
                          stderr=subprocess.PIPE,
-                         shell=shell)
-    (out, err) = p.communicate()
-
-    if decode_output and sys.version_info < (3, 0):
-        out = out.decode(sys.stdout.encoding)
-        err = err.decode(sys.stdout.encoding)
+                         shell=shell,
+                         **session_kwargs)
+    timed_out = []
+    timer = None
+    if timeout is not None:
+        def kill():
+            timed_out.append(True)
+            try:
+                os.killpg(p.pid, signal.SIGKILL)
+            except OSError:
+                # Already exited
+                pass
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+    try:
+        (out, err) = p.communicate()
+    finally:
+        if timer:
+            timer.cancel()
+    if timed_out:
+        raise DeadlineExceeded("%s did not finish within %.1f seconds" % (
+            args[0], timeout))
+
+    if decode_output:
+        encoding = getattr(sys.stdout, "encoding", None) or "utf-8"
+        out = out.decode(encoding)
+        err = err.decode(encoding)
 
     return out, err, p.returncode
 
 
 def retry_decorator(max_retry_count=1, sleep_time=5):
-    """Retries invoking the decorated method"""
+    """Retries invoking the decorated method
+
+    A retry is scheduled only if it starts within the deadline keyword
+    argument, if given.
+    """
 
     def wrapper(f):
         def inner(*args, **kwargs):
@@ -795,65 +3048,576 @@ def retry_decorator(max_retry_count=1, sleep_time=5):
             while True:
                 try:
                     return f(*args, **kwargs)
+                except DeadlineExceeded:
+                    raise
                 except Exception:
                     try_count = try_count + 1
                     if try_count == max_retry_count:
                         raise
+                    deadline = kwargs.get("deadline")
+                    if deadline and deadline.remaining() <= sleep_time:
+                        LOG("No time left for a retry")
+                        raise
 
                     time.sleep(sleep_time)
         return inner
     return wrapper
 
 
-def parse_fron_b64_json(b64json_data):
-    json_data = base64.b64decode(b64json_data)
-    if type(json_data) is bytes:
-        json_data = json_data.decode()
+def read_network_data(stream, chunk_size=NETWORK_DATA_CHUNK_SIZE):
+    """Reads raw or base64 encoded JSON network data from a binary stream
+
+    The format is detected from the first non blank character. The base64
+    data is decoded chunk by chunk into a single buffer, so that only one
+    copy of the decoded text is held in memory before being parsed.
+    """
+    if is_python_3():
+        text_decoder = codecs.getincrementaldecoder("utf-8")()
+        json_data = ""
+    else:
+        # json parses the UTF-8 byte strings directly on Python 2
+        text_decoder = None
+        json_data = b""
+    is_b64 = None
+    b64_pending = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if is_b64 is None:
+            stripped = chunk.lstrip()
+            if not stripped:
+                continue
+            is_b64 = stripped[:1] not in (b"{", b"[")
+        if is_b64:
+            b64_pending += chunk.translate(None, b" \t\r\n")
+            b64_len = len(b64_pending) - len(b64_pending) % 4
+            chunk = base64.b64decode(b64_pending[:b64_len])
+            b64_pending = b64_pending[b64_len:]
+        if text_decoder:
+            chunk = text_decoder.decode(chunk)
+        # CPython grows a string with a single reference in place, unlike
+        # joining a list of chunks, which needs a second copy
+        json_data += chunk
+    if b64_pending:
+        raise Exception("Invalid base64 network data length")
+    if text_decoder:
+        json_data += text_decoder.decode(b"", True)
+    if not json_data.strip():
+        return None
     return json.loads(json_data)
 
 
+def open_network_data(network_data=None, file_path=None, fd=None):
+    if file_path:
+        return open(file_path, "rb")
+    if fd is not None:
+        return os.fdopen(fd, "rb")
+    if network_data == "-":
+        return getattr(sys.stdin, "buffer", sys.stdin)
+    raise Exception("No network data input")
+
+
+def find_config_drive(timeout=None):
+    """Return the device of the config drive, found by its label"""
+    for label in CONFIG_DRIVE_LABELS:
+        out, err, exit_code = execute_process(
+            ["blkid", "-t", "LABEL=%s" % label, "-o", "device"],
+            shell=False, decode_output=True, timeout=timeout)
+        devices = out.split()
+        if not exit_code and devices:
+            return devices[0]
+    return None
+
+
+def get_mount_point(device):
+    device = os.path.realpath(device)
+    with open("/proc/mounts", "r") as mounts:
+        for line in mounts:
+            fields = line.split()
+            if len(fields) > 1 and os.path.realpath(fields[0]) == device:
+                return fields[1]
+    return None
+
+
+def read_config_drive_network_data(config_drive="auto", deadline=None):
+    """Read the network data from the config drive
+
+    The config drive found by its label is written when the instance is
+    created, its network data is rejected when it does not describe
+    exactly the present NICs, as after a NIC hotplug. A config drive
+    given as a device, an image file or a directory is not checked.
+    """
+    network_data = read_config_drive(config_drive, deadline=deadline)
+    if (config_drive == "auto" and network_data is not None and
+            not is_network_data_current(network_data)):
+        raise Exception("The config drive network data does not match the "
+                        "NICs, it is stale after a NIC hotplug")
+    return network_data
+
+
+def read_config_drive(config_drive="auto", deadline=None):
+    """Read the network data file of the config drive
+
+    The config drive can be given as a device, an image file or a mounted
+    directory, or found by its label. It is mounted read only, only for
+    the time needed to read the network data, if not already mounted.
+    """
+    deadline = deadline or Deadline()
+    if os.path.isdir(config_drive):
+        mount_point = config_drive
+    else:
+        device = config_drive
+        if config_drive == "auto":
+            device = find_config_drive(timeout=deadline.remaining())
+            if not device:
+                raise Exception("Config drive could not be found")
+        mount_point = get_mount_point(device)
+
+    if mount_point:
+        with open(os.path.join(mount_point, CONFIG_DRIVE_NETWORK_DATA),
+                  "rb") as stream:
+            return read_network_data(stream)
+
+    mount_options = "ro"
+    if os.path.isfile(device):
+        mount_options += ",loop"
+    mount_point = tempfile.mkdtemp(prefix="openstack-networkd-")
+    try:
+        out, err, exit_code = execute_process(
+            ["mount", "-o", mount_options, device, mount_point], shell=False,
+            decode_output=True, timeout=deadline.remaining())
+        if exit_code:
+            raise Exception("Config drive %s could not be mounted: %s" % (
+                device, err))
+        try:
+            with open(os.path.join(mount_point, CONFIG_DRIVE_NETWORK_DATA),
+                      "rb") as stream:
+                return read_network_data(stream)
+        finally:
+            # Not bounded by the deadline, the mount point is removed next
+            execute_process(["umount", mount_point], shell=False)
+    finally:
+        os.rmdir(mount_point)
+
+
+def parse_fron_b64_json(b64json_data):
+    if not isinstance(b64json_data, bytes):
+        b64json_data = b64json_data.encode()
+    return read_network_data(io.BytesIO(b64json_data))
+
+
+def get_dns_servers(services):
+    return [service["address"] for service in services
+            if str(service.get("type")) == "dns"]
+
+
+def remove_dns_services(network_data):
+    """Return a copy of the network data without the DNS services"""
+    network_data = dict(network_data)
+    network_data["services"] = [
+        service for service in network_data.get("services", [])
+        if str(service.get("type")) != "dns"]
+    network_data["networks"] = [
+        dict(network, services=[
+            service for service in network.get("services", [])
+            if str(service.get("type")) != "dns"])
+        for network in network_data.get("networks", [])]
+    return network_data
+
+
+def get_network_data_summary(network_data):
+    return ("%d links, %d networks, %d services" %
+            (len(network_data.get("links", [])),
+             len(network_data.get("networks", [])),
+             len(network_data.get("services", []))))
+
+
 def LOG(msg):
     msg = "%s" % msg
     syslog.syslog(syslog.LOG_INFO, msg)
     print(msg)
 
 
-@retry_decorator()
-def configure_network(b64json_network_data, reset_to_dhcp=False):
-    network_data = parse_fron_b64_json(b64json_network_data)
-    LOG(network_data)
+RENDERER_DISTROS = {
+    "eni": DebianInterfacesDistro,
+    "sysconfig": CentOSDistro,
+    "netplan": NetplanDistro,
+    "networkd": SystemdNetworkdDistro,
+    "networkmanager": NetworkManagerDistro,
+}
+
+# (service, distro, OS distros kept): the active network backends take
+# precedence over the OS defaults, except on the RHEL family where
+# NetworkManager reads the ifcfg files
+BACKEND_DISTROS = [
+    ("systemd-networkd", SystemdNetworkdDistro, ()),
+    ("NetworkManager", NetworkManagerDistro, (CentOSDistro,)),
+]
+
+# (os-release ID, first VERSION_ID, distro), the newest releases first.
+# An OS missing here gets the latest release of its first known ID_LIKE id.
+OS_DISTROS = [
+    ("ubuntu", "18.04", NetplanDistro),
+    ("ubuntu", "16.04", DebianInterfacesd50Distro),
+    ("ubuntu", "14.04", DebianInterfacesDistro),
+    ("debian", "10", DebianBusterInterfacesd50Distro),
+    ("debian", "9", DebianInterfacesd50Distro),
+    ("debian", "8", DebianInterfacesDistro),
+    ("centos", "6", CentOSDistro),
+    ("rhel", "6", CentOSDistro),
+]
+
+DETECTED_DISTROS = dict(
+    (distro_class.__name__, distro_class) for distro_class
+    in [distro_class for _, distro_class, _ in BACKEND_DISTROS] +
+    [distro_class for _, _, distro_class in OS_DISTROS])
+
+
+def match_os_distro(os_release):
+    """Return the distro of the os-release from OS_DISTROS, or None
+
+    The VERSION_ID is only compared with the releases of the same ID, the
+    numbering of a derivative is unrelated to the one of its ID_LIKE ids.
+    """
+    os_id = os_release.get("ID", "")
+    version = parse_version(os_release.get("VERSION_ID", ""))
+    os_releases = [(first_version, distro_class) for
+                   distro_os_id, first_version, distro_class in OS_DISTROS
+                   if distro_os_id == os_id]
+    if os_releases:
+        for first_version, distro_class in os_releases:
+            # Rolling releases, like Debian testing, have no VERSION_ID
+            if not version or version >= parse_version(first_version):
+                return distro_class
+        # Older than the supported releases
+        return None
+
+    for like_id in os_release.get("ID_LIKE", "").split():
+        for distro_os_id, _, distro_class in OS_DISTROS:
+            if distro_os_id == like_id:
+                return distro_class
+    return None
 
+
+def get_detection_key(os_release_file):
+    """Return the key of the cached detection
+
+    The os-release changes on upgrades, the active network backends may
+    only change with a reboot.
+    """
+    boot_id = ""
+    try:
+        with open(BOOT_ID_FILE, "r") as boot_id_file:
+            boot_id = boot_id_file.read().strip()
+    except (IOError, OSError):
+        pass
+    return [os_release_file, os.path.getmtime(os_release_file), boot_id,
+            os.path.getmtime(os.path.abspath(__file__))]
+
+
+def detect_distro_class(timeout=None):
+    """Return the distro class of the active backend or of the OS"""
+    os_release = None
+    os_distro_class = None
+    os_release_file = get_os_release_file()
+    if os_release_file:
+        os_release = get_os_release(os_release_file)
+        LOG("Running on %s" % os_release.get("PRETTY_NAME",
+                                             os_release.get("ID")))
+        os_distro_class = match_os_distro(os_release)
+
+    for service_name, distro_class, kept_distros in BACKEND_DISTROS:
+        if (os_distro_class not in kept_distros and
+                is_service_active(service_name, timeout=timeout)):
+            return distro_class
+
+    if not os_release:
+        raise Exception("Distro not supported, no os-release found")
+    if not os_distro_class:
+        raise Exception("Distro %s %s not supported" % (
+            os_release.get("ID"), os_release.get("VERSION_ID")))
+    return os_distro_class
+
+
+def get_distro(renderer=None, **distro_kwargs):
+    """Return the distro of the renderer, detected if not given
+
+    Only the renderer of this host can be detected, not the one of another
+    root. The detection is cached until the os-release changes or the next
+    boot.
+    """
+    if renderer:
+        LOG("Using the %s renderer" % renderer)
+        return RENDERER_DISTROS[renderer](**distro_kwargs)
+
+    root = distro_kwargs.get("root") or "/"
+    if root != "/":
+        # The OS and the network backends of the root are not running
+        raise Exception("The renderer is required with the root %s, it "
+                        "can only be detected for this host" % root)
+    cache_file = DETECTION_CACHE_FILE
+    os_release_file = get_os_release_file()
+    key = None
+    if os_release_file:
+        key = get_detection_key(os_release_file)
+        cached = load_state_file(cache_file)
+        if (cached and cached.get("key") == key and
+                cached.get("distro") in DETECTED_DISTROS):
+            LOG("Using the detected %s" % cached["distro"])
+            return DETECTED_DISTROS[cached["distro"]](**distro_kwargs)
+
+    timeout = None
+    if distro_kwargs.get("deadline"):
+        timeout = distro_kwargs["deadline"].remaining()
+    distro_class = detect_distro_class(timeout=timeout)
+    LOG("Detected %s" % distro_class.__name__)
+    if key and not distro_kwargs.get("dry_run"):
+        save_state_file({"key": key, "distro": distro_class.__name__},
+                        cache_file)
+    return distro_class(**distro_kwargs)
+
+
+def configure(network_data, renderer=None, root="/", apply=True,
+              dry_run=False, reset_to_dhcp=False, plan_cache=True,
+              dhcp_backend="dhclient", dhcp_timeout=DHCP_TIMEOUT,
+              ipv6_dad="enabled", ipv6_dad_timeout=IPV6_DAD_TIMEOUT,
+              eni_route_batch=False, link_timeout=LINK_READY_TIMEOUT,
+              deadline=None):
+    """Configure the network from the OpenStack network data, in process
+
+    The config files are written relative to root. They are applied to the
+    running system only if apply is set and root is "/", nothing is
+    changed on dry run. The renderer is required with another root.
+    Each call has its own state, the network data is not modified. All
+    the commands and waits share the deadline, EVENT_DEADLINE by default.
+
+    Returns a dict with the renderer, the plan key, whether only the DNS
+    servers have changed, the written, removed files, the changed links,
+    the links without a DHCP lease by family ("4", "6"), the commands /
+    sysctls run and the timings.
+    """
+    distro = get_distro(renderer, dry_run=dry_run, root=root,
+                        dhcp_backend=dhcp_backend, dhcp_timeout=dhcp_timeout,
+                        ipv6_dad=ipv6_dad, ipv6_dad_timeout=ipv6_dad_timeout,
+                        eni_route_batch=eni_route_batch,
+                        link_timeout=link_timeout,
+                        deadline=deadline or Deadline())
+    result = {
+        "renderer": distro.__class__.__name__,
+        "plan": None,
+        "dns_only": False,
+        "files_written": distro.written_config_files,
+        "files_removed": distro.deleted_config_files,
+        "changed_links": distro.changed_links,
+        "no_dhcp_leases": distro.no_dhcp_leases,
+        "ops": distro.ops,
+        "timings": distro.timings,
+    }
     if not network_data:
         LOG("Network data is empty")
+        return result
+
+    LOG("Network data: %s" % get_network_data_summary(network_data))
+    try:
+        start_time = distro.start_step("plan")
+        plan = distro.get_plan(network_data, reset_to_dhcp=reset_to_dhcp,
+                               use_cache=plan_cache)
+        result["plan"] = plan["key"]
+        distro.record_timing("plan", start_time)
+        start_time = distro.start_step("config files")
+        distro.write_config_files(plan)
+        distro.record_timing("config files", start_time)
+        if not distro.can_apply(apply):
+            LOG("The network config is not applied")
+        elif distro.is_dns_only_change(plan):
+            LOG("Only the DNS servers have changed")
+            result["dns_only"] = True
+            start_time = distro.start_step("DNS")
+            distro.apply_dns_config(plan)
+            distro.record_timing("DNS", start_time)
+            distro.save_applied_state(plan)
+        else:
+            start_time = distro.start_step("apply")
+            distro.apply_network_config(plan)
+            distro.record_timing("apply", start_time)
+            start_time = distro.start_step("DNS")
+            distro.apply_dns_config(plan)
+            distro.record_timing("DNS", start_time)
+            distro.save_applied_state(plan)
+    finally:
+        LOG("Timings: %s" % ", ".join(
+            "%s %.3fs" % (step, seconds) for step, seconds in distro.timings))
+
+    # write_config_files replaces the lists
+    result.update({
+        "files_written": distro.written_config_files,
+        "files_removed": distro.deleted_config_files,
+        "changed_links": distro.changed_links,
+    })
+    return result
+
+
+@retry_decorator()
+def configure_network(network_data, **kwargs):
+    return configure(network_data, **kwargs)
+
+
+def remove_link(link, renderer=None, root="/", apply=True, dry_run=False,
+                deadline=None):
+    """Drop a removed link from the config, without the network data
+
+    Only the config files and the state of the link are changed, the
+    other links are not touched. The live state (DHCP clients, addresses,
+    service reloads) is only changed with apply=True and the "/" root,
+    the config files of another root do not describe this host. The
+    renderer is required with another root.
+
+    Returns a dict with the renderer, the written, removed files, the
+    commands / sysctls run and the timings.
+    """
+    distro = get_distro(renderer, dry_run=dry_run, root=root,
+                        deadline=deadline or Deadline())
+    LOG("Removing the config of link %s" % link)
+    try:
+        start_time = distro.start_step("config files")
+        removal = distro.compile_link_removal(link)
+        distro.write_config_files(removal)
+        distro.record_timing("config files", start_time)
+        if not distro.can_apply(apply):
+            LOG("The removal of link %s is not applied" % link)
+        else:
+            start_time = distro.start_step("remove")
+            distro.apply_link_removal(removal)
+            distro.record_timing("remove", start_time)
+    finally:
+        LOG("Timings: %s" % ", ".join(
+            "%s %.3fs" % (step, seconds) for step, seconds in distro.timings))
+
+    return {
+        "renderer": distro.__class__.__name__,
+        "files_written": distro.written_config_files,
+        "files_removed": distro.deleted_config_files,
+        "ops": distro.ops,
+        "timings": distro.timings,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Applies an OpenStack network config")
+    parser.add_argument("network_data", nargs="?",
+                        help="Base64 encoded OpenStack network_data.json, "
+                             "or - to read it from stdin")
+    parser.add_argument("--file",
+                        help="Path of the raw or base64 encoded "
+                             "network_data.json")
+    parser.add_argument("--fd", type=int,
+                        help="File descriptor to read the raw or base64 "
+                             "encoded network_data.json from")
+    parser.add_argument("--config-drive", nargs="?", const="auto",
+                        help="Read the network_data.json from the config "
+                             "drive: a device, an image file or a mounted "
+                             "directory, found by its config-2 label if "
+                             "not given")
+    parser.add_argument("--renderer", choices=NET_RENDERERS,
+                        help="Network config renderer, detected by default")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Show the rendered network config without "
+                             "writing or applying it")
+    parser.add_argument("--reset-to-dhcp", action="store_true",
+                        help="Configure the DHCP networks from the metadata")
+    parser.add_argument("--dhcp-backend", choices=DHCP_BACKENDS,
+                        default="dhclient",
+                        help="DHCP client used for the DHCP networks")
+    parser.add_argument("--dhcp-timeout", type=float, default=DHCP_TIMEOUT,
+                        help="Time in seconds to wait for the DHCP leases of "
+                             "all the links")
+    parser.add_argument("--ipv6-dad", choices=IPV6_DAD_MODES,
+                        default="enabled",
+                        help="IPv6 duplicate address detection mode of the "
+                             "networks without an ipv6_dad setting")
+    parser.add_argument("--ipv6-dad-timeout", type=float,
+                        default=IPV6_DAD_TIMEOUT,
+                        help="Time in seconds to wait for the IPv6 "
+                             "addresses to leave the tentative state")
+    parser.add_argument("--link-timeout", type=float,
+                        default=LINK_READY_TIMEOUT,
+                        help="Time in seconds to wait for the carrier of "
+                             "each link after setting it up")
+    parser.add_argument("--eni-route-batch", action="store_true",
+                        help="Install the extra routes of the ENI configs "
+                             "with a single ip -batch command per "
+                             "interface")
+    parser.add_argument("--no-plan-cache", action="store_true",
+                        help="Always compile the plan, without using or "
+                             "updating the cache in %s" % PLAN_CACHE_DIR)
+    parser.add_argument("--deadline", type=float, default=EVENT_DEADLINE,
+                        help="Time in seconds for the whole event, from "
+                             "the network data read to the last wait")
+    remove_link_default = None
+    if os.environ.get("ACTION") == "remove":
+        # Set by udev on the NIC removal events
+        remove_link_default = os.environ.get("INTERFACE")
+    parser.add_argument("--remove-link", default=remove_link_default,
+                        help="Drop the config of a removed link, without "
+                             "network data (default: $INTERFACE on the "
+                             "udev remove events)")
+    args = parser.parse_args()
+    inputs = [i for i in (args.network_data, args.file, args.fd,
+                          args.config_drive)
+              if i is not None]
+    if args.remove_link:
+        if inputs:
+            parser.error("the removal of link %s (--remove-link or "
+                         "ACTION=remove) takes no network data" %
+                         args.remove_link)
+        return args
+    if len(inputs) != 1:
+        parser.error("exactly one of network_data, --file, --fd or "
+                     "--config-drive is required")
+    return args
+
+
+def main():
+    args = parse_args()
+    deadline = Deadline(args.deadline)
+
+    if args.remove_link:
+        # The network data is not needed, and not read
+        remove_link(args.remove_link, renderer=args.renderer,
+                    dry_run=args.dry_run, deadline=deadline)
         return
 
-    os_distrib = get_os_distribution()
-    os_distrib_str = " ".join(os_distrib)
-    LOG("Running on %s" % os_distrib_str)
-
-    if (os_distrib_str == "Ubuntu 14.04 trusty" or
-            os_distrib_str.find("debian 8.") == 0):
-        DISTRO = DebianInterfacesDistro()
-    elif (os_distrib_str.find("debian 9") == 0 or
-            os_distrib_str == "Ubuntu 16.04 xenial"):
-        DISTRO = DebianInterfacesd50Distro()
-    elif (os_distrib_str.find("debian 10") == 0):
-        DISTRO = DebianBusterInterfacesd50Distro()
-    elif (os_distrib_str == "Ubuntu 18.04 bionic" or
-            os_distrib_str == "Ubuntu 20.04 focal"):
-        DISTRO = NetplanDistro()
-    elif (os_distrib_str.find("centos ") == 0):
-        DISTRO = CentOSDistro()
+    deadline.start_stage("network data")
+    if args.config_drive:
+        data = read_config_drive_network_data(args.config_drive,
+                                              deadline=deadline)
+    elif args.network_data and args.network_data != "-":
+        data = parse_fron_b64_json(args.network_data)
     else:
-        raise Exception("Distro %s not supported" % os_distrib_str)
+        stream = open_network_data(args.network_data, file_path=args.file,
+                                   fd=args.fd)
+        try:
+            data = read_network_data(stream)
+        finally:
+            stream.close()
 
-    DISTRO.set_network_config_file(network_data, reset_to_dhcp=reset_to_dhcp)
-    DISTRO.apply_network_config(network_data, reset_to_dhcp=reset_to_dhcp)
+    # data = parse_fron_b64_json(get_example_metadata())
 
-data = sys.argv[1]
+    reset_to_dhcp = args.reset_to_dhcp
 
-# data = get_example_metadata()
+    configure_network(data, reset_to_dhcp=reset_to_dhcp,
+                      renderer=args.renderer, dry_run=args.dry_run,
+                      dhcp_backend=args.dhcp_backend,
+                      dhcp_timeout=args.dhcp_timeout,
+                      ipv6_dad=args.ipv6_dad,
+                      ipv6_dad_timeout=args.ipv6_dad_timeout,
+                      plan_cache=not args.no_plan_cache,
+                      eni_route_batch=args.eni_route_batch,
+                      link_timeout=args.link_timeout,
+                      deadline=deadline)
 
-reset_to_dhcp = False
 
-configure_network(data, reset_to_dhcp=reset_to_dhcp)
+if __name__ == "__main__":
+    main()
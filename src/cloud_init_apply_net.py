@@ -25,10 +25,86 @@ from cloudinit.sources.helpers import openstack
 
 MAGIC_URL = "http://169.254.169.254/openstack/latest/network_data.json"
 LEGACY_MAGIC_URL = "http://169.254.169.254/openstack/content/0000"
+CONFIG_DRIVE_LABELS = ["config-2", "CONFIG-2"]
+CONFIG_DRIVE_NETWORK_DATA = "openstack/latest/network_data.json"
+CONFIG_DRIVE_LEGACY_NETWORK_DATA = "openstack/content/0000"
+SYS_CLASS_NET = "/sys/class/net/"
+
+# auto: the config drive, if its network data matches the current NICs,
+# then the metadata service. config-drive / metadata-service: only one.
+NETWORK_DATA_SOURCE = os.environ.get("NETWORK_DATA_SOURCE", "auto")
+
+# Time budget of an event, shared by the fetch, apply and reset stages
+EVENT_DEADLINE = float(os.environ.get("EVENT_DEADLINE", "120"))
+URL_TIMEOUT = 3
+URL_RETRIES = 3
+URL_RETRY_SLEEP = 1
+# Exit code of timeout(1) when the command timed out
+TIMEOUT_EXIT_CODE = 124
+# Shortest command timeout, timeout(1) does not kill a command given 0
+MIN_COMMAND_TIMEOUT = 0.1
+
+LOG = logging.getLogger(__name__)
+
+
+# Copies of Deadline and DeadlineExceeded of apply-networking-linux.py, the
+# reference: this wrapper is installed alone in /usr/local/bin and has to
+# stay standalone. Keep them in sync, tests/test_deadline.py checks it.
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline(object):
+    """Time budget of an event, shared by all its stages
+
+    The commands and the HTTP calls take their timeouts from the remaining
+    time, the retries are scheduled only if they fit in it. The current
+    and the longest stages are reported when the time is used up.
+    """
+
+    def __init__(self, timeout=EVENT_DEADLINE):
+        self.timeout = timeout
+        self.end_time = time.time() + timeout
+        self.stage = "start"
+        self.stage_start_time = time.time()
+        # [(stage, seconds)] of the completed stages
+        self.stages = []
+
+    def start_stage(self, stage):
+        now = time.time()
+        self.stages.append((self.stage, now - self.stage_start_time))
+        self.stage = stage
+        self.stage_start_time = now
+
+    def remaining(self):
+        return max(self.end_time - time.time(), 0)
+
+    def get_timeout(self, timeout):
+        """Return the timeout, capped to the remaining time"""
+        return min(timeout, self.remaining())
+
+    def check(self, action=None):
+        if not self.remaining():
+            raise self.exceeded(action)
+
+    def exceeded(self, action=None):
+        msg = "The %ss deadline was used up in stage %s" % (
+            self.timeout, self.stage)
+        if action:
+            msg += ", while %s" % action
+        stages = self.stages + [(self.stage,
+                                 time.time() - self.stage_start_time)]
+        stage, seconds = max(stages, key=lambda stage_info: stage_info[1])
+        msg += " (longest stage: %s, %.1fs)" % (stage, seconds)
+        return DeadlineExceeded(msg)
 
 
 def retry_decorator(max_retry_count=5, sleep_time=5):
-    """Retries invoking the decorated method"""
+    """Retries invoking the decorated method
+
+    A retry is scheduled only if it starts within the deadline keyword
+    argument, if given.
+    """
 
     def wrapper(f):
         def inner(*args, **kwargs):
@@ -37,9 +113,15 @@ def retry_decorator(max_retry_count=5, sleep_time=5):
             while True:
                 try:
                     return f(*args, **kwargs)
+                except DeadlineExceeded:
+                    raise
                 except Exception:
                     if try_count == max_retry_count:
                         raise
+                    deadline = kwargs.get("deadline")
+                    if deadline and deadline.remaining() <= sleep_time:
+                        LOG.warning("No time left for a retry")
+                        raise
 
                     try_count = try_count + 1
                     time.sleep(sleep_time)
@@ -47,63 +129,99 @@ def retry_decorator(max_retry_count=5, sleep_time=5):
     return wrapper
 
 
-def is_cloud_init_running():
+def subp(args, deadline, rcs=None):
+    """Run the command, killed when the deadline is reached
+
+    util.subp has no timeout, the command is run through timeout(1).
+    """
+    action = "running %s" % " ".join(args)
+    remaining = deadline.remaining()
+    if remaining <= MIN_COMMAND_TIMEOUT:
+        raise deadline.exceeded(action)
     try:
-        return util.subp(["ps", "--no-headers", "-fC", "cloud-init"])
+        return util.subp(["timeout", "-k", "1",
+                          "%.1f" % max(remaining, MIN_COMMAND_TIMEOUT)] +
+                         args, rcs=rcs)
+    except util.ProcessExecutionError as ex:
+        if ex.exit_code == TIMEOUT_EXIT_CODE:
+            raise deadline.exceeded(action)
+        raise
+
+
+def is_cloud_init_running(deadline):
+    try:
+        return subp(["ps", "--no-headers", "-fC", "cloud-init"], deadline)
+    except DeadlineExceeded:
+        raise
     except Exception:
         pass
 
 
-def try_reset_network(distro_name, reset_async=False):
+def try_reset_network(distro_name, reset_async=False, deadline=None):
+    deadline = deadline or Deadline()
     use_ifup = True
     if not use_ifup and (distro_name == "debian" or distro_name == "ubuntu"):
         try:
-            util.subp(["systemctl", "stop", "networking"])
+            subp(["systemctl", "stop", "networking"], deadline)
+        except DeadlineExceeded:
+            raise
         except Exception:
             pass
         try:
             args = ["systemctl", "start", "networking"]
             if reset_async:
                 args += ["--no-block"]
-            util.subp(args)
+            subp(args, deadline)
             return
+        except DeadlineExceeded:
+            raise
         except Exception:
             pass
 
     if use_ifup and (distro_name == "debian" or distro_name == "ubuntu"):
         try:
-            util.subp(["ifdown", "--all"])
-            util.subp(["ifdown", "--all"])
+            subp(["ifdown", "--all"], deadline)
+            subp(["ifdown", "--all"], deadline)
+        except DeadlineExceeded:
+            raise
         except Exception:
             pass
         try:
-            util.subp(["ifup", "--all"])
-            util.subp(["ifup", "--all"])
+            subp(["ifup", "--all"], deadline)
+            subp(["ifup", "--all"], deadline)
             return
+        except DeadlineExceeded:
+            raise
         except Exception:
             pass
 
     # required on Ubuntu 18.04
     try:
-        util.subp(["systemctl", "restart", "systemd-networkd"])
+        subp(["systemctl", "restart", "systemd-networkd"], deadline)
         return
+    except DeadlineExceeded:
+        raise
     except Exception:
         pass
     try:
-        util.subp(["netplan", "apply"])
+        subp(["netplan", "apply"], deadline)
         return
+    except DeadlineExceeded:
+        raise
     except Exception:
         pass
 
     if distro_name == "rhel" or distro_name == "centos":
         try:
-            util.subp(["service", "network", "restart"])
+            subp(["service", "network", "restart"], deadline)
             return
+        except DeadlineExceeded:
+            raise
         except Exception:
             pass
 
 
-def set_manual_interface(interface_name):
+def set_manual_interface(interface_name, deadline=None):
     interfaces_file = "/etc/network/interfaces.d/50-cloud-init.cfg"
     interfaces = ''
 
@@ -120,21 +238,40 @@ def set_manual_interface(interface_name):
     with open(interfaces_file, 'w') as file:
         file.write(interfaces)
 
+    deadline = deadline or Deadline()
     try:
-        util.subp(["ifdown", "--all"])
-        util.subp(["ifdown", "--all"])
+        subp(["ifdown", "--all"], deadline)
+        subp(["ifdown", "--all"], deadline)
+    except DeadlineExceeded:
+        raise
     except Exception:
         pass
     try:
-        util.subp(["ifup", "--all"])
-        util.subp(["ifup", "--all"])
+        subp(["ifup", "--all"], deadline)
+        subp(["ifup", "--all"], deadline)
         return
+    except DeadlineExceeded:
+        raise
     except Exception:
         pass
 
 
-def try_read_url(url, distro_name, reset_net=True):
-    raw_data = url_helper.readurl(url, timeout=3, retries=3).contents
+def try_read_url(url, distro_name, reset_net=True, deadline=None):
+    """Read the URL, retrying while the deadline allows it"""
+    deadline = deadline or Deadline()
+    try_count = 0
+    while True:
+        deadline.check("reading %s" % url)
+        try:
+            raw_data = url_helper.readurl(
+                url, timeout=deadline.get_timeout(URL_TIMEOUT)).contents
+            break
+        except url_helper.UrlError:
+            try_count += 1
+            if (try_count > URL_RETRIES or
+                    deadline.remaining() <= URL_RETRY_SLEEP):
+                raise
+            time.sleep(URL_RETRY_SLEEP)
 
     if type(raw_data) is bytes:
         raw_data = raw_data.decode()
@@ -142,10 +279,143 @@ def try_read_url(url, distro_name, reset_net=True):
     return raw_data
 
 
+def get_nic_mac_addresses():
+    """Return the MAC addresses of the physical NICs"""
+    mac_addresses = set()
+    for dev in os.listdir(SYS_CLASS_NET):
+        dev_path = os.path.join(SYS_CLASS_NET, dev)
+        if not os.path.exists(os.path.join(dev_path, "device")):
+            continue
+        mac_addresses.add(
+            util.load_file(os.path.join(dev_path, "address")).strip().lower())
+    return mac_addresses
+
+
+def is_network_data_current(raw_data, legacy=False):
+    """Check that the network data describes exactly the present NICs
+
+    The config drive is written when the instance is created, it gets
+    stale after a NIC hotplug.
+    """
+    mac_addresses = get_nic_mac_addresses()
+    if legacy:
+        # Debian interfaces format, with a hwaddress per interface
+        data_mac_addresses = set(
+            line.split()[-1].lower() for line in raw_data.splitlines()
+            if line.strip().startswith("hwaddress"))
+    else:
+        data_mac_addresses = set(
+            str(link.get("ethernet_mac_address", "")).lower()
+            for link in json.loads(raw_data).get("links", []))
+    return data_mac_addresses == mac_addresses
+
+
+class MetadataServiceSource(object):
+
+    name = "metadata-service"
+
+    def is_available(self, deadline=None):
+        return True
+
+    def read(self, distro_name, legacy=False, deadline=None):
+        url = MAGIC_URL
+        if legacy:
+            url = LEGACY_MAGIC_URL
+        return try_read_url(url, distro_name, deadline=deadline)
+
+
+class ConfigDriveSource(object):
+    """Reads the network data from the config drive, without any HTTP call
+
+    The config drive is mounted read only, only while it is read, unless
+    it is already mounted. util.mount_cb has no timeout, the deadline is
+    only checked before the mount. The devices are only probed when the
+    config drive is consulted.
+    """
+
+    name = "config-drive"
+
+    def __init__(self):
+        self.devices = None
+
+    def is_available(self, deadline=None):
+        if self.devices is None:
+            self.devices = []
+            for label in CONFIG_DRIVE_LABELS:
+                # util.find_devs_with has no timeout
+                try:
+                    out, _ = subp(["blkid", "-c", "/dev/null", "-t",
+                                   "LABEL=%s" % label, "-o", "device"],
+                                  deadline or Deadline(), rcs=[0, 2])
+                except DeadlineExceeded:
+                    raise
+                except Exception as ex:
+                    LOG.warning("The config drive could not be probed: %s",
+                                ex)
+                    continue
+                self.devices += out.split()
+        return bool(self.devices)
+
+    def read(self, distro_name, legacy=False, deadline=None):
+        if deadline:
+            deadline.check("mounting the config drive")
+        path = CONFIG_DRIVE_NETWORK_DATA
+        if legacy:
+            path = CONFIG_DRIVE_LEGACY_NETWORK_DATA
+
+        def read_network_data(mount_point):
+            return util.load_file(os.path.join(mount_point, path))
+
+        return util.mount_cb(self.devices[0], read_network_data)
+
+
+def get_network_data_sources(source_name=NETWORK_DATA_SOURCE):
+    """Return the network data sources, the fastest first
+
+    The sources are not probed, see is_available.
+    """
+    sources = [ConfigDriveSource(), MetadataServiceSource()]
+    if source_name != "auto":
+        sources = [source for source in sources if source.name == source_name]
+        if not sources:
+            raise Exception("Network data source %s not supported" %
+                            source_name)
+    return sources
+
+
+def read_network_data(distro_name, legacy=False,
+                      source_name=NETWORK_DATA_SOURCE, deadline=None):
+    deadline = deadline or Deadline()
+    last_exception = Exception("No network data source is available")
+    for source in get_network_data_sources(source_name):
+        if not source.is_available(deadline):
+            continue
+        try:
+            raw_data = source.read(distro_name, legacy=legacy,
+                                   deadline=deadline)
+        except DeadlineExceeded:
+            raise
+        except Exception as ex:
+            LOG.warning("Network data could not be read from %s: %s",
+                        source.name, ex)
+            last_exception = ex
+            continue
+
+        if (source_name == "auto" and source.name == "config-drive" and
+                not is_network_data_current(raw_data, legacy=legacy)):
+            LOG.info("The config drive network data does not match the "
+                     "NICs, it is not used")
+            continue
+        LOG.info("Network data read from %s", source.name)
+        return raw_data
+    raise last_exception
+
+
 @retry_decorator()
-def set_network_config(action="", id_net_name=""):
+def set_network_config(action="", id_net_name="", deadline=None):
+    deadline = deadline or Deadline()
 
-    if is_cloud_init_running():
+    if is_cloud_init_running(deadline):
         return
 
     init = stages.Init()
@@ -168,25 +438,33 @@ def set_network_config(action="", id_net_name=""):
         # on compute node, in nova.conf:
         # [DEFAULT}
         # flat_injected = True
-        net_cfg_raw = try_read_url(LEGACY_MAGIC_URL, init.distro.name)
+        deadline.start_stage("fetch")
+        net_cfg_raw = read_network_data(init.distro.name, legacy=True,
+                                        deadline=deadline)
+        deadline.start_stage("apply")
         init.distro.apply_network(net_cfg_raw, bring_up=True)
 
         return
 
     if id_net_name and action == "remove":
-        set_manual_interface(id_net_name)
+        deadline.start_stage("remove")
+        set_manual_interface(id_net_name, deadline=deadline)
 
-    net_cfg_raw = try_read_url(MAGIC_URL, init.distro.name)
+    deadline.start_stage("fetch")
+    net_cfg_raw = read_network_data(init.distro.name, deadline=deadline)
     net_cfg_raw = json.loads(net_cfg_raw)
     netcfg = openstack.convert_net_json(net_cfg_raw)
 
+    # cloud-init brings up the links itself, without a timeout
+    deadline.start_stage("apply")
     init.distro.apply_network_config_names(netcfg)
     init.distro.apply_network_config(netcfg, bring_up=True)
 
-    try_reset_network(init.distro.name)
+    deadline.start_stage("reset")
+    try_reset_network(init.distro.name, deadline=deadline)
 
 
 action = os.environ.get("ACTION", "")
 id_net_name = os.environ.get("ID_NET_NAME", "")
 
-set_network_config(action, id_net_name)
+set_network_config(action, id_net_name, deadline=Deadline())
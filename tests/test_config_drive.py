@@ -0,0 +1,100 @@
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import utils
+
+anl = utils.load_apply_networking()
+
+NETWORK_DATA = {
+    "links": [{"id": "tap0", "mtu": 1450,
+               "ethernet_mac_address": "FA:16:3E:7A:61:64"},
+              {"id": "tap1", "mtu": 1450,
+               "ethernet_mac_address": "fa:16:3e:00:00:01"}],
+    "networks": [],
+    "services": [],
+}
+
+
+class ConfigDriveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+        self.mac_addresses = set(["fa:16:3e:7a:61:64", "fa:16:3e:00:00:01"])
+        self.get_nic_mac_addresses = anl.get_nic_mac_addresses
+        self.addCleanup(setattr, anl, "get_nic_mac_addresses",
+                        anl.get_nic_mac_addresses)
+        anl.get_nic_mac_addresses = lambda: set(self.mac_addresses)
+
+        # A mounted config drive
+        self.config_drive_dir = os.path.join(self.tmp_dir, "config-2")
+        network_data_file = os.path.join(self.config_drive_dir,
+                                         anl.CONFIG_DRIVE_NETWORK_DATA)
+        os.makedirs(os.path.dirname(network_data_file))
+        with open(network_data_file, "w") as f:
+            json.dump(NETWORK_DATA, f)
+
+    def test_network_data_current(self):
+        self.assertTrue(anl.is_network_data_current(NETWORK_DATA))
+        self.mac_addresses.add("fa:16:3e:00:00:02")
+        self.assertFalse(anl.is_network_data_current(NETWORK_DATA))
+        self.mac_addresses = set(["fa:16:3e:7a:61:64"])
+        self.assertFalse(anl.is_network_data_current(NETWORK_DATA))
+
+    def test_directory_not_checked(self):
+        self.mac_addresses = set()
+        self.assertEqual(
+            anl.read_config_drive_network_data(self.config_drive_dir),
+            NETWORK_DATA)
+
+    def test_auto_stale(self):
+        read_config_drive = anl.read_config_drive
+        self.addCleanup(setattr, anl, "read_config_drive", read_config_drive)
+        anl.read_config_drive = (
+            lambda config_drive, deadline=None:
+            read_config_drive(self.config_drive_dir, deadline=deadline))
+
+        self.assertEqual(anl.read_config_drive_network_data("auto"),
+                         NETWORK_DATA)
+        # A NIC was hotplugged after the config drive was written
+        self.mac_addresses.add("fa:16:3e:00:00:02")
+        self.assertRaises(Exception, anl.read_config_drive_network_data,
+                          "auto")
+
+    def test_nic_mac_addresses(self):
+        self.addCleanup(setattr, anl, "SYS_CLASS_NET", anl.SYS_CLASS_NET)
+        anl.SYS_CLASS_NET = self.tmp_dir
+        for dev, mac_address, is_physical in [
+                ("eth0", "FA:16:3E:7A:61:64", True),
+                ("br0", "fa:16:3e:00:00:09", False)]:
+            dev_path = os.path.join(self.tmp_dir, dev)
+            os.makedirs(dev_path)
+            with open(os.path.join(dev_path, "address"), "w") as f:
+                f.write(mac_address + "\n")
+            if is_physical:
+                os.makedirs(os.path.join(dev_path, "device"))
+        # Only the physical NICs are described by the network data
+        self.assertEqual(self.get_nic_mac_addresses(),
+                         set(["fa:16:3e:7a:61:64"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+import utils
+
+anl = utils.load_apply_networking()
+
+
+class WriteFileAtomicTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir_path)
+        self.file_path = os.path.join(self.dir_path, "ifcfg-eth0")
+
+    def _get_mode(self):
+        return stat.S_IMODE(os.stat(self.file_path).st_mode)
+
+    def _read(self):
+        with open(self.file_path) as config_file:
+            return config_file.read()
+
+    def test_write(self):
+        anl.write_file_atomic(self.file_path, "DEVICE=eth0\n")
+        self.assertEqual(self._read(), "DEVICE=eth0\n")
+        self.assertEqual(self._get_mode(), 0o644)
+        self.assertEqual(os.listdir(self.dir_path), ["ifcfg-eth0"])
+
+    def test_mode(self):
+        anl.write_file_atomic(self.file_path, "a", mode=0o600)
+        self.assertEqual(self._get_mode(), 0o600)
+        anl.write_file_atomic(self.file_path, "b", sync=False)
+        self.assertEqual(self._get_mode(), 0o600)
+        self.assertEqual(self._read(), "b")
+
+    def test_hidden_tmp_file(self):
+        rename = os.rename
+        tmp_file_paths = []
+
+        def fake_rename(src, dst):
+            tmp_file_paths.append(src)
+            rename(src, dst)
+        anl.os.rename = fake_rename
+        self.addCleanup(setattr, anl.os, "rename", rename)
+
+        anl.write_file_atomic(self.file_path, "a")
+        self.assertEqual(len(tmp_file_paths), 1)
+        self.assertEqual(os.path.dirname(tmp_file_paths[0]), self.dir_path)
+        self.assertTrue(os.path.basename(tmp_file_paths[0]).startswith(
+            ".ifcfg-eth0."))
+
+    def test_tmp_file_removed_on_failure(self):
+        anl.write_file_atomic(self.file_path, "a")
+        self.assertRaises(Exception, anl.write_file_atomic, self.file_path,
+                          "b", mode="not-a-mode")
+        self.assertEqual(os.listdir(self.dir_path), ["ifcfg-eth0"])
+        self.assertEqual(self._read(), "a")
+
+
+if __name__ == "__main__":
+    unittest.main()
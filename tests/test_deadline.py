@@ -0,0 +1,94 @@
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import ast
+import os
+import time
+import unittest
+
+import utils
+
+anl = utils.load_apply_networking()
+
+CLOUD_INIT_APPLY_NET = os.path.join(os.path.dirname(utils.SCRIPT_PATH),
+                                    "cloud_init_apply_net.py")
+
+
+def get_class_dumps(script_path, class_names):
+    """Return the AST dumps of the classes, without their docstrings"""
+    with open(script_path) as script:
+        tree = ast.parse(script.read())
+    dumps = {}
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name in class_names:
+            if ast.get_docstring(node):
+                node.body = node.body[1:]
+            dumps[node.name] = ast.dump(node)
+    return dumps
+
+
+class DeadlineTest(unittest.TestCase):
+
+    def test_copies_in_sync(self):
+        class_names = ("Deadline", "DeadlineExceeded")
+        dumps = get_class_dumps(utils.SCRIPT_PATH, class_names)
+        self.assertEqual(sorted(dumps), sorted(class_names))
+        self.assertEqual(get_class_dumps(CLOUD_INIT_APPLY_NET, class_names),
+                         dumps)
+
+    def test_exceeded(self):
+        deadline = anl.Deadline(0)
+        deadline.start_stage("apply")
+        self.assertEqual(deadline.remaining(), 0)
+        try:
+            deadline.check("running ip")
+        except anl.DeadlineExceeded as ex:
+            self.assertIn("used up in stage apply, while running ip",
+                          str(ex))
+        else:
+            self.fail("The deadline was not exceeded")
+
+    def test_execute_process_timeout(self):
+        start_time = time.time()
+        self.assertRaises(anl.DeadlineExceeded, anl.execute_process,
+                          ["sh", "-c", "sleep 10 & wait"], shell=False,
+                          timeout=0.2)
+        self.assertLess(time.time() - start_time, 5)
+
+    def test_execute_process(self):
+        out, err, exit_code = anl.execute_process(
+            ["echo", "ok"], shell=False, decode_output=True, timeout=5)
+        self.assertEqual((out, exit_code), ("ok\n", 0))
+
+    def test_dhcp_lease_listing_bounded(self):
+        timeouts = []
+
+        def get_link_lease_addresses(link, family, timeout=None):
+            timeouts.append(timeout)
+            return {}
+        self.addCleanup(setattr, anl, "get_link_lease_addresses",
+                        anl.get_link_lease_addresses)
+        anl.get_link_lease_addresses = get_link_lease_addresses
+
+        dhcp_client = anl.DhcpClient(timeout=0,
+                                     max_end_time=time.time() + 30)
+        dhcp_client.watch("eth0", "4")
+        self.assertEqual(dhcp_client.wait(), [("eth0", "4")])
+        self.assertEqual(len(timeouts), 2)
+        for timeout in timeouts:
+            self.assertTrue(0 < timeout <= 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
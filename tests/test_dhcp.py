@@ -0,0 +1,100 @@
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import utils
+
+anl = utils.load_apply_networking()
+
+MAC_ADDRESS = "fa:16:3e:7a:61:64"
+INTERFACES = {MAC_ADDRESS: "eth0"}
+DHCP_FILE = "/run/systemd/network/06-openstack-dhcp-eth0.network"
+NETWORK_DATA = {
+    "links": [{"id": "tap0", "mtu": 1450,
+               "ethernet_mac_address": MAC_ADDRESS}],
+    "networks": [{"id": "network0", "link": "tap0", "type": "ipv4_dhcp",
+                  "services": []}],
+    "services": [],
+}
+
+
+class NetworkdDhcpBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def _compile_plan(self, distro_class=anl.DebianInterfacesDistro):
+        distro = distro_class(dhcp_backend="networkd", root=self.root)
+        plan = distro.compile_plan(NETWORK_DATA, INTERFACES,
+                                   reset_to_dhcp=True)
+        return distro, plan
+
+    def test_dhcp_file_in_plan(self):
+        distro, plan = self._compile_plan()
+        dhcp_files = [config_file for config_file in plan["config_files"]
+                      if config_file["path"] == DHCP_FILE]
+        self.assertEqual(len(dhcp_files), 1)
+        self.assertEqual(dhcp_files[0]["link"], "eth0")
+        self.assertIn("DHCP=ipv4\n", dhcp_files[0]["content"])
+
+    def test_no_dhcp_file_for_networkd_renderer(self):
+        distro, plan = self._compile_plan(anl.SystemdNetworkdDistro)
+        self.assertNotIn(DHCP_FILE, [config_file["path"] for config_file
+                                     in plan["config_files"]])
+
+    def test_dhcp_files_written_under_root(self):
+        stale_file = os.path.join(
+            self.root, "run/systemd/network/06-openstack-dhcp-eth1.network")
+        os.makedirs(os.path.dirname(stale_file))
+        with open(stale_file, "w") as f:
+            f.write("stale")
+
+        distro, plan = self._compile_plan()
+        changed_files = distro.write_config_files(plan)
+
+        dhcp_file = os.path.join(self.root, DHCP_FILE.lstrip("/"))
+        self.assertTrue(os.path.exists(dhcp_file))
+        self.assertFalse(os.path.exists(stale_file))
+        self.assertIn(dhcp_file, changed_files)
+        self.assertIn(stale_file, changed_files)
+
+
+class NoDhcpLeasesTest(unittest.TestCase):
+
+    def test_links_by_family(self):
+        self.addCleanup(setattr, anl, "get_link_lease_addresses",
+                        anl.get_link_lease_addresses)
+        anl.get_link_lease_addresses = (
+            lambda link, family, timeout=None: {})
+
+        distro = anl.DebianInterfacesDistro(dry_run=True)
+        dhcp_client = anl.DhcpClient(timeout=0)
+        for link, family in [("eth0", "4"), ("eth1", "4"), ("eth1", "6")]:
+            dhcp_client.watch(link, family)
+        distro._wait_for_dhcp_leases(dhcp_client)
+        self.assertEqual(distro.no_dhcp_leases,
+                         {"4": ["eth0", "eth1"], "6": ["eth1"]})
+
+    def test_configure_result(self):
+        result = anl.configure({}, renderer="eni", dry_run=True)
+        self.assertEqual(result["no_dhcp_leases"], {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import utils
+
+anl = utils.load_apply_networking()
+
+
+class OsReleaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir_path)
+
+    def _write(self, file_name, content):
+        file_path = os.path.join(self.dir_path, file_name)
+        with open(file_path, "w") as release_file:
+            release_file.write(content)
+        return file_path
+
+    def test_parse_os_release(self):
+        os_release = anl.parse_os_release(
+            '# comment\n'
+            '\n'
+            'NAME="Ubuntu"\n'
+            "VERSION_ID='20.04'\n"
+            'ID=ubuntu\n'
+            'ID_LIKE=debian\n'
+            'PRETTY_NAME="Ubuntu 20.04.1 LTS"\n'
+            'HOME_URL="https://www.ubuntu.com/"\n'
+            'not a key value line\n'
+            'EMPTY=\n')
+        self.assertEqual(os_release, {
+            "NAME": "Ubuntu",
+            "VERSION_ID": "20.04",
+            "ID": "ubuntu",
+            "ID_LIKE": "debian",
+            "PRETTY_NAME": "Ubuntu 20.04.1 LTS",
+            "HOME_URL": "https://www.ubuntu.com/",
+            "EMPTY": "",
+        })
+
+    def test_parse_version(self):
+        self.assertEqual(anl.parse_version("18.04"), (18, 4))
+        self.assertEqual(anl.parse_version("10"), (10,))
+        self.assertEqual(anl.parse_version("7.9.2009"), (7, 9, 2009))
+        self.assertEqual(anl.parse_version("8-stream"), (8,))
+        self.assertEqual(anl.parse_version("rolling"), ())
+        self.assertEqual(anl.parse_version(""), ())
+
+    def test_os_release_file(self):
+        os_release_file = self._write(
+            "os-release", 'ID=debian\nVERSION_ID="10"\n')
+        self.assertEqual(anl.get_os_release(os_release_file),
+                         {"ID": "debian", "VERSION_ID": "10"})
+
+    def test_redhat_release_fallback(self):
+        redhat_release_file = self._write(
+            "redhat-release", "CentOS release 6.10 (Final)\n")
+        self.addCleanup(setattr, anl, "REDHAT_RELEASE_FILE",
+                        anl.REDHAT_RELEASE_FILE)
+        anl.REDHAT_RELEASE_FILE = redhat_release_file
+        os_release = anl.get_os_release(redhat_release_file)
+        self.assertEqual(os_release, {
+            "ID": "centos",
+            "ID_LIKE": "rhel",
+            "VERSION_ID": "6.10",
+            "PRETTY_NAME": "CentOS release 6.10 (Final)",
+        })
+        self.assertIs(anl.match_os_distro(os_release), anl.CentOSDistro)
+
+
+class MatchOsDistroTest(unittest.TestCase):
+
+    def _match(self, os_id, version_id=None, id_like=None):
+        os_release = {"ID": os_id}
+        if version_id is not None:
+            os_release["VERSION_ID"] = version_id
+        if id_like is not None:
+            os_release["ID_LIKE"] = id_like
+        return anl.match_os_distro(os_release)
+
+    def test_known_releases(self):
+        self.assertIs(self._match("ubuntu", "20.04", "debian"),
+                      anl.NetplanDistro)
+        self.assertIs(self._match("ubuntu", "18.04", "debian"),
+                      anl.NetplanDistro)
+        self.assertIs(self._match("ubuntu", "16.04", "debian"),
+                      anl.DebianInterfacesd50Distro)
+        self.assertIs(self._match("ubuntu", "14.04", "debian"),
+                      anl.DebianInterfacesDistro)
+        self.assertIs(self._match("debian", "11"),
+                      anl.DebianBusterInterfacesd50Distro)
+        self.assertIs(self._match("debian", "9"),
+                      anl.DebianInterfacesd50Distro)
+        self.assertIs(self._match("centos", "7", "rhel fedora"),
+                      anl.CentOSDistro)
+
+    def test_rolling_release(self):
+        self.assertIs(self._match("debian"),
+                      anl.DebianBusterInterfacesd50Distro)
+
+    def test_older_release_not_supported(self):
+        # Not matched as a debian release by the ubuntu version
+        self.assertIsNone(self._match("ubuntu", "12.04", "debian"))
+        self.assertIsNone(self._match("debian", "7"))
+
+    def test_derivative_versions_not_compared(self):
+        # The latest release of the first known ID_LIKE id
+        self.assertIs(self._match("linuxmint", "21", "ubuntu debian"),
+                      anl.NetplanDistro)
+        self.assertIs(self._match("linuxmint", "2", "ubuntu debian"),
+                      anl.NetplanDistro)
+        self.assertIs(self._match("raspbian", "9", "debian"),
+                      anl.DebianBusterInterfacesd50Distro)
+        self.assertIs(self._match("rocky", "9.1", "rhel centos fedora"),
+                      anl.CentOSDistro)
+
+    def test_unknown(self):
+        self.assertIsNone(self._match("arch"))
+        self.assertIsNone(self._match("gentoo", "2.7", "unknown"))
+
+
+class DetectDistroTest(unittest.TestCase):
+
+    def setUp(self):
+        self.os_release = None
+        self.active_services = set()
+        for name, value in [
+                ("get_os_release_file",
+                 lambda: self.os_release and "/etc/os-release"),
+                ("get_os_release", lambda path: self.os_release),
+                ("is_service_active",
+                 lambda name, timeout=None: name in self.active_services)]:
+            self.addCleanup(setattr, anl, name, getattr(anl, name))
+            setattr(anl, name, value)
+
+    def test_os_default(self):
+        self.os_release = {"ID": "ubuntu", "VERSION_ID": "16.04"}
+        self.assertIs(anl.detect_distro_class(),
+                      anl.DebianInterfacesd50Distro)
+
+    def test_active_backend(self):
+        self.os_release = {"ID": "ubuntu", "VERSION_ID": "20.04"}
+        self.active_services = set(["NetworkManager"])
+        self.assertIs(anl.detect_distro_class(), anl.NetworkManagerDistro)
+        self.active_services.add("systemd-networkd")
+        self.assertIs(anl.detect_distro_class(), anl.SystemdNetworkdDistro)
+
+    def test_rhel_keeps_ifcfg_with_networkmanager(self):
+        self.os_release = {"ID": "centos", "VERSION_ID": "7"}
+        self.active_services = set(["NetworkManager"])
+        self.assertIs(anl.detect_distro_class(), anl.CentOSDistro)
+
+    def test_no_os_release(self):
+        self.assertRaises(Exception, anl.detect_distro_class)
+        self.active_services = set(["NetworkManager"])
+        self.assertIs(anl.detect_distro_class(), anl.NetworkManagerDistro)
+
+    def test_not_supported(self):
+        self.os_release = {"ID": "ubuntu", "VERSION_ID": "12.04"}
+        self.assertRaises(Exception, anl.detect_distro_class)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,160 @@
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+import utils
+
+anl = utils.load_apply_networking()
+
+DNS_PLAN = {"dns": {"links": {"eth0": ["10.0.0.2"], "eth1": []},
+                    "global": ["8.8.8.8"]}}
+
+RESOLV_CONF = """# Written by the admin
+search example.com
+nameserver 192.0.2.53
+options edns0
+"""
+
+
+class DnsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        os.makedirs(os.path.join(self.root, "etc"))
+        self.resolv_conf = os.path.join(self.root, "etc", "resolv.conf")
+
+        self.resolved_active = False
+        self.addCleanup(setattr, anl, "is_service_active",
+                        anl.is_service_active)
+        anl.is_service_active = (
+            lambda name, timeout=None: self.resolved_active)
+
+        self.commands = []
+        self.missing_commands = set()
+        self.distro = anl.DebianInterfacesDistro(root=self.root)
+        self.distro._execute_process = self._execute_process
+
+    def _execute_process(self, args, **kwargs):
+        if args[0] in self.missing_commands:
+            raise OSError(errno.ENOENT, "No such file or directory")
+        self.commands.append(args)
+        return "", "", 0
+
+    def _write_resolv_conf(self, content):
+        with open(self.resolv_conf, "w") as resolv_conf:
+            resolv_conf.write(content)
+
+    def _read_resolv_conf(self):
+        with open(self.resolv_conf) as resolv_conf:
+            return resolv_conf.read()
+
+    def test_resolvectl(self):
+        self.resolved_active = True
+        self.distro.apply_dns_config(DNS_PLAN)
+        self.assertEqual(self.commands, [
+            ["resolvectl", "dns", "eth0", "10.0.0.2", "8.8.8.8"],
+            ["resolvectl", "dns", "eth1", "8.8.8.8"],
+        ])
+        self.assertFalse(os.path.exists(self.resolv_conf))
+
+    def test_systemd_resolve(self):
+        self.resolved_active = True
+        self.missing_commands.add("resolvectl")
+        self.distro.apply_dns_config(DNS_PLAN)
+        self.assertEqual(self.commands, [
+            ["systemd-resolve", "--interface", "eth0",
+             "--set-dns", "10.0.0.2", "--set-dns", "8.8.8.8"],
+            ["systemd-resolve", "--interface", "eth1",
+             "--set-dns", "8.8.8.8"],
+        ])
+
+    def test_resolved_global_only(self):
+        self.resolved_active = True
+        self.distro.apply_dns_config(
+            {"dns": {"links": {}, "global": ["8.8.8.8"]}})
+        self.assertEqual(self.commands, [])
+        self.assertFalse(os.path.exists(self.resolv_conf))
+
+    def test_no_servers(self):
+        self._write_resolv_conf(RESOLV_CONF)
+        self.distro.apply_dns_config({"dns": {"links": {"eth0": []},
+                                              "global": []}})
+        self.assertEqual(self._read_resolv_conf(), RESOLV_CONF)
+
+    def test_resolv_conf(self):
+        self._write_resolv_conf(RESOLV_CONF)
+        self.distro.apply_dns_config(DNS_PLAN)
+        self.assertEqual(self._read_resolv_conf(), anl.NETWORKD_HEADER + (
+            "nameserver 10.0.0.2\n"
+            "nameserver 8.8.8.8\n"
+            "# Written by the admin\n"
+            "search example.com\n"
+            "options edns0\n"))
+        self.assertEqual(self.distro.written_config_files,
+                         [self.resolv_conf])
+
+        # The header and the nameservers are replaced on the next run
+        self.distro.apply_dns_config(
+            {"dns": {"links": {"eth0": ["10.0.0.3"]}, "global": []}})
+        self.assertEqual(self._read_resolv_conf(), anl.NETWORKD_HEADER + (
+            "nameserver 10.0.0.3\n"
+            "# Written by the admin\n"
+            "search example.com\n"
+            "options edns0\n"))
+
+    def test_resolv_conf_created(self):
+        self.distro.apply_dns_config(DNS_PLAN)
+        self.assertEqual(self._read_resolv_conf(), anl.NETWORKD_HEADER + (
+            "nameserver 10.0.0.2\n"
+            "nameserver 8.8.8.8\n"))
+
+    def test_resolv_conf_link_not_written(self):
+        target = os.path.join(self.root, "run", "resolvconf", "resolv.conf")
+        os.makedirs(os.path.dirname(target))
+        with open(target, "w") as target_file:
+            target_file.write(RESOLV_CONF)
+        os.symlink(target, self.resolv_conf)
+
+        self.distro.apply_dns_config(DNS_PLAN)
+        self.assertTrue(os.path.islink(self.resolv_conf))
+        self.assertEqual(self._read_resolv_conf(), RESOLV_CONF)
+        self.assertEqual(self.distro.written_config_files, [])
+
+    def test_managed_resolv_conf_not_written(self):
+        for header in ["# Dynamic resolv.conf(5) file for glibc "
+                       "resolver(3) generated by resolvconf(8)",
+                       "# Generated by NetworkManager",
+                       "# This file is managed by man:systemd-resolved(8)."]:
+            content = "%s\nnameserver 192.0.2.53\n" % header
+            self._write_resolv_conf(content)
+            self.distro.apply_dns_config(DNS_PLAN)
+            self.assertEqual(self._read_resolv_conf(), content)
+
+    def test_resolv_conf_manager(self):
+        self.assertIsNone(anl.get_resolv_conf_manager(self.resolv_conf))
+        self._write_resolv_conf(RESOLV_CONF)
+        self.assertIsNone(anl.get_resolv_conf_manager(self.resolv_conf))
+        self._write_resolv_conf("# Generated by NetworkManager\n")
+        self.assertEqual(anl.get_resolv_conf_manager(self.resolv_conf),
+                         "NetworkManager")
+
+
+if __name__ == "__main__":
+    unittest.main()
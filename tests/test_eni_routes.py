@@ -0,0 +1,128 @@
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import utils
+
+anl = utils.load_apply_networking()
+
+MAC_ADDRESS = "fa:16:3e:7a:61:64"
+INTERFACES = {MAC_ADDRESS: "eth0"}
+NETWORK_DATA = {
+    "links": [{"id": "tap0", "mtu": 1450,
+               "ethernet_mac_address": MAC_ADDRESS}],
+    "networks": [{
+        "id": "network0",
+        "link": "tap0",
+        "type": "ipv4",
+        "ip_address": "192.168.5.22",
+        "netmask": "255.255.255.0",
+        "routes": [{"network": "0.0.0.0", "netmask": "0.0.0.0",
+                    "gateway": "192.168.5.1"},
+                   {"network": "10.10.0.0", "netmask": "255.255.0.0",
+                    "gateway": "192.168.5.254"},
+                   {"network": "10.20.0.0", "netmask": "255.255.0.0",
+                    "gateway": "192.168.5.253"}],
+        "services": [],
+    }, {
+        "id": "network1",
+        "link": "tap0",
+        "type": "ipv6",
+        "ip_address": "2001:db8::22",
+        "netmask": "ffff:ffff:ffff:ffff::",
+        "routes": [{"network": "::", "netmask": "::",
+                    "gateway": "2001:db8::1"},
+                   {"network": "2001:db8:1::", "netmask": "ffff:ffff:ffff::",
+                    "gateway": "2001:db8::fe"}],
+        "services": [],
+    }],
+    "services": [],
+}
+
+ROUTES_FILE = os.path.join(anl.ENI_ROUTES_DIR, "eth0.inet")
+ROUTES6_FILE = os.path.join(anl.ENI_ROUTES_DIR, "eth0.inet6")
+
+
+class EniRouteBatchTest(unittest.TestCase):
+
+    def _get_config_files(self, eni_route_batch):
+        distro = anl.DebianInterfacesDistro(dry_run=True,
+                                            eni_route_batch=eni_route_batch)
+        plan = distro.compile_plan(NETWORK_DATA, INTERFACES)
+        return dict((config_file["path"], config_file["content"])
+                    for config_file in plan["config_files"])
+
+    def test_route_commands(self):
+        config_files = self._get_config_files(False)
+        self.assertEqual(sorted(config_files), ["/etc/network/interfaces"])
+        interfaces = config_files["/etc/network/interfaces"]
+        self.assertIn("    post-up route add -net 10.10.0.0 netmask "
+                      "255.255.0.0 gw 192.168.5.254\n", interfaces)
+        self.assertNotIn("-batch", interfaces)
+
+    def test_batch_files(self):
+        config_files = self._get_config_files(True)
+        self.assertEqual(sorted(config_files), [
+            "/etc/network/interfaces",
+            ROUTES_FILE,
+            ROUTES_FILE + ".del",
+            ROUTES6_FILE,
+            ROUTES6_FILE + ".del",
+        ])
+        self.assertEqual(config_files[ROUTES_FILE],
+                         "route replace 10.10.0.0/16 via 192.168.5.254 "
+                         "dev eth0\n"
+                         "route replace 10.20.0.0/16 via 192.168.5.253 "
+                         "dev eth0\n")
+        self.assertEqual(config_files[ROUTES_FILE + ".del"],
+                         "route del 10.10.0.0/16 via 192.168.5.254 dev eth0\n"
+                         "route del 10.20.0.0/16 via 192.168.5.253 dev eth0\n")
+        self.assertEqual(config_files[ROUTES6_FILE],
+                         "route replace 2001:db8:1::/48 via 2001:db8::fe "
+                         "dev eth0\n")
+
+        # A single ip command per interface and family
+        interfaces = config_files["/etc/network/interfaces"]
+        self.assertNotIn("route add -net", interfaces)
+        for family, routes_file in (("4", ROUTES_FILE), ("6", ROUTES6_FILE)):
+            self.assertEqual(interfaces.count(
+                "    post-up ip -%s -force -batch %s || true\n" % (
+                    family, routes_file)), 1)
+            self.assertEqual(interfaces.count(
+                "    pre-down ip -%s -force -batch %s.del || true\n" % (
+                    family, routes_file)), 1)
+
+    def test_stale_batch_files_removed(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        routes_dir = os.path.join(root, anl.ENI_ROUTES_DIR.lstrip("/"))
+        os.makedirs(routes_dir)
+        for routes_file in ("eth1.inet", "eth1.inet.del"):
+            with open(os.path.join(routes_dir, routes_file), "w") as f:
+                f.write("route replace 10.30.0.0/16 via 192.168.6.1 "
+                        "dev eth1\n")
+
+        distro = anl.DebianInterfacesDistro(root=root, eni_route_batch=True)
+        distro.write_config_files(distro.compile_plan(NETWORK_DATA,
+                                                      INTERFACES))
+        self.assertEqual(sorted(os.listdir(routes_dir)), [
+            "eth0.inet", "eth0.inet.del", "eth0.inet6", "eth0.inet6.del"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import copy
+import unittest
+
+import utils
+
+anl = utils.load_apply_networking()
+
+INTERFACES = {"fa:16:3e:7a:61:64": "eth0", "fa:16:3e:00:00:01": "eth1"}
+
+
+def get_ipv6_network(network_id, link, ip_address, dad_mode=None):
+    network = {
+        "id": network_id,
+        "link": link,
+        "type": "ipv6",
+        "ip_address": ip_address,
+        "netmask": "ffff:ffff:ffff:ffff::",
+        "routes": [{"network": "::", "netmask": "::",
+                    "gateway": ip_address.rsplit(":", 1)[0] + ":1"}],
+        "services": [],
+    }
+    if dad_mode:
+        network["ipv6_dad"] = dad_mode
+    return network
+
+
+NETWORK_DATA = {
+    "links": [{"id": "tap0", "mtu": 1450,
+               "ethernet_mac_address": "fa:16:3e:7a:61:64"},
+              {"id": "tap1", "mtu": 1500,
+               "ethernet_mac_address": "fa:16:3e:00:00:01"}],
+    "networks": [
+        get_ipv6_network("network0", "tap0", "2001:db8::5"),
+        # The strongest mode of a link is set on the whole link
+        get_ipv6_network("network1", "tap0", "2001:db8:1::5", "optimistic"),
+        get_ipv6_network("network2", "tap1", "2001:db8:2::5", "disabled"),
+    ],
+    "services": [],
+}
+
+SYSCTL_CONFIG = anl.NETWORKD_HEADER + """\
+net/ipv6/conf/eth0/accept_dad = 1
+net/ipv6/conf/eth0/optimistic_dad = 1
+net/ipv6/conf/eth0/use_optimistic = 1
+net/ipv6/conf/eth1/accept_dad = 0
+net/ipv6/conf/eth1/optimistic_dad = 0
+net/ipv6/conf/eth1/use_optimistic = 0
+"""
+
+
+class Ipv6DadTest(unittest.TestCase):
+
+    def _compile_plan(self, distro_class, network_data=NETWORK_DATA,
+                      **kwargs):
+        distro = distro_class(dry_run=True, **kwargs)
+        return distro, distro.compile_plan(network_data, INTERFACES)
+
+    def test_sysctls(self):
+        self.assertEqual(anl.get_ipv6_dad_sysctls("eth0", "enabled"), [
+            ("net/ipv6/conf/eth0/accept_dad", "1"),
+            ("net/ipv6/conf/eth0/optimistic_dad", "0"),
+            ("net/ipv6/conf/eth0/use_optimistic", "0"),
+        ])
+        self.assertEqual(anl.get_ipv6_dad_sysctls("eth0", "optimistic"), [
+            ("net/ipv6/conf/eth0/accept_dad", "1"),
+            ("net/ipv6/conf/eth0/optimistic_dad", "1"),
+            ("net/ipv6/conf/eth0/use_optimistic", "1"),
+        ])
+        self.assertEqual(anl.get_ipv6_dad_sysctls("eth0", "disabled"), [
+            ("net/ipv6/conf/eth0/accept_dad", "0"),
+            ("net/ipv6/conf/eth0/optimistic_dad", "0"),
+            ("net/ipv6/conf/eth0/use_optimistic", "0"),
+        ])
+
+    def test_unsupported_mode(self):
+        network_data = copy.deepcopy(NETWORK_DATA)
+        network_data["networks"][0]["ipv6_dad"] = "fast"
+        self.assertRaises(Exception, self._compile_plan,
+                          anl.CentOSDistro, network_data)
+        self.assertRaises(Exception, anl.get_ipv6_dad_mode, {"id": "n"},
+                          "fast")
+
+    def test_sysctl_config(self):
+        distro, plan = self._compile_plan(anl.CentOSDistro)
+        self.assertEqual(plan["ipv6_dad_modes"],
+                         {"eth0": "optimistic", "eth1": "disabled"})
+        self.assertEqual(plan["sysctl_config"], SYSCTL_CONFIG)
+
+    def test_default_mode(self):
+        network_data = copy.deepcopy(NETWORK_DATA)
+        for network in network_data["networks"]:
+            network.pop("ipv6_dad", None)
+        distro, plan = self._compile_plan(anl.CentOSDistro, network_data)
+        # The kernel defaults are not persisted
+        self.assertEqual(plan["sysctl_config"], "")
+
+        distro, plan = self._compile_plan(anl.CentOSDistro, network_data,
+                                          ipv6_dad="disabled")
+        self.assertEqual(plan["ipv6_dad_modes"],
+                         {"eth0": "disabled", "eth1": "disabled"})
+
+    def test_eni_native(self):
+        distro, plan = self._compile_plan(anl.DebianInterfacesDistro)
+        self.assertIsNone(plan["sysctl_config"])
+        content = plan["config_files"][0]["content"]
+        self.assertIn("pre-up echo 1 > /proc/sys/net/ipv6/conf/eth0/"
+                      "optimistic_dad || true", content)
+        self.assertIn("pre-up echo 0 > /proc/sys/net/ipv6/conf/eth1/"
+                      "accept_dad || true", content)
+
+    def test_networkd(self):
+        distro, plan = self._compile_plan(anl.SystemdNetworkdDistro)
+        config_files = dict((config_file["path"], config_file["content"])
+                            for config_file in plan["config_files"])
+        self.assertIn("IPv6DuplicateAddressDetection=0\n", config_files[
+            "/run/systemd/network/05-openstack-eth1.network"])
+        self.assertNotIn("IPv6DuplicateAddressDetection", config_files[
+            "/run/systemd/network/05-openstack-eth0.network"])
+        # No networkd setting for optimistic DAD, the sysctls are persisted
+        self.assertEqual(plan["sysctl_config"], SYSCTL_CONFIG)
+
+    def test_address_flags(self):
+        commands = []
+
+        def execute_process(args, **kwargs):
+            commands.append(args)
+            return "", "", 0
+
+        distro, plan = self._compile_plan(anl.DebianInterfacesDistro)
+        distro._execute_process = execute_process
+        for link in plan["links"]:
+            distro._apply_link_config(
+                link["name"], plan["link_configs"][link["id"]], None)
+        self.assertEqual([cmd for cmd in commands if "addr" in cmd], [
+            ["ip", "-6", "addr", "replace", "2001:db8::5/64", "dev", "eth0"],
+            ["ip", "-6", "addr", "replace", "2001:db8:1::5/64", "dev", "eth0",
+             "optimistic"],
+            ["ip", "-6", "addr", "replace", "2001:db8:2::5/64", "dev", "eth1",
+             "nodad"],
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import struct
+import time
+import unittest
+
+import utils
+
+anl = utils.load_apply_networking()
+
+
+def get_link_payload(ifindex, flags):
+    # struct ifinfomsg
+    return struct.pack("=BxHiII", 0, 1, ifindex, flags, 0)
+
+
+class FakeNetlink(object):
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.timeouts = []
+
+    def receive(self, timeout):
+        self.timeouts.append(timeout)
+        if not self.messages:
+            return []
+        return [self.messages.pop(0)]
+
+
+class FakeLinkStateWatcher(object):
+
+    def __init__(self, ready):
+        self.ready = ready
+        self.deadlines = []
+
+    def wait(self, ifindex, deadline):
+        self.deadlines.append(deadline)
+        return self.ready
+
+
+class LinkStateWatcherTest(unittest.TestCase):
+
+    def _get_watcher(self, messages):
+        # Without the netlink socket
+        link_watcher = anl.LinkStateWatcher.__new__(anl.LinkStateWatcher)
+        link_watcher.netlink = FakeNetlink(messages)
+        link_watcher.ready = set()
+        return link_watcher
+
+    def test_parse_link(self):
+        self.assertEqual(
+            anl.NetlinkRoute.parse_link(get_link_payload(
+                3, anl.IFF_UP | anl.IFF_LOWER_UP)),
+            (3, anl.IFF_UP | anl.IFF_LOWER_UP))
+
+    def test_wait_for_carrier(self):
+        link_watcher = self._get_watcher([
+            (anl.RTM_NEWLINK, get_link_payload(3, anl.IFF_UP)),
+            (anl.RTM_NEWLINK, get_link_payload(4, anl.IFF_UP |
+                                               anl.IFF_LOWER_UP)),
+            (anl.RTM_NEWLINK, get_link_payload(3, anl.IFF_UP |
+                                               anl.IFF_LOWER_UP)),
+        ])
+        self.assertTrue(link_watcher.wait(3, time.time() + 10))
+        self.assertEqual(link_watcher.ready, set([3, 4]))
+        # The pending notifications are processed without blocking first
+        self.assertEqual(link_watcher.netlink.timeouts[0], 0)
+
+    def test_carrier_lost(self):
+        link_watcher = self._get_watcher([
+            (anl.RTM_NEWLINK, get_link_payload(3, anl.IFF_UP |
+                                               anl.IFF_LOWER_UP)),
+            (anl.RTM_NEWLINK, get_link_payload(3, anl.IFF_UP)),
+        ])
+        link_watcher._receive(0)
+        self.assertEqual(link_watcher.ready, set([3]))
+        self.assertFalse(link_watcher.wait(3, time.time() - 1))
+        self.assertEqual(link_watcher.ready, set())
+
+    def test_loopback(self):
+        link_watcher = anl.LinkStateWatcher()
+        self.addCleanup(link_watcher.close)
+        self.assertTrue(link_watcher.wait(anl.get_link_index("lo"),
+                                          time.time() + 5))
+
+
+class WaitForLinkReadyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, anl, "get_link_index", anl.get_link_index)
+        anl.get_link_index = lambda link: 3
+
+    def test_bounded_by_link_timeout(self):
+        distro = anl.DebianInterfacesDistro(dry_run=True, link_timeout=2)
+        link_watcher = FakeLinkStateWatcher(False)
+        online_time = time.time()
+        distro._wait_for_link_ready(link_watcher, "eth0", online_time)
+        self.assertEqual(link_watcher.deadlines, [online_time + 2])
+        self.assertEqual([step for step, seconds in distro.timings],
+                         ["link eth0 ready"])
+
+    def test_bounded_by_deadline(self):
+        deadline = anl.Deadline(1)
+        distro = anl.DebianInterfacesDistro(dry_run=True, link_timeout=10,
+                                            deadline=deadline)
+        link_watcher = FakeLinkStateWatcher(True)
+        distro._wait_for_link_ready(link_watcher, "eth0", time.time())
+        self.assertEqual(link_watcher.deadlines, [deadline.end_time])
+
+
+if __name__ == "__main__":
+    unittest.main()
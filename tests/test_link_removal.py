@@ -0,0 +1,212 @@
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+import utils
+
+anl = utils.load_apply_networking()
+
+ENI_CONFIG = """# Injected by CLOUD MANAGER
+auto lo
+iface lo inet loopback
+
+auto eth0 eth1 eth10
+iface eth0 inet static
+    address 10.0.0.5/24
+    gateway 10.0.0.1
+
+iface eth1 inet static
+    address 10.1.0.5/24
+
+iface eth1:1 inet6 static
+    address 2001:db8:1::5/64
+
+allow-hotplug eth1
+iface eth10 inet dhcp
+"""
+
+ENI_CONFIG_WITHOUT_ETH1 = """# Injected by CLOUD MANAGER
+auto lo
+iface lo inet loopback
+
+auto eth0 eth10
+iface eth0 inet static
+    address 10.0.0.5/24
+    gateway 10.0.0.1
+
+iface eth10 inet dhcp
+"""
+
+SYSCTL_CONFIG = anl.NETWORKD_HEADER + """\
+net/ipv6/conf/eth0/accept_dad = 0
+net/ipv6/conf/eth1/accept_dad = 0
+net/ipv6/conf/eth1/optimistic_dad = 0
+"""
+
+
+class LinkRemovalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def _get_path(self, path):
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def _write(self, path, content):
+        file_path = self._get_path(path)
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        with open(file_path, "w") as config_file:
+            config_file.write(content)
+
+    def _read(self, path):
+        with open(self._get_path(path)) as config_file:
+            return config_file.read()
+
+    def _exists(self, path):
+        return os.path.exists(self._get_path(path))
+
+    def _remove_link(self, link, renderer):
+        result = anl.remove_link(link, renderer=renderer, root=self.root)
+        # Never applied to this host, the root is not "/"
+        self.assertEqual(result["ops"], [])
+        return result
+
+    def test_eni(self):
+        self._write("/etc/network/interfaces", ENI_CONFIG)
+        for routes_file in ("eth0.inet", "eth1.inet", "eth1.inet6",
+                            "eth10.inet"):
+            self._write(os.path.join(anl.ENI_ROUTES_DIR, routes_file), "")
+        self._write(anl.SYSCTL_DAD_CONFIG_FILE, SYSCTL_CONFIG)
+
+        self._remove_link("eth1", "eni")
+        self.assertEqual(self._read("/etc/network/interfaces"),
+                         ENI_CONFIG_WITHOUT_ETH1)
+        self.assertEqual(
+            sorted(os.listdir(self._get_path(anl.ENI_ROUTES_DIR))),
+            ["eth0.inet", "eth10.inet"])
+        self.assertEqual(self._read(anl.SYSCTL_DAD_CONFIG_FILE),
+                         anl.NETWORKD_HEADER +
+                         "net/ipv6/conf/eth0/accept_dad = 0\n")
+
+        self._remove_link("eth0", "eni")
+        self.assertFalse(self._exists(anl.SYSCTL_DAD_CONFIG_FILE))
+
+    @unittest.skipIf(yaml is None, "PyYAML is not installed")
+    def test_netplan(self):
+        config_file = "/etc/netplan/50-cloud-init.yaml"
+        self._write(config_file, yaml.dump({"network": {
+            "version": 2,
+            "ethernets": {
+                "eth0": {"addresses": ["10.0.0.5/24"]},
+                "eth1": {"addresses": ["10.1.0.5/24"]},
+            }}}))
+
+        self._remove_link("eth1", "netplan")
+        self.assertEqual(yaml.safe_load(self._read(config_file)), {
+            "network": {"version": 2, "ethernets": {
+                "eth0": {"addresses": ["10.0.0.5/24"]}}}})
+
+    def test_sysconfig(self):
+        scripts_dir = "/etc/sysconfig/network-scripts"
+        for link in ("eth0", "eth1"):
+            for prefix in ("ifcfg", "route", "route6"):
+                self._write("%s/%s-%s" % (scripts_dir, prefix, link), "")
+
+        self._remove_link("eth1", "sysconfig")
+        self.assertEqual(sorted(os.listdir(self._get_path(scripts_dir))),
+                         ["ifcfg-eth0", "route-eth0", "route6-eth0"])
+
+    def test_networkd(self):
+        config_dir = "/run/systemd/network"
+        for config_file in ("05-openstack-eth0.network",
+                            "05-openstack-eth1.network",
+                            "05-openstack-eth1.link",
+                            "06-openstack-dhcp-eth1.network"):
+            self._write(os.path.join(config_dir, config_file), "")
+
+        self._remove_link("eth1", "networkd")
+        self.assertEqual(os.listdir(self._get_path(config_dir)),
+                         ["05-openstack-eth0.network"])
+
+    def test_networkmanager(self):
+        config_dir = "/etc/NetworkManager/system-connections"
+        for link in ("eth0", "eth1"):
+            self._write("%s/openstack-%s.nmconnection" % (config_dir, link),
+                        "")
+
+        self._remove_link("eth1", "networkmanager")
+        self.assertEqual(os.listdir(self._get_path(config_dir)),
+                         ["openstack-eth0.nmconnection"])
+
+    def test_unknown_link(self):
+        self._write("/etc/network/interfaces", ENI_CONFIG)
+        self._write(anl.SYSCTL_DAD_CONFIG_FILE, SYSCTL_CONFIG)
+        self._write("/etc/sysconfig/network-scripts/ifcfg-eth0", "")
+
+        for renderer in anl.RENDERER_DISTROS:
+            if renderer == "netplan" and yaml is None:
+                continue
+            result = self._remove_link("eth9", renderer)
+            self.assertEqual(result["files_written"], [])
+            self.assertEqual(result["files_removed"], [])
+        self.assertEqual(self._read("/etc/network/interfaces"), ENI_CONFIG)
+        self.assertEqual(self._read(anl.SYSCTL_DAD_CONFIG_FILE),
+                         SYSCTL_CONFIG)
+
+
+class RemoveLinkArgsTest(unittest.TestCase):
+
+    def _parse_args(self, argv, action=None):
+        environ = dict(os.environ)
+        self.addCleanup(setattr, os, "environ", os.environ)
+        self.addCleanup(setattr, sys, "argv", sys.argv)
+        os.environ = environ
+        os.environ.pop("ACTION", None)
+        os.environ["INTERFACE"] = "eth1"
+        if action:
+            os.environ["ACTION"] = action
+        sys.argv = ["apply-networking-linux.py"] + argv
+        devnull = open(os.devnull, "w")
+        self.addCleanup(devnull.close)
+        self.addCleanup(setattr, sys, "stderr", sys.stderr)
+        sys.stderr = devnull
+        return anl.parse_args()
+
+    def test_udev_remove_event(self):
+        self.assertEqual(self._parse_args([], action="remove").remove_link,
+                         "eth1")
+        self.assertIsNone(self._parse_args(["e30="]).remove_link)
+
+    def test_network_data_rejected(self):
+        # The network data would be ignored
+        self.assertRaises(SystemExit, self._parse_args, ["e30="],
+                          action="remove")
+        self.assertRaises(SystemExit, self._parse_args,
+                          ["--remove-link", "eth1", "--file", "x.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
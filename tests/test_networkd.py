@@ -0,0 +1,179 @@
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import shutil
+import tempfile
+import unittest
+
+import utils
+
+anl = utils.load_apply_networking()
+
+INTERFACES = {"fa:16:3e:7a:61:64": "eth0", "fa:16:3e:00:00:01": "eth1"}
+NETWORK_DATA = {
+    "links": [{"id": "tap0", "mtu": 1450,
+               "ethernet_mac_address": "fa:16:3e:7a:61:64"},
+              {"id": "tap1", "mtu": 1500,
+               "ethernet_mac_address": "fa:16:3e:00:00:01"}],
+    "networks": [{
+        "id": "network0",
+        "link": "tap0",
+        "type": "ipv4",
+        "ip_address": "192.168.5.22",
+        "netmask": "255.255.255.0",
+        "routes": [{"network": "0.0.0.0", "netmask": "0.0.0.0",
+                    "gateway": "192.168.5.1"}],
+        "services": [{"type": "dns", "address": "8.8.8.8"}],
+    }, {
+        "id": "network1",
+        "link": "tap1",
+        "type": "ipv4_dhcp",
+        "services": [],
+    }],
+    "services": [],
+}
+
+ETH0_NETWORK = anl.NETWORKD_HEADER + """
+[Match]
+MACAddress=fa:16:3e:7a:61:64
+Name=eth0
+
+[Link]
+MTUBytes=1450
+
+[Network]
+DHCP=no
+DNS=8.8.8.8
+
+[Address]
+Address=192.168.5.22/24
+
+[Route]
+Destination=0.0.0.0/0
+Gateway=192.168.5.1
+"""
+
+ETH0_LINK = anl.NETWORKD_HEADER + """
+[Match]
+MACAddress=fa:16:3e:7a:61:64
+
+[Link]
+Name=eth0
+MTUBytes=1450
+"""
+
+ETH1_NETWORK = anl.NETWORKD_HEADER + """
+[Match]
+MACAddress=fa:16:3e:00:00:01
+Name=eth1
+
+[Link]
+MTUBytes=1500
+
+[Network]
+DHCP=ipv4
+"""
+
+
+class FakeDhcpClient(object):
+
+    started = []
+
+    def __init__(self, **kwargs):
+        pass
+
+    def start(self, link, family):
+        self.started.append((link, family))
+
+    def watch(self, link, family):
+        pass
+
+    def wait(self):
+        return []
+
+
+class FakeLinkStateWatcher(object):
+
+    def close(self):
+        pass
+
+
+class SystemdNetworkdDistroTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def _compile_plan(self, distro):
+        return distro.compile_plan(NETWORK_DATA, INTERFACES,
+                                   reset_to_dhcp=True)
+
+    def test_rendered_files(self):
+        plan = self._compile_plan(anl.SystemdNetworkdDistro(dry_run=True))
+        config_files = dict((config_file["path"], config_file)
+                            for config_file in plan["config_files"])
+        self.assertEqual(sorted(config_files), [
+            "/run/systemd/network/05-openstack-eth0.link",
+            "/run/systemd/network/05-openstack-eth0.network",
+            "/run/systemd/network/05-openstack-eth1.link",
+            "/run/systemd/network/05-openstack-eth1.network",
+        ])
+
+        eth0_network = config_files[
+            "/run/systemd/network/05-openstack-eth0.network"]
+        self.assertEqual(eth0_network["content"], ETH0_NETWORK)
+        # Only the .network files trigger a link reconfiguration
+        self.assertEqual(eth0_network["link"], "eth0")
+        eth0_link = config_files["/run/systemd/network/05-openstack-eth0.link"]
+        self.assertEqual(eth0_link["content"], ETH0_LINK)
+        self.assertIsNone(eth0_link["link"])
+        self.assertEqual(config_files[
+            "/run/systemd/network/05-openstack-eth1.network"]["content"],
+            ETH1_NETWORK)
+
+    def test_reload_failure_starts_no_dhcp_client(self):
+        commands = []
+
+        def execute_process(args, **kwargs):
+            commands.append(args)
+            if args == ["networkctl", "reload"]:
+                return "", "Unknown operation reload", 1
+            return "", "", 0
+
+        for name, value in [("DhcpClient", FakeDhcpClient),
+                            ("LinkStateWatcher", FakeLinkStateWatcher)]:
+            self.addCleanup(setattr, anl, name, getattr(anl, name))
+            setattr(anl, name, value)
+        self.addCleanup(setattr, FakeDhcpClient, "started", [])
+        FakeDhcpClient.started = []
+
+        distro = anl.SystemdNetworkdDistro(root=self.root)
+        distro._execute_process = execute_process
+        distro._get_primary_links = lambda: set()
+        distro._wait_for_link_ready = lambda *args: None
+        plan = self._compile_plan(distro)
+        distro.config_changed = True
+        distro.changed_links = ["eth0", "eth1"]
+
+        distro.apply_network_config(plan)
+        # The static config is applied with ip
+        self.assertIn(["ip", "-4", "addr", "replace", "192.168.5.22/24",
+                       "dev", "eth0"], commands)
+        self.assertNotIn(["networkctl", "reconfigure", "eth0", "eth1"],
+                         commands)
+        self.assertEqual(FakeDhcpClient.started, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import unittest
+
+import utils
+
+anl = utils.load_apply_networking()
+
+MAC_ADDRESS = "fa:16:3e:7a:61:64"
+CONNECTION_UUID = "5489a0cc-800f-54b4-b117-1bd09d4c2663"
+
+
+class NetworkManagerDistroTest(unittest.TestCase):
+
+    def test_connection_uuid(self):
+        self.assertEqual(anl.get_connection_uuid(MAC_ADDRESS),
+                         CONNECTION_UUID)
+
+    def test_connection_uuid_unicode(self):
+        # The MAC addresses parsed from JSON are unicode on Python 2
+        self.assertEqual(anl.get_connection_uuid(u"fa:16:3e:7a:61:64"),
+                         CONNECTION_UUID)
+
+    def test_compile_plan(self):
+        network_data = json.loads(anl.EXAMPLE_JSON_METADATA)
+        distro = anl.NetworkManagerDistro(dry_run=True)
+        plan = distro.compile_plan(network_data, {MAC_ADDRESS: "eth0"})
+
+        self.assertEqual(len(plan["config_files"]), 1)
+        config_file = plan["config_files"][0]
+        self.assertEqual(config_file["link"], "eth0")
+        self.assertEqual(config_file["mode"], 0o600)
+        self.assertIn("uuid=%s\n" % CONNECTION_UUID, config_file["content"])
+        self.assertIn("mac-address=%s\n" % MAC_ADDRESS.upper(),
+                      config_file["content"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,252 @@
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import utils
+
+anl = utils.load_apply_networking()
+
+MAC_ADDRESS = "fa:16:3e:7a:61:64"
+INTERFACES = {MAC_ADDRESS: "eth0"}
+
+
+def get_network_data(dns="8.8.8.8"):
+    return {
+        "links": [{"id": "tap0", "mtu": 1450,
+                   "ethernet_mac_address": MAC_ADDRESS}],
+        "networks": [{
+            "id": "network0",
+            "link": "tap0",
+            "type": "ipv4",
+            "ip_address": "192.168.5.22",
+            "netmask": "255.255.255.0",
+            "routes": [{"network": "0.0.0.0", "netmask": "0.0.0.0",
+                        "gateway": "192.168.5.1"}],
+            "services": [{"type": "dns", "address": dns}],
+        }],
+        "services": [],
+    }
+
+
+class ValidateNetworkDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.distro = anl.DebianInterfacesDistro(dry_run=True)
+        self.distro.interfaces = INTERFACES
+
+    def _get_errors(self, network_data):
+        try:
+            self.distro.validate_network_data(network_data)
+        except Exception as ex:
+            return str(ex)
+        self.fail("The network data is valid")
+
+    def test_valid(self):
+        self.distro.validate_network_data(get_network_data())
+
+    def test_no_lists(self):
+        self.assertIn("no links or networks list",
+                      self._get_errors({"links": {}, "networks": []}))
+        self.assertIn("no links or networks list",
+                      self._get_errors({"links": []}))
+
+    def test_link_errors(self):
+        network_data = get_network_data()
+        network_data["links"] += [
+            {"id": "tap1"},
+            {"id": "tap2", "mtu": 1500,
+             "ethernet_mac_address": "fa:16:3e:00:00:02"},
+            {"id": "tap3", "mtu": "big",
+             "ethernet_mac_address": MAC_ADDRESS},
+        ]
+        errors = self._get_errors(network_data)
+        self.assertIn("has no id or MAC address", errors)
+        self.assertIn("Link could not be found fa:16:3e:00:00:02", errors)
+        self.assertIn("Link tap3 has no valid MTU", errors)
+
+    def test_network_errors(self):
+        network_data = get_network_data()
+        network = network_data["networks"][0]
+        network_data["networks"] += [
+            dict(network, id="network1", link="missing"),
+            dict(network, id="network2", type="ipv5"),
+            dict(network, id="network3", ip_address="192.168.5.300"),
+            dict(network, id="network4", routes=[
+                {"network": "10.0.0.0", "netmask": "255.0.0.0",
+                 "gateway": "not-an-address"}]),
+            dict(network, id="network5", type="ipv6",
+                 ip_address="2001:db8::10", netmask="64",
+                 routes=[{"network": "::", "netmask": "::",
+                          "gateway": "2001:db8::1"}],
+                 ipv6_dad="sometimes"),
+        ]
+        errors = self._get_errors(network_data)
+        self.assertIn("Link not found for net network1", errors)
+        self.assertIn("Network type ipv5 not supported for network2", errors)
+        self.assertIn("Network network3 is not valid", errors)
+        self.assertIn("of network network4 is not valid", errors)
+        self.assertIn("Network network5 is not valid", errors)
+
+    def test_gateway_required(self):
+        network_data = get_network_data()
+        network_data["networks"][0]["routes"] = []
+        self.assertIn("No gateways have been found for network0",
+                      self._get_errors(network_data))
+
+        distro = anl.SystemdNetworkdDistro(dry_run=True)
+        distro.interfaces = INTERFACES
+        distro.validate_network_data(network_data)
+
+    def test_dhcp_network_not_checked(self):
+        network_data = get_network_data()
+        network_data["networks"][0] = {
+            "id": "network0", "link": "tap0", "type": "ipv4_dhcp"}
+        self.distro.validate_network_data(network_data)
+
+
+class PlanCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        get_os_net_interface_index = anl.get_os_net_interface_index
+        anl.get_os_net_interface_index = lambda: dict(INTERFACES)
+        self.addCleanup(setattr, anl, "get_os_net_interface_index",
+                        get_os_net_interface_index)
+        self.cache_dir = os.path.join(self.root,
+                                      anl.PLAN_CACHE_DIR.lstrip("/"))
+
+    def _get_distro(self, **kwargs):
+        return anl.DebianInterfacesDistro(root=self.root, **kwargs)
+
+    def test_plan_key(self):
+        plan_input = {"network_data": get_network_data(), "ipv6_dad": "x"}
+        key = anl.get_plan_key(plan_input)
+        self.assertEqual(key, anl.get_plan_key(copy.deepcopy(plan_input)))
+        self.assertNotEqual(key, anl.get_plan_key(
+            dict(plan_input, ipv6_dad="y")))
+
+    def test_cached_plan(self):
+        plan = self._get_distro().get_plan(get_network_data())
+        self.assertTrue(os.path.exists(
+            os.path.join(self.cache_dir, "%s.json" % plan["key"])))
+
+        distro = self._get_distro()
+        distro.compile_plan = None
+        self.assertEqual(distro.get_plan(get_network_data()),
+                         json.loads(json.dumps(plan)))
+
+    def test_plan_key_inputs(self):
+        network_data = get_network_data()
+        key = self._get_distro().get_plan(network_data)["key"]
+        self.assertNotEqual(key, self._get_distro(
+            ipv6_dad="disabled").get_plan(network_data)["key"])
+        self.assertNotEqual(key, self._get_distro(
+            dhcp_backend="networkd").get_plan(network_data)["key"])
+        self.assertNotEqual(key, self._get_distro().get_plan(
+            network_data, reset_to_dhcp=True)["key"])
+
+    def test_dns_only_change(self):
+        plan = self._get_distro().get_plan(get_network_data())
+        dns_plan = self._get_distro().get_plan(get_network_data("1.1.1.1"))
+        self.assertNotEqual(plan["key"], dns_plan["key"])
+        self.assertEqual(plan["network_key"], dns_plan["network_key"])
+
+    def test_no_cache_on_dry_run(self):
+        self._get_distro(dry_run=True).get_plan(get_network_data())
+        self.assertEqual(anl.get_dir_files(self.cache_dir), [])
+
+    def test_load_plan_key_mismatch(self):
+        plan = self._get_distro().get_plan(get_network_data())
+        os.rename(os.path.join(self.cache_dir, "%s.json" % plan["key"]),
+                  os.path.join(self.cache_dir, "other.json"))
+        self.assertIsNone(anl.load_plan("other", self.cache_dir))
+        self.assertIsNone(anl.load_plan(plan["key"], self.cache_dir))
+
+    def test_cache_pruned(self):
+        for index in range(anl.PLAN_CACHE_SIZE + 2):
+            anl.save_plan({"key": "plan%d" % index}, self.cache_dir)
+        self.assertEqual(len(anl.get_dir_files(self.cache_dir)),
+                         anl.PLAN_CACHE_SIZE)
+
+
+class ConfigureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        get_os_net_interface_index = anl.get_os_net_interface_index
+        anl.get_os_net_interface_index = lambda: dict(INTERFACES)
+        self.addCleanup(setattr, anl, "get_os_net_interface_index",
+                        get_os_net_interface_index)
+
+    def test_other_root_not_applied(self):
+        result = anl.configure(get_network_data(), renderer="eni",
+                               root=self.root, apply=True)
+        self.assertIsNotNone(result["plan"])
+        self.assertEqual(result["files_written"], [
+            os.path.join(self.root, "etc/network/interfaces")])
+        self.assertEqual(result["ops"], [])
+
+    def test_can_apply(self):
+        self.assertTrue(anl.DebianInterfacesDistro().can_apply())
+        self.assertFalse(anl.DebianInterfacesDistro().can_apply(False))
+        self.assertFalse(
+            anl.DebianInterfacesDistro(dry_run=True).can_apply())
+        self.assertFalse(
+            anl.DebianInterfacesDistro(root=self.root).can_apply())
+
+    def test_renderer_required_with_root(self):
+        self.assertRaises(Exception, anl.configure, get_network_data(),
+                          root=self.root, apply=False)
+        self.assertEqual(os.listdir(self.root), [])
+
+
+class NormalizeTest(unittest.TestCase):
+
+    def test_normalize_address(self):
+        self.assertEqual(anl.normalize_address("10.0.0.5/24"), "10.0.0.5/24")
+        self.assertEqual(anl.normalize_address("2001:db8:0::10/64"),
+                         "2001:db8::10/64")
+        self.assertEqual(anl.normalize_address("2001:DB8::A"), "2001:db8::a")
+        self.assertRaises(Exception, anl.normalize_address, "10.0.0.300")
+
+    def test_normalize_route_destination(self):
+        for destination, expected in [
+                ("default", "default"),
+                ("0.0.0.0/0", "default"),
+                ("::/0", "default"),
+                ("169.254.169.254/32", "169.254.169.254"),
+                ("2001:db8::1/128", "2001:db8::1"),
+                ("10.0.0.0/8", "10.0.0.0/8"),
+                ("2001:db8:5:0::/64", "2001:db8:5::/64"),
+                ("10.1.2.3", "10.1.2.3")]:
+            self.assertEqual(anl.normalize_route_destination(destination),
+                             expected)
+
+    def test_mask_to_net_prefix(self):
+        self.assertEqual(anl.mask_to_net_prefix("255.255.255.0"), 24)
+        self.assertEqual(anl.mask_to_net_prefix("0.0.0.0"), 0)
+        self.assertEqual(anl.mask_to_net_prefix("ffff:ffff:ffff:ffff::"), 64)
+        self.assertEqual(anl.mask_to_net_prefix("64"), 64)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import base64
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import utils
+
+anl = utils.load_apply_networking()
+
+NETWORK_DATA = {
+    "links": [{"id": "tap0", "mtu": 1450,
+               "ethernet_mac_address": "fa:16:3e:7a:61:64"}],
+    # A multi byte UTF-8 character, split across the chunks
+    "networks": [{"id": u"r\u00e9seau0", "link": "tap0",
+                  "type": "ipv4_dhcp"}],
+    "services": [],
+}
+NETWORK_DATA_JSON = json.dumps(NETWORK_DATA, ensure_ascii=False).encode(
+    "utf-8")
+CHUNK_SIZES = (1, 2, 3, 5, 7, 64 * 1024)
+
+
+class ReadNetworkDataTest(unittest.TestCase):
+
+    def _read(self, data, chunk_size):
+        return anl.read_network_data(io.BytesIO(data), chunk_size=chunk_size)
+
+    def test_json(self):
+        for chunk_size in CHUNK_SIZES:
+            self.assertEqual(
+                self._read(b"\n  " + NETWORK_DATA_JSON, chunk_size),
+                NETWORK_DATA)
+
+    def test_base64(self):
+        b64_data = base64.b64encode(NETWORK_DATA_JSON)
+        # Wrapped like the base64 tool output
+        wrapped_b64_data = b"\n".join(
+            b64_data[i:i + 76] for i in range(0, len(b64_data), 76)) + b"\n"
+        for chunk_size in CHUNK_SIZES:
+            self.assertEqual(self._read(b64_data, chunk_size), NETWORK_DATA)
+            self.assertEqual(self._read(b"  \r\n" + wrapped_b64_data,
+                                        chunk_size), NETWORK_DATA)
+
+    def test_empty(self):
+        for data in (b"", b" \n\t"):
+            for chunk_size in CHUNK_SIZES:
+                self.assertIsNone(self._read(data, chunk_size))
+
+    def test_invalid_base64(self):
+        b64_data = base64.b64encode(NETWORK_DATA_JSON)
+        self.assertRaises(Exception, self._read, b64_data[:-1], 3)
+
+    def test_file_and_fd(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        file_path = os.path.join(tmp_dir, "network_data.json")
+        with open(file_path, "wb") as network_data_file:
+            network_data_file.write(NETWORK_DATA_JSON)
+
+        with anl.open_network_data(file_path=file_path) as stream:
+            self.assertEqual(anl.read_network_data(stream), NETWORK_DATA)
+        fd = os.open(file_path, os.O_RDONLY)
+        with anl.open_network_data(fd=fd) as stream:
+            self.assertEqual(anl.read_network_data(stream), NETWORK_DATA)
+        self.assertRaises(Exception, anl.open_network_data)
+
+
+if __name__ == "__main__":
+    unittest.main()
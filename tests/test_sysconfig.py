@@ -0,0 +1,81 @@
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+
+import utils
+
+anl = utils.load_apply_networking()
+
+MAC_ADDRESS = "fa:16:3e:7a:61:64"
+INTERFACES = {MAC_ADDRESS: "eth0"}
+NETWORK_DATA = {
+    "links": [{"id": "tap0", "mtu": 1450,
+               "ethernet_mac_address": MAC_ADDRESS}],
+    "networks": [{
+        "id": "network0",
+        "link": "tap0",
+        "type": "ipv4",
+        "ip_address": "192.168.5.22",
+        "netmask": "255.255.255.0",
+        # The routes before the default route have their own gateway too
+        "routes": [{"network": "10.10.0.0", "netmask": "255.255.0.0",
+                    "gateway": "192.168.5.254"},
+                   {"network": "0.0.0.0", "netmask": "0.0.0.0",
+                    "gateway": "192.168.5.1"},
+                   {"network": "10.20.0.0", "netmask": "255.255.0.0",
+                    "gateway": "192.168.5.253"}],
+        "services": [],
+    }, {
+        "id": "network1",
+        "link": "tap0",
+        "type": "ipv6",
+        "ip_address": "2001:db8::22",
+        "netmask": "ffff:ffff:ffff:ffff::",
+        "routes": [{"network": "::", "netmask": "::",
+                    "gateway": "2001:db8::1"},
+                   {"network": "2001:db8:1::", "netmask": "ffff:ffff:ffff::",
+                    "gateway": "2001:db8::fe"}],
+        "services": [],
+    }],
+    "services": [],
+}
+
+
+class CentOSDistroTest(unittest.TestCase):
+
+    def setUp(self):
+        distro = anl.CentOSDistro(dry_run=True)
+        plan = distro.compile_plan(NETWORK_DATA, INTERFACES)
+        self.config_files = dict(
+            (config_file["path"], config_file["content"])
+            for config_file in plan["config_files"])
+
+    def test_default_gateway(self):
+        ifcfg = self.config_files["/etc/sysconfig/network-scripts/ifcfg-eth0"]
+        self.assertIn("GATEWAY=192.168.5.1\n", ifcfg)
+        self.assertIn("IPV6_DEFAULTGW=2001:db8::1%eth0\n", ifcfg)
+
+    def test_route_gateways(self):
+        self.assertEqual(
+            self.config_files["/etc/sysconfig/network-scripts/route-eth0"],
+            "10.10.0.0/16 via 192.168.5.254 dev eth0\n"
+            "10.20.0.0/16 via 192.168.5.253 dev eth0")
+        self.assertEqual(
+            self.config_files["/etc/sysconfig/network-scripts/route6-eth0"],
+            "2001:db8:1::/48 via 2001:db8::fe dev eth0")
+
+
+if __name__ == "__main__":
+    unittest.main()
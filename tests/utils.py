@@ -0,0 +1,34 @@
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import sys
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                           "src", "apply-networking-linux.py")
+
+
+def load_apply_networking():
+    """Import the standalone script, its file name is not a module name"""
+    if sys.version_info[0] >= 3:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location(
+            "apply_networking_linux", SCRIPT_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    import imp
+    sys.dont_write_bytecode = True
+    return imp.load_source("apply_networking_linux", SCRIPT_PATH)
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""OpenStack metadata service emulator, with latency and fault injection
+
+Serves the endpoints used by the agents from a fixtures directory:
+
+    /openstack/latest/network_data.json  <fixtures>/network_data.json
+    /openstack/content/0000              <fixtures>/content/0000
+    /openstack/latest/password           <fixtures>/password (GET and POST)
+
+Faults can be injected on each request: a fixed latency with jitter, hung
+requests (timeouts) and 5xx errors. Content updates, either made to the
+fixture files or with a PUT on /_emulator/<endpoint>, become visible only
+after --update-delay seconds, like the metadata updated after the udev
+NIC remove event. Request counters are available on /_emulator/stats.
+
+In load mode, many VMs poll the service in parallel, with the same retry
+settings as cloud_init_apply_net.py: requests of 3 seconds at most, retried
+3 times 1 second apart, wrapped in a retry_decorator with 5 retries and 5
+seconds between them, all within the 120 seconds event deadline.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from http import server
+
+NETWORK_DATA_PATH = "/openstack/latest/network_data.json"
+LEGACY_NETWORK_DATA_PATH = "/openstack/content/0000"
+PASSWORD_PATH = "/openstack/latest/password"
+EMULATOR_PATH = "/_emulator"
+
+ENDPOINT_FIXTURES = {
+    NETWORK_DATA_PATH: "network_data.json",
+    LEGACY_NETWORK_DATA_PATH: os.path.join("content", "0000"),
+    PASSWORD_PATH: "password",
+}
+
+DEFAULT_NETWORK_DATA = {
+    "links": [{
+        "id": "tapef0ec56c-88",
+        "mtu": 1420,
+        "ethernet_mac_address": "fa:16:3e:7a:61:64"
+    }],
+    "networks": [{
+        "id": "network0",
+        "link": "tapef0ec56c-88",
+        "type": "ipv4",
+        "netmask": "255.255.255.0",
+        "ip_address": "192.168.5.22",
+        "routes": [{
+            "network": "0.0.0.0",
+            "netmask": "0.0.0.0",
+            "gateway": "192.168.5.1"
+        }],
+        "services": [{"type": "dns", "address": "8.8.8.8"}]
+    }],
+    "services": [{"type": "dns", "address": "1.1.1.1"}]
+}
+
+
+class FaultInjector(object):
+    """Decides the fate of each request"""
+
+    def __init__(self, latency=0, jitter=0, timeout_rate=0, hang_time=30,
+                 error_rate=0, error_code=503, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.timeout_rate = timeout_rate
+        self.hang_time = hang_time
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def get_fault(self):
+        """Return (delay, fault), fault being None, "timeout" or "error\""""
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            dice = self.random.random()
+        if dice < self.timeout_rate:
+            return self.hang_time, "timeout"
+        if dice < self.timeout_rate + self.error_rate:
+            return delay, "error"
+        return delay, None
+
+
+class MetadataStore(object):
+    """Endpoint contents, with delayed visibility of the updates"""
+
+    def __init__(self, fixtures_dir=None, update_delay=0):
+        self.fixtures_dir = fixtures_dir
+        self.update_delay = update_delay
+        self.lock = threading.Lock()
+        # endpoint => (visible content, [(visible_at, content)])
+        self.contents = {}
+        self.fixture_mtimes = {}
+        for endpoint in ENDPOINT_FIXTURES:
+            content = self._read_fixture(endpoint)
+            if content is None and endpoint == NETWORK_DATA_PATH:
+                content = json.dumps(DEFAULT_NETWORK_DATA).encode()
+            self.contents[endpoint] = (content, [])
+
+    def _get_fixture_path(self, endpoint):
+        if not self.fixtures_dir:
+            return None
+        return os.path.join(self.fixtures_dir, ENDPOINT_FIXTURES[endpoint])
+
+    def _read_fixture(self, endpoint):
+        fixture_path = self._get_fixture_path(endpoint)
+        if not fixture_path or not os.path.exists(fixture_path):
+            return None
+        self.fixture_mtimes[endpoint] = os.stat(fixture_path).st_mtime
+        with open(fixture_path, "rb") as fixture:
+            return fixture.read()
+
+    def _check_fixture_update(self, endpoint):
+        fixture_path = self._get_fixture_path(endpoint)
+        if not fixture_path or not os.path.exists(fixture_path):
+            return
+        if (os.stat(fixture_path).st_mtime !=
+                self.fixture_mtimes.get(endpoint)):
+            self._update(endpoint, self._read_fixture(endpoint))
+
+    def _update(self, endpoint, content, delayed=True):
+        visible, updates = self.contents[endpoint]
+        if not delayed:
+            self.contents[endpoint] = (content, [])
+            return
+        updates.append((time.time() + self.update_delay, content))
+
+    def update(self, endpoint, content, delayed=True):
+        with self.lock:
+            self._update(endpoint, content, delayed)
+
+    def get(self, endpoint):
+        with self.lock:
+            self._check_fixture_update(endpoint)
+            visible, updates = self.contents[endpoint]
+            now = time.time()
+            while updates and updates[0][0] <= now:
+                visible = updates.pop(0)[1]
+            self.contents[endpoint] = (visible, updates)
+            return visible
+
+
+class MetadataHandler(server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _count(self, key):
+        with self.server.stats_lock:
+            self.server.stats[key] = self.server.stats.get(key, 0) + 1
+
+    def _send(self, code, content=b"", content_type="text/plain"):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length)
+
+    def _handle_emulator(self):
+        if self.command == "GET" and self.path == EMULATOR_PATH + "/stats":
+            with self.server.stats_lock:
+                stats = json.dumps(self.server.stats, indent=4)
+            self._send(200, stats.encode(), "application/json")
+            return
+
+        endpoint = self.path[len(EMULATOR_PATH):]
+        if self.command == "PUT" and endpoint in ENDPOINT_FIXTURES:
+            self.server.store.update(endpoint, self._read_body())
+            self._send(200)
+            return
+        self._send(404)
+
+    def _handle(self):
+        if self.path.startswith(EMULATOR_PATH + "/"):
+            self._handle_emulator()
+            return
+
+        self._count("requests")
+        delay, fault = self.server.faults.get_fault()
+        if fault == "timeout":
+            self._count("timeouts")
+        if delay:
+            time.sleep(delay)
+        if fault == "timeout":
+            # Do not answer, like an unreachable or overloaded service
+            self.close_connection = True
+            return
+        if fault == "error":
+            self._count("errors")
+            self._send(self.server.faults.error_code)
+            return
+
+        if self.path not in ENDPOINT_FIXTURES:
+            self._count("not_found")
+            self._send(404)
+            return
+
+        if self.command == "POST":
+            if self.path != PASSWORD_PATH:
+                self._send(405)
+                return
+            # The password can be set only once, like in Nova
+            if self.server.store.get(PASSWORD_PATH):
+                self._count("conflicts")
+                self._send(409)
+                return
+            self.server.store.update(PASSWORD_PATH, self._read_body(),
+                                     delayed=False)
+            self._count("posts")
+            self._send(200)
+            return
+
+        content = self.server.store.get(self.path)
+        if content is None:
+            self._count("not_found")
+            self._send(404)
+            return
+        self._count("ok")
+        content_type = "text/plain"
+        if self.path.endswith(".json"):
+            content_type = "application/json"
+        self._send(200, content, content_type)
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_PUT(self):
+        self._handle()
+
+
+class MetadataServer(server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, store, faults, verbose=False):
+        server.ThreadingHTTPServer.__init__(self, address, MetadataHandler)
+        self.store = store
+        self.faults = faults
+        self.verbose = verbose
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class PollingVM(object):
+    """Fetches the network data with the cloud_init_apply_net.py retries
+
+    The inner loop is try_read_url: each request times out after timeout
+    seconds, capped to the remaining time, and is retried up to retries
+    times, retry_sleep seconds apart. The outer loop is the
+    retry_decorator(max_retry_count, sleep_time) of set_network_config.
+    Both schedule a retry only if it fits in the event deadline.
+    """
+
+    def __init__(self, url, timeout=3, retries=3, retry_sleep=1,
+                 max_retry_count=5, sleep_time=5, deadline=120):
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_sleep = retry_sleep
+        self.max_retry_count = max_retry_count
+        self.sleep_time = sleep_time
+        self.deadline = deadline
+        self.end_time = None
+        self.requests = 0
+        self.elapsed = None
+        self.success = False
+
+    def _remaining(self):
+        return max(self.end_time - time.time(), 0)
+
+    def _read_url(self):
+        try_count = 0
+        while True:
+            remaining = self._remaining()
+            if not remaining:
+                raise DeadlineExceeded()
+            self.requests += 1
+            try:
+                with urllib.request.urlopen(
+                        self.url,
+                        timeout=min(self.timeout, remaining)) as resp:
+                    return resp.read()
+            except Exception:
+                try_count += 1
+                if (try_count > self.retries or
+                        self._remaining() <= self.retry_sleep):
+                    raise
+                time.sleep(self.retry_sleep)
+
+    def run(self):
+        start = time.time()
+        self.end_time = start + self.deadline
+        try_count = 0
+        while True:
+            try:
+                self._read_url()
+                self.success = True
+                break
+            except DeadlineExceeded:
+                break
+            except Exception:
+                if (try_count == self.max_retry_count or
+                        self._remaining() <= self.sleep_time):
+                    break
+                try_count += 1
+                time.sleep(self.sleep_time)
+        self.elapsed = time.time() - start
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile"""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = max(int(round(percent / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def format_seconds(value):
+    if value is None:
+        return "-"
+    return "%.2fs" % value
+
+
+def run_load(args, url):
+    vms = [PollingVM(url, timeout=args.url_timeout,
+                     retries=args.url_retries,
+                     retry_sleep=args.url_retry_sleep,
+                     max_retry_count=args.retry_count,
+                     sleep_time=args.retry_sleep,
+                     deadline=args.deadline)
+           for _ in range(args.load)]
+    threads = []
+    start = time.time()
+    for vm in vms:
+        thread = threading.Thread(target=vm.run)
+        thread.daemon = True
+        threads.append(thread)
+        thread.start()
+        if args.ramp_up:
+            time.sleep(args.ramp_up / float(args.load))
+    for thread in threads:
+        thread.join()
+
+    elapsed = [vm.elapsed for vm in vms if vm.success]
+    failed = [vm.elapsed for vm in vms if not vm.success]
+    print("VMs: %d, succeeded: %d, gave up: %d, requests: %d, wall time: %s"
+          % (len(vms), len(elapsed), len(failed),
+             sum(vm.requests for vm in vms),
+             format_seconds(time.time() - start)))
+    print("time to network data: p50 %s, p90 %s, p99 %s, max %s" % (
+        format_seconds(percentile(elapsed, 50)),
+        format_seconds(percentile(elapsed, 90)),
+        format_seconds(percentile(elapsed, 99)),
+        format_seconds(max(elapsed) if elapsed else None)))
+    if failed:
+        print("time to give up: max %s" % format_seconds(max(failed)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="OpenStack metadata service emulator with fault "
+                    "injection")
+    parser.add_argument("--fixtures",
+                        help="Directory with network_data.json, "
+                             "content/0000 and password")
+    parser.add_argument("--bind", default="127.0.0.1",
+                        help="Address to listen on, like 169.254.169.254")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="Seconds added to each response")
+    parser.add_argument("--jitter", type=float, default=0,
+                        help="Random seconds added on top of the latency")
+    parser.add_argument("--timeout-rate", type=float, default=0,
+                        help="Fraction of the requests never answered")
+    parser.add_argument("--hang-time", type=float, default=30,
+                        help="Seconds a never answered request is held")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="Fraction of the requests answered with an "
+                             "error")
+    parser.add_argument("--error-code", type=int, default=503,
+                        help="HTTP error code, 5xx")
+    parser.add_argument("--update-delay", type=float, default=0,
+                        help="Seconds before a content update is served")
+    parser.add_argument("--seed", type=int,
+                        help="Random seed, for reproducible faults")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Log the requests")
+
+    load = parser.add_argument_group("load mode")
+    load.add_argument("--load", type=int, default=0,
+                      help="Number of VMs polling the service")
+    load.add_argument("--url",
+                      help="Network data URL to poll, the emulator is "
+                           "started locally if not set")
+    load.add_argument("--ramp-up", type=float, default=0,
+                      help="Seconds over which the VMs are started")
+    load.add_argument("--url-timeout", type=float, default=3,
+                      help="Seconds before a request times out")
+    load.add_argument("--url-retries", type=int, default=3)
+    load.add_argument("--url-retry-sleep", type=float, default=1)
+    load.add_argument("--retry-count", type=int, default=5)
+    load.add_argument("--retry-sleep", type=float, default=5)
+    load.add_argument("--deadline", type=float, default=120,
+                      help="Seconds each VM has to get the network data")
+    args = parser.parse_args()
+    if args.url and not args.load:
+        parser.error("--url is only polled in load mode, set --load")
+    return args
+
+
+def main():
+    args = parse_args()
+
+    httpd = None
+    url = args.url
+    if not url:
+        store = MetadataStore(args.fixtures, update_delay=args.update_delay)
+        faults = FaultInjector(latency=args.latency, jitter=args.jitter,
+                               timeout_rate=args.timeout_rate,
+                               hang_time=args.hang_time,
+                               error_rate=args.error_rate,
+                               error_code=args.error_code, seed=args.seed)
+        httpd = MetadataServer((args.bind, args.port), store, faults,
+                               verbose=args.verbose)
+        url = "http://%s:%d%s" % (args.bind, httpd.server_address[1],
+                                  NETWORK_DATA_PATH)
+
+    if not args.load:
+        print("Serving on %s" % url, flush=True)
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    if httpd:
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+    run_load(args, url)
+    if httpd:
+        print("server stats: %s" % json.dumps(httpd.stats, sort_keys=True))
+        httpd.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
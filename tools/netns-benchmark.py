@@ -0,0 +1,652 @@
+#!/usr/bin/env python3
+# Copyright 2020 Cloudbase Solutions Srl
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""End to end NIC hotplug convergence benchmark
+
+Runs on a single Linux host, as root, without any network access. Two
+network namespaces are created: a "cloud" namespace holding the gateways
+and a metadata service on 169.254.169.254, and a "vm" namespace where the
+network config tools run. Each NIC is a veth pair with a known MAC address,
+the NIC add / remove events are simulated by moving the VM end of the pairs
+in and out of the "vm" namespace, all at once (burst). As with udev, each
+NIC of a burst is its own event: the tool runs once per NIC, the events are
+handled one after the other.
+
+The VM always has a primary NIC carrying the default route and the route to
+the metadata service, the measured NICs are added on top of it.
+
+The latency is measured from the burst to the moment the VM network is
+ready and the last event was handled: all the addresses are present and not
+tentative, all the routes are installed and all the gateways are reachable.
+After a remove burst, the addresses, routes and config files of the removed
+NICs must also be gone, otherwise the run is counted as a failure.
+
+The tools run in the "vm" namespace with overlays mounted on /etc and
+/var/lib and a private directory on /run, so the rendered config files and
+the state never reach the host. They are kept for all the events of a run,
+like the disk of a VM. The service managers (systemctl, service, netplan) are
+replaced with no-ops for the same reason, which means that only the
+renderers applying the config with "ip" can be compared (eni, netplan,
+sysconfig). The shims report all the services as inactive, so that the DNS
+servers are not set through the systemd-resolved of the host.
+"""
+
+import argparse
+import base64
+import ipaddress
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from http import server
+
+CLOUD_NS = "osnd-bench-cloud"
+VM_NS = "osnd-bench-vm"
+METADATA_IP = "169.254.169.254"
+MAC_ADDRESS_TEMPLATE = "fa:16:3e:be:00:%02x"
+PRIMARY_NIC = 0
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                       "src")
+APPLY_NETWORKING_LINUX = os.path.join(SRC_DIR, "apply-networking-linux.py")
+CLOUD_INIT_APPLY_NET = os.path.join(SRC_DIR, "cloud_init_apply_net.py")
+
+TOOLS = ["apply-networking-linux", "cloud-init"]
+RENDERERS = ["eni", "netplan", "sysconfig"]
+SCENARIOS = ["add", "remove"]
+SERVICE_MANAGERS = ["systemctl", "service", "netplan"]
+SERVICE_MANAGER_SHIM = """#!/bin/sh
+# The host services are not reachable from the benchmark
+if [ "$1" = "is-active" ]; then
+    exit 3
+fi
+exit 0
+"""
+# Private to each tool run: the config files, the state and the caches
+OVERLAY_DIRS = ["/etc", "/var/lib"]
+
+PROBE_INTERVAL = 0.005
+PROBE_CONNECT_TIMEOUT = 0.2
+
+
+def run(args, check=True, **kwargs):
+    p = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                       universal_newlines=True, **kwargs)
+    if check and p.returncode:
+        raise Exception("%s failed: %s" % (" ".join(args), p.stderr))
+    return p
+
+
+def ip_batch(namespace, commands):
+    """Run multiple ip commands with a single ip process"""
+    args = ["ip"]
+    if namespace:
+        args += ["-n", namespace]
+    run(args + ["-batch", "-"], input="\n".join(commands) + "\n")
+
+
+def nic_names(index):
+    return "osndc%d" % index, "osndv%d" % index
+
+
+def get_nic_config(index, ipv6=True):
+    """Return the addressing of the NIC pair with the given index"""
+    config = {
+        "mac_address": MAC_ADDRESS_TEMPLATE % index,
+        "ipv4_gateway": "10.%d.0.1" % (100 + index),
+        "ipv4_address": "10.%d.0.10" % (100 + index),
+        "ipv4_route": "10.%d.0.0/24" % (200 + index),
+        "ipv6_gateway": None,
+        "ipv6_address": None,
+    }
+    if ipv6:
+        config["ipv6_gateway"] = str(
+            ipaddress.ip_address("2001:db8:%x::1" % index))
+        config["ipv6_address"] = str(
+            ipaddress.ip_address("2001:db8:%x::10" % index))
+    return config
+
+
+def get_network_data(nics, ipv6=True):
+    """Return the OpenStack network_data.json for the given NIC indexes"""
+    network_data = {"links": [], "networks": [], "services": []}
+    for index in nics:
+        nic_config = get_nic_config(index, ipv6=ipv6)
+        link_id = "tap-bench-%d" % index
+        network_data["links"].append({
+            "id": link_id,
+            "type": "ovs",
+            "mtu": 1450,
+            "ethernet_mac_address": nic_config["mac_address"],
+        })
+
+        # As in OpenStack, every subnet with a gateway has a default route,
+        # the first one (the primary NIC) is used
+        routes = [{
+            "network": "0.0.0.0",
+            "netmask": "0.0.0.0",
+            "gateway": nic_config["ipv4_gateway"],
+        }, {
+            "network": "10.%d.0.0" % (200 + index),
+            "netmask": "255.255.255.0",
+            "gateway": nic_config["ipv4_gateway"],
+        }]
+        network_data["networks"].append({
+            "id": "network%d" % index,
+            "link": link_id,
+            "type": "ipv4",
+            "ip_address": nic_config["ipv4_address"],
+            "netmask": "255.255.255.0",
+            "routes": routes,
+            "services": [{"type": "dns", "address": "10.100.0.53"}],
+        })
+
+        if ipv6:
+            network_data["networks"].append({
+                "id": "network%d-v6" % index,
+                "link": link_id,
+                "type": "ipv6",
+                "ip_address": nic_config["ipv6_address"],
+                "netmask": "ffff:ffff:ffff:ffff::",
+                "routes": [{
+                    "network": "::",
+                    "netmask": "::",
+                    "gateway": nic_config["ipv6_gateway"],
+                }],
+                "services": [],
+            })
+    return network_data
+
+
+def get_probe_spec(nics, ipv6=True):
+    """Return what the probe checks for the VM to be ready"""
+    spec = {"addresses": [], "routes": [], "gateways": []}
+    for index in nics:
+        nic_config = get_nic_config(index, ipv6=ipv6)
+        spec["addresses"].append(nic_config["ipv4_address"])
+        spec["routes"].append(["4", nic_config["ipv4_route"]])
+        spec["gateways"].append(nic_config["ipv4_gateway"])
+        if ipv6:
+            spec["addresses"].append(nic_config["ipv6_address"])
+            spec["gateways"].append(nic_config["ipv6_gateway"])
+        if index == PRIMARY_NIC:
+            spec["routes"].append(["4", "default"])
+            if ipv6:
+                spec["routes"].append(["6", "default"])
+    return spec
+
+
+class MetadataHandler(server.SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DualStackHTTPServer(server.ThreadingHTTPServer):
+    address_family = socket.AF_INET6
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+        super(DualStackHTTPServer, self).server_bind()
+
+
+def serve(directory, port):
+    """Serve the metadata directory on all the cloud namespace addresses
+
+    The gateway reachability is checked with a TCP connect to this server.
+    """
+    os.chdir(directory)
+    httpd = DualStackHTTPServer(("::", port), MetadataHandler)
+    httpd.serve_forever()
+
+
+def get_ready_state(namespace=None, tentative=False):
+    """Return the addresses and the (family, destination) routes
+
+    The tentative addresses are not usable yet and are skipped, unless
+    requested.
+    """
+    ip_cmd = ["ip"]
+    if namespace:
+        ip_cmd += ["-n", namespace]
+    addresses = set()
+    for addr in json.loads(run(ip_cmd + ["-j", "addr", "show"]).stdout):
+        for addr_info in addr.get("addr_info", []):
+            if tentative or not addr_info.get("tentative"):
+                addresses.add(addr_info["local"])
+
+    routes = set()
+    for family in ("4", "6"):
+        for route in json.loads(run(
+                ip_cmd + ["-j", "-%s" % family, "route", "show"]).stdout):
+            routes.add((family, route["dst"]))
+    return addresses, routes
+
+
+def is_gateway_reachable(gateway, port):
+    family = socket.AF_INET
+    if ":" in gateway:
+        family = socket.AF_INET6
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(PROBE_CONNECT_TIMEOUT)
+    try:
+        sock.connect((gateway, port))
+        return True
+    except (socket.error, socket.timeout):
+        return False
+    finally:
+        sock.close()
+
+
+def probe(spec, timeout, port):
+    """Wait for the VM to be ready, print the monotonic ready time
+
+    Runs in the "vm" namespace. The monotonic clock is shared by all the
+    processes of the host, so the time can be compared with the event time.
+    """
+    print("probing", flush=True)
+    deadline = time.monotonic() + timeout
+    required_routes = set(tuple(route) for route in spec["routes"])
+    reachable = set()
+    while time.monotonic() < deadline:
+        addresses, routes = get_ready_state()
+        if (set(spec["addresses"]) <= addresses and
+                required_routes <= routes):
+            for gateway in spec["gateways"]:
+                if (gateway not in reachable and
+                        is_gateway_reachable(gateway, port)):
+                    reachable.add(gateway)
+            if reachable == set(spec["gateways"]):
+                print(time.monotonic(), flush=True)
+                return 0
+        time.sleep(PROBE_INTERVAL)
+    print("timeout", flush=True)
+    return 1
+
+
+class BenchEnvironment(object):
+
+    def __init__(self, max_nics, ipv6=True, port=80):
+        self.max_nics = max_nics
+        self.ipv6 = ipv6
+        self.port = port
+        self.work_dir = tempfile.mkdtemp(prefix="osnd-bench-")
+        self.metadata_dir = os.path.join(self.work_dir, "metadata")
+        self.shim_dir = os.path.join(self.work_dir, "bin")
+        self.server = None
+        self.vm_nics = set()
+        # [(dir, upper dir, work dir)] of the current VM root
+        self.overlays = []
+        self.run_dir = None
+
+    def setup(self):
+        self.teardown_namespaces()
+        run(["ip", "netns", "add", CLOUD_NS])
+        run(["ip", "netns", "add", VM_NS])
+
+        cloud_cmds = ["link set lo up",
+                      "addr add %s/32 dev lo" % METADATA_IP]
+        for index in range(self.max_nics + 1):
+            nic_config = get_nic_config(index, ipv6=self.ipv6)
+            cloud_nic, vm_nic = nic_names(index)
+            run(["ip", "-n", CLOUD_NS, "link", "add", cloud_nic, "type",
+                 "veth", "peer", "name", vm_nic, "address",
+                 nic_config["mac_address"]])
+            cloud_cmds += [
+                "link set %s up" % cloud_nic,
+                "addr add %s/24 dev %s" % (
+                    nic_config["ipv4_gateway"], cloud_nic),
+            ]
+            if self.ipv6:
+                cloud_cmds += ["addr add %s/64 dev %s nodad" % (
+                    nic_config["ipv6_gateway"], cloud_nic)]
+        ip_batch(CLOUD_NS, cloud_cmds)
+        run(["ip", "netns", "exec", CLOUD_NS, "sysctl", "-qw",
+             "net.ipv6.conf.all.forwarding=1"])
+
+        # The primary NIC, carrying the metadata route, is always present
+        primary = get_nic_config(PRIMARY_NIC, ipv6=self.ipv6)
+        self.add_nics([PRIMARY_NIC])
+        ip_batch(VM_NS, [
+            "link set lo up",
+            "link set %s up" % nic_names(PRIMARY_NIC)[1],
+            "addr add %s/24 dev %s" % (
+                primary["ipv4_address"], nic_names(PRIMARY_NIC)[1]),
+            "route add default via %s" % primary["ipv4_gateway"],
+        ])
+
+        os.makedirs(os.path.join(self.metadata_dir, "openstack", "latest"))
+        os.makedirs(os.path.join(self.metadata_dir, "openstack", "content"))
+        os.makedirs(self.shim_dir)
+        for service_manager in SERVICE_MANAGERS:
+            shim_path = os.path.join(self.shim_dir, service_manager)
+            with open(shim_path, "w") as shim:
+                shim.write(SERVICE_MANAGER_SHIM)
+            os.chmod(shim_path, 0o755)
+
+        self.server = subprocess.Popen(
+            ["ip", "netns", "exec", CLOUD_NS, sys.executable,
+             os.path.abspath(__file__), "--serve", self.metadata_dir,
+             "--port", str(self.port)])
+
+    def teardown_namespaces(self):
+        for namespace in (VM_NS, CLOUD_NS):
+            run(["ip", "netns", "del", namespace], check=False)
+
+    def teardown(self):
+        if self.server:
+            self.server.kill()
+            self.server.wait()
+        self.teardown_namespaces()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def set_metadata(self, nics):
+        network_data = get_network_data(sorted(nics), ipv6=self.ipv6)
+        network_data_path = os.path.join(self.metadata_dir, "openstack",
+                                         "latest", "network_data.json")
+        with open(network_data_path + ".tmp", "w") as network_data_file:
+            json.dump(network_data, network_data_file)
+        os.rename(network_data_path + ".tmp", network_data_path)
+        return network_data
+
+    def add_nics(self, nics):
+        ip_batch(CLOUD_NS, ["link set %s netns %s" % (nic_names(index)[1],
+                                                      VM_NS)
+                            for index in nics])
+        self.vm_nics.update(nics)
+
+    def remove_nics(self, nics):
+        # Moving the device out of the namespace is seen as a removal
+        ip_batch(VM_NS, ["link set %s netns %s" % (nic_names(index)[1],
+                                                   CLOUD_NS)
+                         for index in nics])
+        self.vm_nics.difference_update(nics)
+
+    def start_probe(self, nics, timeout):
+        spec = get_probe_spec(sorted(nics), ipv6=self.ipv6)
+        p = subprocess.Popen(
+            ["ip", "netns", "exec", VM_NS, sys.executable,
+             os.path.abspath(__file__), "--probe", json.dumps(spec),
+             "--timeout", str(timeout), "--port", str(self.port)],
+            stdout=subprocess.PIPE, universal_newlines=True)
+        # Wait for the probe to be started, before the event
+        p.stdout.readline()
+        return p
+
+    def new_vm_root(self):
+        """Give the next tool runs an empty private /etc, /var/lib and /run
+
+        The upper dirs of the overlays keep only what the tools write.
+        """
+        self.overlays = []
+        for overlay_dir in OVERLAY_DIRS:
+            self.overlays.append((overlay_dir,
+                                  tempfile.mkdtemp(dir=self.work_dir),
+                                  tempfile.mkdtemp(dir=self.work_dir)))
+        self.run_dir = tempfile.mkdtemp(dir=self.work_dir)
+
+    def get_tool_cmd(self, tool, renderer, network_data, action, nic):
+        # "ip netns exec" runs the command in its own mount namespace
+        mounts = ["mount --bind %s /run" % self.run_dir]
+        for overlay_dir, upper_dir, work_dir in self.overlays:
+            mounts.append(
+                "mount -t overlay overlay -o lowerdir=%s,upperdir=%s,"
+                "workdir=%s %s" % (overlay_dir, upper_dir, work_dir,
+                                   overlay_dir))
+        cmd = ["ip", "netns", "exec", VM_NS, "sh", "-c",
+               '%s && exec "$@"' % " && ".join(mounts), "sh", "env",
+               "PATH=%s:%s" % (self.shim_dir, os.environ.get("PATH", "")),
+               "ACTION=%s" % action, "ID_NET_NAME=%s" % nic,
+               "INTERFACE=%s" % nic]
+        if tool == "cloud-init":
+            return cmd + [sys.executable, CLOUD_INIT_APPLY_NET]
+
+        cmd += [sys.executable, APPLY_NETWORKING_LINUX, "--renderer",
+                renderer]
+        if action == "remove":
+            # The removal events drop the link without the network data
+            return cmd
+        b64_network_data = base64.b64encode(
+            json.dumps(network_data).encode()).decode()
+        return cmd + ["--no-plan-cache", b64_network_data]
+
+    def run_tool(self, tool, renderer, network_data, action, nic, timeout):
+        tool_cmd = self.get_tool_cmd(tool, renderer, network_data, action,
+                                     nic)
+        return run(tool_cmd, check=False, timeout=timeout)
+
+    def run_events(self, tool, renderer, network_data, action, nics,
+                   timeout):
+        """Run the tool for each NIC event, one after the other
+
+        Return the exit code and the stderr of the first failed event.
+        """
+        deadline = time.monotonic() + timeout
+        for index in sorted(nics):
+            tool_process = self.run_tool(
+                tool, renderer, network_data, action, nic_names(index)[1],
+                deadline - time.monotonic())
+            if tool_process.returncode:
+                return tool_process.returncode, tool_process.stderr
+        return 0, None
+
+    def get_removal_errors(self, nics):
+        """Return what is left in the VM of the removed NICs"""
+        errors = []
+        addresses, routes = get_ready_state(VM_NS, tentative=True)
+        for index in nics:
+            nic_config = get_nic_config(index, ipv6=self.ipv6)
+            for address in (nic_config["ipv4_address"],
+                            nic_config["ipv6_address"]):
+                if address in addresses:
+                    errors.append("address %s is still present" % address)
+            if ("4", nic_config["ipv4_route"]) in routes:
+                errors.append("route %s is still present" %
+                              nic_config["ipv4_route"])
+
+        # The config files written by the tools, the whiteouts of the
+        # removed files are not regular files
+        etc_upper_dir = self.overlays[OVERLAY_DIRS.index("/etc")][1]
+        for dir_path, _, file_names in os.walk(etc_upper_dir):
+            for file_name in file_names:
+                file_path = os.path.join(dir_path, file_name)
+                if (os.path.islink(file_path) or
+                        not os.path.isfile(file_path)):
+                    continue
+                with open(file_path, errors="replace") as config_file:
+                    content = config_file.read()
+                config_path = os.path.join(
+                    "/etc", os.path.relpath(file_path, etc_upper_dir))
+                for index in nics:
+                    for token in (nic_names(index)[1],
+                                  MAC_ADDRESS_TEMPLATE % index):
+                        if token in content or token in file_name:
+                            errors.append("%s still has %s" % (config_path,
+                                                               token))
+        return errors
+
+    def run_event(self, scenario, nics, tool, renderer, timeout):
+        """Run an add or remove event burst, return the measured times"""
+        if scenario == "add":
+            ready_nics = set([PRIMARY_NIC]) | set(nics)
+        else:
+            ready_nics = set([PRIMARY_NIC])
+        network_data = self.set_metadata(ready_nics)
+
+        probe = None
+        if scenario == "add":
+            probe = self.start_probe(ready_nics, timeout)
+
+        event_time = time.monotonic()
+        if scenario == "add":
+            self.add_nics(nics)
+        else:
+            self.remove_nics(nics)
+
+        tool_start = time.monotonic()
+        exit_code, tool_error = self.run_events(
+            tool, renderer, network_data, scenario, nics, timeout)
+        tool_end = time.monotonic()
+
+        if probe is None:
+            # The remaining NICs are ready before the removal, check that
+            # the tool left them ready
+            probe = self.start_probe(ready_nics, timeout)
+        ready_line = probe.communicate()[0].strip()
+
+        result = {
+            "tool_exit_code": exit_code,
+            "tool_start": tool_start - event_time,
+            "tool_time": tool_end - tool_start,
+            "latency": None,
+        }
+        if exit_code:
+            result["tool_error"] = tool_error[-2000:]
+        if scenario == "remove":
+            result["removal_errors"] = self.get_removal_errors(nics)
+        if ready_line != "timeout":
+            result["latency"] = max(float(ready_line), tool_end) - event_time
+        return result
+
+    def reset(self):
+        """Bring the VM back to the primary NIC only, with a new VM root"""
+        extra_nics = self.vm_nics - set([PRIMARY_NIC])
+        if extra_nics:
+            self.remove_nics(extra_nics)
+        self.new_vm_root()
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile"""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = max(int(round(percent / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def format_ms(value):
+    if value is None:
+        return "-"
+    return "%.1f" % (value * 1000)
+
+
+def run_benchmark(args):
+    results = []
+    env = BenchEnvironment(max(args.nics), ipv6=args.ipv6, port=args.port)
+    try:
+        env.setup()
+        for tool in args.tool:
+            renderers = args.renderer
+            if tool == "cloud-init":
+                renderers = ["cloud-init"]
+            for renderer in renderers:
+                for nics_count in args.nics:
+                    nics = list(range(1, nics_count + 1))
+                    latencies = []
+                    failures = 0
+                    for _ in range(args.runs):
+                        env.reset()
+                        if args.scenario == "remove":
+                            env.add_nics(nics)
+                            network_data = env.set_metadata(
+                                [PRIMARY_NIC] + nics)
+                            env.run_events(tool, renderer, network_data,
+                                           "add", nics, args.timeout)
+                        result = env.run_event(args.scenario, nics, tool,
+                                               renderer, args.timeout)
+                        if (result["latency"] is None or
+                                result["tool_exit_code"] or
+                                result.get("removal_errors")):
+                            failures += 1
+                        else:
+                            latencies.append(result["latency"])
+                        result.update({"tool": tool, "renderer": renderer,
+                                       "nics": nics_count,
+                                       "scenario": args.scenario})
+                        results.append(result)
+                    print("%-24s %-10s %4d %5d %9s %9s %9s %9s %8d" % (
+                        tool, renderer, nics_count, args.runs,
+                        format_ms(percentile(latencies, 50)),
+                        format_ms(percentile(latencies, 90)),
+                        format_ms(percentile(latencies, 99)),
+                        format_ms(max(latencies) if latencies else None),
+                        failures), flush=True)
+    finally:
+        env.teardown()
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measures the NIC hotplug event to network ready "
+                    "latency in network namespaces")
+    parser.add_argument("--tool", choices=TOOLS, action="append",
+                        help="Tool to benchmark, can be repeated "
+                             "(default: apply-networking-linux)")
+    parser.add_argument("--renderer", choices=RENDERERS, action="append",
+                        help="apply-networking-linux renderer, can be "
+                             "repeated (default: eni)")
+    parser.add_argument("--nics", default="1,4,8,16",
+                        help="Comma separated NIC counts of the bursts")
+    parser.add_argument("--runs", type=int, default=10,
+                        help="Runs for each NIC count")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="add")
+    parser.add_argument("--no-ipv6", dest="ipv6", action="store_false",
+                        help="Do not configure IPv6 networks")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="Maximum time in seconds for a run")
+    parser.add_argument("--port", type=int, default=80,
+                        help="Metadata service port in the cloud namespace")
+    parser.add_argument("--json", dest="json_path",
+                        help="Write the results of all the runs to a file")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.nics = [int(nics) for nics in args.nics.split(",")]
+    args.tool = args.tool or ["apply-networking-linux"]
+    args.renderer = args.renderer or ["eni"]
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.serve:
+        serve(args.serve, args.port)
+        return 0
+    if args.probe:
+        return probe(json.loads(args.probe), args.timeout, args.port)
+
+    if os.geteuid() != 0:
+        print("The benchmark needs to run as root")
+        return 1
+
+    print("%-24s %-10s %4s %5s %9s %9s %9s %9s %8s" % (
+        "tool", "renderer", "nics", "runs", "p50(ms)", "p90(ms)", "p99(ms)",
+        "max(ms)", "failures"))
+    results = run_benchmark(args)
+    if args.json_path:
+        with open(args.json_path, "w") as json_file:
+            json.dump(results, json_file, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())